@@ -0,0 +1,245 @@
+import json
+from langchain_core.prompts import ChatPromptTemplate
+
+from utils.llm import invoke_chain, ainvoke_chain
+from utils.state import InterviewState
+from utils.context import fit_fields
+from utils.resilience import DeadlineExceeded, CircuitOpenError, degraded, fell_back
+from utils.structured import count_parse, extract_object
+from agents.observer import skip_analysis, fast_analysis, observer_update, FALLBACK_ANALYSIS, SKIPPED_ANALYSIS
+from agents.expert import expert_update, FALLBACK_PLAN, DEGRADED_PLAN
+from agents.interviewer import greeting_rule_for, interviewer_update, FALLBACK_REPLY
+
+# Объединенный узел Observer + Expert (режим "fused") и Observer + Expert + Interviewer
+# (режим "single"): один структурированный вызов вместо двух-трех подряд.
+# Заполняет те же поля state, что и отдельные узлы, поэтому формат лога не меняется.
+
+# --- ПРОМПТ ---
+BASE_PROMPT = """
+Ты совмещаешь две роли на техническом интервью: Наблюдатель (Observer) и Технический Лид (Expert).
+
+КОНТЕКСТ:
+- Кандидат: {name} ({level} {role})
+- Стек: {stack}
+- Прошлый вопрос бота: "{last_bot_msg}"
+- Обсужденные темы: {covered_topics}
+
+ШАГ 1. НАБЛЮДАТЕЛЬ — проанализируй последний ответ кандидата и выставь флаги:
+1. is_hallucination: True, если выдумал факты/библиотеки.
+2. consistency_violation: True, если противоречит себе или грейду.
+3. is_deep_dive: True, если уходит в дебри не по теме.
+4. is_role_reversal: True, если задает встречные вопросы/перехватывает инициативу.
+5. intent_to_leave: True, если пишет "Стоп", "Хватит", "Закончим" или по-другому открыто проявляет желание остановить интервью.
+
+ШАГ 2. ЭКСПЕРТ — на основе флагов из шага 1 составь план:
+1. ПРОВЕРКА НА СТАРТ: Если прошлый вопрос бота похож на "Intro", "Начало" или "Intro Message":
+   - НЕ ОЦЕНИВАЙ ОТВЕТ и игнорируй флаги, сразу задай первый вводный вопрос по заявленному стеку.
+2. ЕСЛИ ЭТО НЕ СТАРТ (ОБЫЧНЫЙ ХОД):
+   - Если есть флаг Hallucination -> Инструкция: "Опровергни факт и спроси источник."
+   - Если есть флаг Stop -> Инструкция: "Заверши интервью." (Topic: Conclusion)
+   - Если ответ ХОРОШИЙ -> ВЫБЕРИ НОВУЮ ТЕМУ. Не спрашивай одно и то же!
+   - Если ответ СЛАБЫЙ -> Задай уточняющий вопрос.
+"""
+
+REPLY_RULES = """
+ШАГ 3. ИНТЕРВЬЮЕР (Технический рекрутер Алиса) — перефразируй инструкцию из шага 2 в живую реплику:
+1. {greeting_rule}
+2. Каждое сообщение (кроме прощания) ДОЛЖНО заканчиваться вопросительным предложением.
+3. Не читай лекции, будь лаконична (2-3 предложения), тон профессиональный, но дружелюбный.
+4. Если инструкция говорит завершить — попрощайся.
+5. Язык: Русский
+"""
+
+OUTPUT_HEAD = """
+ФОРМАТ ВЫВОДА (ТОЛЬКО ЧИСТЫЙ JSON, БЕЗ MARKDOWN):
+{{
+    "observer": {{
+        "thoughts": "Твой краткий анализ на русском (макс 4 предл).",
+        "is_hallucination": false,
+        "consistency_violation": false,
+        "is_deep_dive": false,
+        "is_role_reversal": false,
+        "intent_to_leave": false,
+        "answer_quality": "medium"
+    }},
+    "expert": {{
+        "thoughts": "Твои мысли (макс 3 предл).",
+        "instruction": "Что именно спросить у кандидата (прямая речь для интервьюера).",
+        "topic_name": "Название темы (например: 'SQL Joins' или 'Global Lock').",
+        "difficulty_adjustment": "same"
+    }}"""
+
+HUMAN_PROMPT = "Ответ кандидата: {last_user_msg}\n\nJSON:"
+
+FUSED_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", BASE_PROMPT + OUTPUT_HEAD + "\n}}\n"),
+    ("human", HUMAN_PROMPT)
+])
+
+SINGLE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", BASE_PROMPT + REPLY_RULES + OUTPUT_HEAD + ',\n    "reply": "Реплика Алисы для кандидата."\n}}\n'),
+    ("human", HUMAN_PROMPT)
+])
+
+
+def analyst_inputs(state: InterviewState, node="analyst"):
+    """Переменные объединенного промпта из state."""
+    messages = state['messages']
+    candidate_info = state.get('candidate_info', {})
+
+    inputs = {
+        "name": candidate_info.get('name', 'Candidate'),
+        "level": candidate_info.get('level', 'Junior'),
+        "role": candidate_info.get('role', 'Developer'),
+        "stack": candidate_info.get('stack', 'General'),
+        "covered_topics": ", ".join(state.get('topics_covered', [])),
+        "last_bot_msg": messages[-2].content if len(messages) > 1 else "Intro",
+        "last_user_msg": messages[-1].content,
+        "greeting_rule": greeting_rule_for(messages)
+    }
+    return fit_fields(node, inputs, ("covered_topics", "last_bot_msg", "last_user_msg"))
+
+
+def parse_result(node, raw_response):
+    """Вложенный JSON аналитика; неразобранный ответ — пустой dict (дальше сработают fallback-и)."""
+    # ДЕБАГ: Видим, что ответила модель на самом деле
+    print(f"🔧 Analyst Raw Output: {raw_response[:100]}...")
+
+    try:
+        result = json.loads(extract_object(raw_response))
+    except ValueError as e:
+        print(f"❌ Analyst JSON Error: {e}")
+        result = None
+    if not isinstance(result, dict):
+        count_parse(node, "failed")
+        fell_back(node)
+        return {}
+    count_parse(node, "ok")
+    return result
+
+
+# Реплика режима "single", когда на вызов LLM не осталось времени хода или провайдеры отключены
+DEGRADED_REPLY = "Приведите, пожалуйста, практический пример к своему последнему ответу."
+
+
+def degraded_result():
+    """Результат без LLM (дедлайн, отключенные провайдеры) — как у Observer и Expert по отдельности."""
+    return {"observer": dict(SKIPPED_ANALYSIS), "expert": dict(DEGRADED_PLAN), "reply": DEGRADED_REPLY}
+
+
+def _analyst_update(state: InterviewState, result):
+    """Раскладывает объединенный JSON по полям state так же, как Observer и Expert."""
+    # Холодный старт и пустой ввод Observer не анализирует — берем его заглушку
+    skipped = skip_analysis(state)
+    if skipped is not None:
+        observer_part = skipped
+    else:
+        analysis = result.get('observer')
+        observer_part = observer_update(analysis if isinstance(analysis, dict) else dict(FALLBACK_ANALYSIS))
+
+    expert_plan = result.get('expert')
+    if not isinstance(expert_plan, dict) or 'instruction' not in expert_plan:
+        expert_plan = dict(FALLBACK_PLAN)
+
+    expert_part = expert_update(
+        state,
+        expert_plan,
+        observer_part['observer_analysis'],
+        observer_part['current_turn_thoughts']
+    )
+    return {**observer_part, **expert_part}
+
+
+def _single_update(state: InterviewState, result):
+    update = _analyst_update(state, result)
+
+    # Без реплики отдаем инструкцию эксперта как есть: она уже написана прямой речью
+    response_text = result.get('reply') or update['expert_plan'].get('instruction', FALLBACK_REPLY)
+    # План нужен интервьюеру в state: на старте вступление уходит в банк (utils.openers)
+    update.update(interviewer_update({**state, "expert_plan": update['expert_plan']}, response_text, update['current_turn_thoughts']))
+    return update
+
+
+def fast_stop(state: InterviewState):
+    """
+    Просьба остановиться распознана локально: Expert не нужен, граф сразу уйдет в farewell.
+    Остальные fast-path случаи в режиме fused все равно требуют плана Expert, поэтому идут в LLM.
+    """
+    if skip_analysis(state) is not None:
+        return None
+    quick = fast_analysis(state, stop_only=True)
+    return observer_update(quick) if quick is not None else None
+
+
+def analyst_node(state: InterviewState):
+    """Режим "fused": Observer + Expert за один вызов, реплику пишет interviewer_node."""
+    print("--- Analyst Working (Observer + Expert) ---")
+
+    stopped = fast_stop(state)
+    if stopped is not None:
+        return stopped
+
+    try:
+        result = parse_result("analyst", invoke_chain("analyst", FUSED_PROMPT, analyst_inputs(state)))
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        degraded("analyst", e)
+        result = degraded_result()
+    except Exception as e:
+        print(f"❌ Analyst Error: {e}")
+        fell_back("analyst")
+        result = {}
+
+    return _analyst_update(state, result)
+
+
+async def aanalyst_node(state: InterviewState):
+    print("--- Analyst Working (Observer + Expert, async) ---")
+
+    stopped = fast_stop(state)
+    if stopped is not None:
+        return stopped
+
+    try:
+        result = parse_result("analyst", await ainvoke_chain("analyst", FUSED_PROMPT, analyst_inputs(state)))
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        degraded("analyst", e)
+        result = degraded_result()
+    except Exception as e:
+        print(f"❌ Analyst Error: {e}")
+        fell_back("analyst")
+        result = {}
+
+    return _analyst_update(state, result)
+
+
+def analyst_single_node(state: InterviewState):
+    """Режим "single": Observer + Expert + Interviewer за один вызов на ход."""
+    print("--- Analyst Working (Observer + Expert + Interviewer) ---")
+
+    try:
+        result = parse_result("analyst_single", invoke_chain("analyst_single", SINGLE_PROMPT, analyst_inputs(state, "analyst_single")))
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        degraded("analyst_single", e)
+        result = degraded_result()
+    except Exception as e:
+        print(f"❌ Analyst Error: {e}")
+        fell_back("analyst_single")
+        result = {}
+
+    return _single_update(state, result)
+
+
+async def aanalyst_single_node(state: InterviewState):
+    print("--- Analyst Working (Observer + Expert + Interviewer, async) ---")
+
+    try:
+        result = parse_result("analyst_single", await ainvoke_chain("analyst_single", SINGLE_PROMPT, analyst_inputs(state, "analyst_single")))
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        degraded("analyst_single", e)
+        result = degraded_result()
+    except Exception as e:
+        print(f"❌ Analyst Error: {e}")
+        fell_back("analyst_single")
+        result = {}
+
+    return _single_update(state, result)
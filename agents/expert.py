@@ -1,29 +1,79 @@
 import json
-import re
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
-from utils.llm import get_llm
+from utils.structured import invoke_structured, ainvoke_structured
+from utils.schemas import ExpertPlan
 from utils.state import InterviewState
+from utils.context import fit_fields
+from utils.resilience import DeadlineExceeded, CircuitOpenError, budget_exhausted, degraded, fell_back
 
-def expert_node(state: InterviewState):
-    print("--- Expert Working ---") 
-    
-    llm = get_llm()
+# --- ПРОМПТ ---
+SYSTEM_PROMPT = """
+Ты — Технический Лид (Expert). 
+
+ТВОЯ ЦЕЛЬ: Сформировать JSON с планом действий.
+
+КОНТЕКСТ:
+- Стек: {stack} ({level})
+- Прошлый вопрос бота: "{last_bot_msg}"
+- Обсужденные темы: {covered_topics}
+
+ОТЧЕТ НАБЛЮДАТЕЛЯ:
+{observer_report}
+
+ИНСТРУКЦИЯ:
+1. ПРОВЕРКА НА СТАРТ: Если прошлый вопрос бота похож на "Intro", "Начало" или "Intro Message":
+   - НЕ ОЦЕНИВАЙ ОТВЕТ (так как кандидат только подтвердил готовность).
+   - Игнорируй флаги наблюдателя на этом шаге.
+   - Твоя задача: Сразу задать первый вводный вопрос по заявленному стеку.
+
+2. ЕСЛИ ЭТО НЕ СТАРТ (ОБЫЧНЫЙ ХОД):
+   - Если есть флаг Hallucination -> Инструкция: "Опровергни факт и спроси источник."
+   - Если есть флаг Stop -> Инструкция: "Заверши интервью." (Topic: Conclusion)
+   - Если ответ ХОРОШИЙ -> ВЫБЕРИ НОВУЮ ТЕМУ. Не спрашивай одно и то же!
+   - Если ответ СЛАБЫЙ -> Задай уточняющий вопрос.
+
+ФОРМАТ ВЫВОДА (ТОЛЬКО ЧИСТЫЙ JSON, БЕЗ MARKDOWN):
+{{
+    "thoughts": "Твои мысли (макс 3 предл).",
+    "instruction": "Что именно спросить у кандидата (прямая речь для интервьюера).",
+    "topic_name": "Название темы (например: 'SQL Joins' или 'Global Lock').",
+    "difficulty_adjustment": "same"
+}}
+"""
+
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", "Ответ кандидата: {last_user_msg}")
+])
+
+# План на случай, если JSON не удалось получить
+FALLBACK_PLAN = {
+    "thoughts": "Ошибка парсинга. Меняю тему принудительно.",
+    "instruction": "Ответ принят. Давайте перейдем к следующей теме. Расскажите, что вы знаете про базы данных?",
+    "topic_name": "Emergency Topic",
+    "difficulty_adjustment": "same"
+}
+
+
+# План без Expert, когда на него не осталось времени хода: уточнение по текущей теме
+# ("Current Topic" не попадает в список пройденных тем)
+DEGRADED_PLAN = {
+    "thoughts": "Бюджет времени хода исчерпан, план без анализа: уточняю текущую тему.",
+    "instruction": "Попроси кандидата привести практический пример к своему последнему ответу.",
+    "topic_name": "Current Topic",
+    "difficulty_adjustment": "same"
+}
+
+
+def expert_inputs(state: InterviewState):
+    """Переменные промпта эксперта из state."""
     messages = state['messages']
     
     # --- ИЗВЛЕЧЕНИЕ ДАННЫХ ---
     candidate_info = state.get('candidate_info', {})
-    stack = candidate_info.get('stack', 'General')
-    level = candidate_info.get('level', 'Junior')
-    
     covered_topics = state.get('topics_covered', [])
     observer_analysis = state.get('observer_analysis', {})
-    current_thoughts = state.get('current_turn_thoughts', [])
-    
-    # Контекст
-    last_user_msg = messages[-1].content
-    last_bot_msg = messages[-2].content if len(messages) > 1 else "Intro"
 
     # --- ПОДГОТОВКА JSON OBSERVER ---
     try:
@@ -31,78 +81,68 @@ def expert_node(state: InterviewState):
     except:
         observer_json_str = "Анализ недоступен"
 
-    # --- ПРОМПТ ---
-    system_prompt = """
-    Ты — Технический Лид (Expert). 
-    
-    ТВОЯ ЦЕЛЬ: Сформировать JSON с планом действий.
-    
-    КОНТЕКСТ:
-    - Стек: {stack} ({level})
-    - Прошлый вопрос бота: "{last_bot_msg}"
-    - Обсужденные темы: {covered_topics}
-    
-    ОТЧЕТ НАБЛЮДАТЕЛЯ:
-    {observer_report}
-
-    ИНСТРУКЦИЯ:
-    1. ПРОВЕРКА НА СТАРТ: Если прошлый вопрос бота похож на "Intro", "Начало" или "Intro Message":
-       - НЕ ОЦЕНИВАЙ ОТВЕТ (так как кандидат только подтвердил готовность).
-       - Игнорируй флаги наблюдателя на этом шаге.
-       - Твоя задача: Сразу задать первый вводный вопрос по заявленному стеку.
-
-    2. ЕСЛИ ЭТО НЕ СТАРТ (ОБЫЧНЫЙ ХОД):
-       - Если есть флаг Hallucination -> Инструкция: "Опровергни факт и спроси источник."
-       - Если есть флаг Stop -> Инструкция: "Заверши интервью." (Topic: Conclusion)
-       - Если ответ ХОРОШИЙ -> ВЫБЕРИ НОВУЮ ТЕМУ. Не спрашивай одно и то же!
-       - Если ответ СЛАБЫЙ -> Задай уточняющий вопрос.
-
-    ФОРМАТ ВЫВОДА (ТОЛЬКО ЧИСТЫЙ JSON, БЕЗ MARKDOWN):
-    {{
-        "thoughts": "Твои мысли (макс 3 предл).",
-        "instruction": "Что именно спросить у кандидата (прямая речь для интервьюера).",
-        "topic_name": "Название темы (например: 'SQL Joins' или 'Global Lock').",
-        "difficulty_adjustment": "same"
-    }}
-    """
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", "Ответ кандидата: {last_user_msg}")
-    ])
-
-    # Используем StrOutputParser (получаем просто строку), а не JsonOutputParser
-    chain = prompt | llm | StrOutputParser()
+    inputs = {
+        "level": candidate_info.get('level', 'Junior'),
+        "stack": candidate_info.get('stack', 'General'),
+        "covered_topics": ", ".join(covered_topics),
+        "observer_report": observer_json_str,
+        "last_bot_msg": messages[-2].content if len(messages) > 1 else "Intro",
+        "last_user_msg": messages[-1].content
+    }
+    return fit_fields("expert", inputs, ("covered_topics", "last_bot_msg", "last_user_msg"))
+
+
+def plan_ready(fields):
+    """Интервьюеру нужны только instruction и topic_name — хвост ответа можно не ждать."""
+    return bool(fields.get("instruction")) and bool(fields.get("topic_name"))
+
+
+def expert_node(state: InterviewState):
+    print("--- Expert Working ---") 
+
+    if budget_exhausted("expert"):
+        return expert_update(state, dict(DEGRADED_PLAN), state.get('observer_analysis', {}), state.get('current_turn_thoughts', []))
 
     try:
-        # Вызываем модель
-        raw_response = chain.invoke({
-            "level": level,
-            "stack": stack,
-            "covered_topics": ", ".join(covered_topics),
-            "observer_report": observer_json_str,
-            "last_bot_msg": last_bot_msg,
-            "last_user_msg": last_user_msg
-        })
-        
-        # ДЕБАГ: Видим, что ответила модель на самом деле
-        print(f"🔧 Expert Raw Output: {raw_response[:100]}...") 
+        expert_plan = invoke_structured("expert", PROMPT, expert_inputs(state), ExpertPlan, stop_when=plan_ready)
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        degraded("expert", e)
+        expert_plan = dict(DEGRADED_PLAN)
+    except Exception as e:
+        print(f"❌ Expert Error: {e}")
+        expert_plan = None
+    # Если всё сломалось, явно говорим интервьюеру сменить тему
+    if not expert_plan:
+        fell_back("expert")
+        expert_plan = dict(FALLBACK_PLAN)
 
-        # --- РУЧНАЯ ЧИСТКА JSON ---
-        # Удаляем ```json и ``` если они есть
-        cleaned_json = raw_response.replace("```json", "").replace("```", "").strip()
-        
-        expert_plan = json.loads(cleaned_json)
+    return expert_update(state, expert_plan, state.get('observer_analysis', {}), state.get('current_turn_thoughts', []))
+
+
+async def aexpert_node(state: InterviewState):
+    print("--- Expert Working (async) ---")
 
+    if budget_exhausted("expert"):
+        return expert_update(state, dict(DEGRADED_PLAN), state.get('observer_analysis', {}), state.get('current_turn_thoughts', []))
+
+    try:
+        expert_plan = await ainvoke_structured("expert", PROMPT, expert_inputs(state), ExpertPlan, stop_when=plan_ready)
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        degraded("expert", e)
+        expert_plan = dict(DEGRADED_PLAN)
     except Exception as e:
-        print(f"❌ Expert JSON Error: {e}")
-        # Если всё сломалось, явно говорим интервьюеру сменить тему
-        expert_plan = {
-            "thoughts": "Ошибка парсинга. Меняю тему принудительно.",
-            "instruction": "Ответ принят. Давайте перейдем к следующей теме. Расскажите, что вы знаете про базы данных?",
-            "topic_name": "Emergency Topic",
-            "difficulty_adjustment": "same"
-        }
+        print(f"❌ Expert Error: {e}")
+        expert_plan = None
+    if not expert_plan:
+        fell_back("expert")
+        expert_plan = dict(FALLBACK_PLAN)
+
+    return expert_update(state, expert_plan, state.get('observer_analysis', {}), state.get('current_turn_thoughts', []))
+
+
+def expert_update(state: InterviewState, expert_plan, observer_analysis, current_thoughts):
+    """Собирает обновление state из плана эксперта: мысли, новые темы и флаг завершения."""
+    covered_topics = state.get('topics_covered', [])
 
     # --- ОБНОВЛЕНИЕ STATE ---
     
@@ -116,7 +156,7 @@ def expert_node(state: InterviewState):
         new_topics.append(topic_name)
         
     should_finish = False
-    if observer_analysis.get('intent_to_leave', False) or topic_name == "Conclusion":
+    if (observer_analysis or {}).get('intent_to_leave', False) or topic_name == "Conclusion":
         should_finish = True
 
     return {
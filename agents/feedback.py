@@ -1,76 +1,467 @@
+import os
+import json
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
-from utils.llm import get_llm
+from utils.llm import invoke_chain, ainvoke_chain
 from utils.state import InterviewState
+from utils.context import build_transcript, get_budget, count_tokens, format_turn
+from utils.resilience import fell_back
+from agents.grader import (
+    grading_enabled, current_thread_id, wait_grades, await_grades, grade_missing, agrade_missing
+)
 
-def feedback_node(state: InterviewState):
-    print("--- Feedback Generation ---")
-    
-    llm = get_llm()
-    messages = state['messages']
-    
-    # Собираем контекст
-    candidate_info = state.get('candidate_info', {})
-    name = candidate_info.get('name', 'Кандидат')
-    stack = candidate_info.get('stack', 'General')
-    level = candidate_info.get('level', 'Junior')
-    
-    # История диалога для анализа
-    # Превращаем сообщения в текст: "Interviewer: ... \n Candidate: ..."
-    conversation_text = ""
-    for msg in messages:
-        role = "Candidate" if msg.type == 'human' else "Interviewer"
-        conversation_text += f"{role}: {msg.content}\n"
-
-    system_prompt = f"""
-    Ты — Технический Лид, проводящий финальную оценку интервью.
-    
-    КАНДИДАТ: {name}
-    ЗАЯВЛЕННЫЙ УРОВЕНЬ: {level}
-    СТЕК: {stack}
-    
-    ТВОЯ ЗАДАЧА:
-    Проанализируй лог интервью и напиши ПОДРОБНЫЙ отчет в формате MARKDOWN.
-    Это должно быть единое поле текста.
-    
-    СТРУКТУРА ОТЧЕТА (Используй Markdown заголовки ## и списки):
-    
-    1. ## Технический ревью
-       - Оцени сильные и слабые стороны кандидата, проявленные в ответах.
-       - Какие темы он знает хорошо? Где плавает? (SQL, Python, Архитектура и т.д.)
-       
-    2. ## Итоговый Грейд
-       - Соответствует ли он уровню {level}?
-       - Какой грейд ты бы дал (Junior/Middle/Senior)?
-       
-    3. ## План развития (Roadmap)
-       - Список конкретных тем и технологий, которые нужно подтянуть.
-       - Рекомендации (книги, курсы, пет-проекты).
-       
-    4. ## Заключение
-       - Итоговое слово: нанимаем или нет?
-       - Вежливое прощание.
-
-    ВАЖНО:
-    - Не используй JSON.
-    - Пиши сразу красивый, отформатированный текст.
-    - Язык: Русский.
+SYSTEM_PROMPT = """
+Ты — Технический Лид, проводящий финальную оценку интервью.
+
+КАНДИДАТ: {name}
+ЗАЯВЛЕННЫЙ УРОВЕНЬ: {level}
+СТЕК: {stack}
+
+ТВОЯ ЗАДАЧА:
+Проанализируй лог интервью и напиши ПОДРОБНЫЙ отчет в формате MARKDOWN.
+Это должно быть единое поле текста.
+
+СТРУКТУРА ОТЧЕТА (Используй Markdown заголовки ## и списки):
+
+1. ## Технический ревью
+   - Оцени сильные и слабые стороны кандидата, проявленные в ответах.
+   - Какие темы он знает хорошо? Где плавает? (SQL, Python, Архитектура и т.д.)
+   
+2. ## Итоговый Грейд
+   - Соответствует ли он уровню {level}?
+   - Какой грейд ты бы дал (Junior/Middle/Senior)?
+   
+3. ## План развития (Roadmap)
+   - Список конкретных тем и технологий, которые нужно подтянуть.
+   - Рекомендации (книги, курсы, пет-проекты).
+   
+4. ## Заключение
+   - Итоговое слово: нанимаем или нет?
+   - Вежливое прощание.
+
+ВАЖНО:
+- Не используй JSON.
+- Пиши сразу красивый, отформатированный текст.
+- Язык: Русский.
+"""
+
+# Лог передается переменной шаблона, а не f-строкой: так промпт компилируется
+# один раз, а фигурные скобки в ответах кандидата не ломают шаблон.
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", "Вот лог интервью:\n{conversation_text}\n\nСоставь отчет.")
+])
+
+
+# Отчет, если LLM не ответила
+FALLBACK_FEEDBACK = "## Ошибка генерации отчета\nК сожалению, не удалось сформировать фидбэк."
+
+
+def conversation_turns(state: InterviewState):
+    """
+    Ходы интервью парами (вопрос бота, ответ кандидата).
+    Берутся из internal_log: канал messages хранит только окно последних сообщений.
     """
+    log = state.get('internal_log', [])
+    turns = [(entry.get('agent_visible_message', ''), entry.get('user_message', '')) for entry in log]
+    if turns:
+        # При досрочном завершении отчет пишется параллельно с прощанием,
+        # и последний ответ кандидата еще не попал в лог
+        messages = state['messages']
+        if messages and messages[-1].type == 'human' and messages[-1].content != log[-1].get('user_message'):
+            turns.append((state.get('last_bot_msg') or '', messages[-1].content))
+        return turns
+
+    # Старые чекпоинты без лога: собираем пары из сообщений
+    pairs = []
+    question = ""
+    for msg in state['messages']:
+        if msg.type == 'human':
+            pairs.append((question, msg.content))
+        else:
+            question = msg.content
+    return pairs
+
+
+def feedback_inputs_base(state: InterviewState):
+    """Данные кандидата для системного промпта отчета."""
+    candidate_info = state.get('candidate_info', {})
+
+    return {
+        "name": candidate_info.get('name', 'Кандидат'),
+        "level": candidate_info.get('level', 'Junior'),
+        "stack": candidate_info.get('stack', 'General')
+    }
+
+
+def feedback_inputs(state: InterviewState):
+    """Переменные промпта финального отчета из state."""
+    # История диалога для анализа: "Interviewer: ... \n Candidate: ..." в пределах бюджета токенов
+    conversation_text = build_transcript(conversation_turns(state), get_budget("feedback"))
+
+    return {**feedback_inputs_base(state), "conversation_text": conversation_text}
+
+
+# --- ИНКРЕМЕНТАЛЬНЫЙ РЕЖИМ (FEEDBACK_MODE=incremental) ---
+# Отчет собирается из оценок ходов, посчитанных в фоне (agents.grader).
+# LLM нужна только для короткого заключения (FEEDBACK_SUMMARY=0 — без вызова вообще).
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+Ты — Технический Лид. По сводке оценок интервью напиши раздел "Заключение" отчета.
+Кандидат: {name}, заявленный уровень: {level}, оценка по итогам: {grade}.
+2-3 предложения: нанимаем или нет и почему, затем вежливое прощание.
+Без заголовков и JSON. Язык: Русский.
+"""),
+    ("human", "Сводка оценок по темам:\n{digest}")
+])
+
+GRADE_THRESHOLDS = ((4.0, "Senior"), (3.0, "Middle"), (0.0, "Junior"))
+GRADER_WAIT_SECONDS = float(os.getenv("GRADER_WAIT_SECONDS", "30"))
+
+
+def _unique(items, limit):
+    seen = []
+    for item in items:
+        if item not in seen:
+            seen.append(item)
+    return seen[:limit]
+
+
+def missing_entries(state: InterviewState, grades):
+    graded = {grade.get('turn_id') for grade in grades}
+    return [entry for entry in state.get('internal_log', []) if entry.get('turn_id') not in graded]
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", f"Вот лог интервью:\n{conversation_text}\n\nСоставь отчет.")
+
+def summarize_grades(grades):
+    """Сводка оценок по темам: средний балл, сильные и слабые стороны, что подтянуть."""
+    topics = {}
+    for grade in sorted(grades, key=lambda g: g.get('turn_id') or 0):
+        topic = topics.setdefault(grade['topic'], {"scores": [], "strengths": [], "weaknesses": [], "roadmap": []})
+        if grade.get('score') is not None:
+            topic["scores"].append(grade['score'])
+        for key in ("strengths", "weaknesses", "roadmap"):
+            topic[key].extend(grade.get(key, []))
+
+    scores = [s for topic in topics.values() for s in topic["scores"]]
+    average = sum(scores) / len(scores) if scores else None
+    grade = next((name for threshold, name in GRADE_THRESHOLDS if average is not None and average >= threshold), None)
+    return topics, average, grade
+
+
+def _digest(topics):
+    lines = []
+    for name, topic in topics.items():
+        score = f"{sum(topic['scores']) / len(topic['scores']):.1f}/5" if topic['scores'] else "без оценки"
+        lines.append(f"- {name}: {score}; плюсы: {'; '.join(_unique(topic['strengths'], 2)) or '-'}; "
+                     f"минусы: {'; '.join(_unique(topic['weaknesses'], 2)) or '-'}")
+    return "\n".join(lines)
+
+
+def summary_inputs(state: InterviewState, topics, grade):
+    candidate_info = state.get('candidate_info', {})
+    return {
+        "name": candidate_info.get('name', 'Кандидат'),
+        "level": candidate_info.get('level', 'Junior'),
+        "grade": grade or "недостаточно данных",
+        "digest": _digest(topics)
+    }
+
+
+def meets_level(level, grade):
+    levels = [name for _, name in reversed(GRADE_THRESHOLDS)]
+    return level in levels and levels.index(grade) >= levels.index(level)
+
+
+def default_conclusion(level, grade):
+    if grade is None:
+        return "Данных для однозначного решения недостаточно. Спасибо за уделенное время!"
+    if meets_level(level, grade):
+        return f"Кандидат подтверждает уровень {level} — рекомендуем к найму. Спасибо за интервью!"
+    return f"По итогам интервью уровень соответствует {grade}, а не заявленному {level}. Спасибо за интервью!"
+
+
+def assemble_report(state: InterviewState, topics, average, grade, conclusion):
+    """Собирает Markdown-отчет в той же структуре из четырех разделов, что и одиночный вызов."""
+    level = state.get('candidate_info', {}).get('level', 'Junior')
+
+    review = []
+    for name, topic in topics.items():
+        score = f" — {sum(topic['scores']) / len(topic['scores']):.1f}/5" if topic['scores'] else ""
+        review.append(f"### {name}{score}")
+        review += [f"- ✅ {item}" for item in _unique(topic['strengths'], 3)]
+        review += [f"- ⚠️ {item}" for item in _unique(topic['weaknesses'], 3)]
+
+    if grade is None:
+        grade_text = "- Недостаточно технических ответов для оценки."
+    else:
+        verdict = "соответствует" if meets_level(level, grade) else "не соответствует"
+        grade_text = f"- Средний балл: {average:.1f}/5\n- Уровню {level} {verdict}.\n- Рекомендуемый грейд: **{grade}**"
+
+    roadmap = _unique([item for topic in topics.values() for item in topic['roadmap']], 10)
+    if not roadmap:
+        roadmap = _unique([item for topic in topics.values() for item in topic['weaknesses']], 10)
+
+    return "\n\n".join([
+        "## Технический ревью\n" + ("\n".join(review) or "- Технических ответов не было."),
+        "## Итоговый Грейд\n" + grade_text,
+        "## План развития (Roadmap)\n" + ("\n".join(f"- {item}" for item in roadmap) or "- Пробелов не выявлено."),
+        "## Заключение\n" + conclusion
     ])
 
-    chain = prompt | llm | StrOutputParser()
+
+def incremental_feedback(state: InterviewState):
+    """Отчет из фоновых оценок: дожидаемся хвоста, дооцениваем пропущенные ходы, один короткий вызов."""
+    grades = list(state.get('turn_grades', []))
+    thread_id = current_thread_id()
+    running = {}
+    if thread_id:
+        waited, running = wait_grades(thread_id, timeout=GRADER_WAIT_SECONDS)
+        grades += waited
+    new_grades = grades[len(state.get('turn_grades', [])):]
+
+    missing = missing_entries(state, grades)
+    if missing:
+        print(f"Feedback: дооценка {len(missing)} ходов (из них еще в работе: {len(running)})")
+        extra = grade_missing(missing, state.get('candidate_info', {}), running)
+        grades += extra
+        new_grades += extra
+
+    topics, average, grade = summarize_grades(grades)
+    level = state.get('candidate_info', {}).get('level', 'Junior')
+    conclusion = default_conclusion(level, grade)
+    if os.getenv("FEEDBACK_SUMMARY", "1") != "0" and topics:
+        try:
+            conclusion = invoke_chain("feedback_summary", SUMMARY_PROMPT, summary_inputs(state, topics, grade)).strip()
+        except Exception as e:
+            print(f"❌ Feedback Summary Error: {e}")
+
+    return {
+        "final_feedback": assemble_report(state, topics, average, grade, conclusion),
+        "turn_grades": new_grades
+    }
+
+
+async def aincremental_feedback(state: InterviewState):
+    grades = list(state.get('turn_grades', []))
+    thread_id = current_thread_id()
+    running = {}
+    if thread_id:
+        waited, running = await await_grades(thread_id, timeout=GRADER_WAIT_SECONDS)
+        grades += waited
+    new_grades = grades[len(state.get('turn_grades', [])):]
+
+    missing = missing_entries(state, grades)
+    if missing:
+        print(f"Feedback: дооценка {len(missing)} ходов (из них еще в работе: {len(running)})")
+        extra = await agrade_missing(missing, state.get('candidate_info', {}), running)
+        grades += extra
+        new_grades += extra
+
+    topics, average, grade = summarize_grades(grades)
+    level = state.get('candidate_info', {}).get('level', 'Junior')
+    conclusion = default_conclusion(level, grade)
+    if os.getenv("FEEDBACK_SUMMARY", "1") != "0" and topics:
+        try:
+            conclusion = (await ainvoke_chain("feedback_summary", SUMMARY_PROMPT, summary_inputs(state, topics, grade))).strip()
+        except Exception as e:
+            print(f"❌ Feedback Summary Error: {e}")
+
+    return {
+        "final_feedback": assemble_report(state, topics, average, grade, conclusion),
+        "turn_grades": new_grades
+    }
+
+
+# --- MAP-REDUCE (FEEDBACK_MODE=mapreduce) ---
+# Длинный лог режется на окна по FEEDBACK_CHUNK_TURNS ходов, окна оцениваются параллельно
+# (не больше FEEDBACK_MAP_CONCURRENCY одновременно), затем выводы сводятся в отчет
+# с тем же SYSTEM_PROMPT, поэтому формат final_feedback не меняется.
+# Режим single переключается сюда сам, если полный лог не влезает в бюджет feedback.
+
+MAP_SYSTEM_PROMPT = """
+Ты — Технический Лид. Тебе дан ФРАГМЕНТ лога интервью (не весь лог).
+
+КАНДИДАТ: {name}
+ЗАЯВЛЕННЫЙ УРОВЕНЬ: {level}
+СТЕК: {stack}
+
+ТВОЯ ЗАДАЧА: Кратко оценить ответы кандидата только в этом фрагменте.
+
+ФОРМАТ ВЫВОДА (ТОЛЬКО JSON, БЕЗ ЛИШНЕГО ТЕКСТА):
+{{
+    "topics": ["Темы фрагмента"],
+    "strengths": ["Сильные стороны"],
+    "weaknesses": ["Слабые стороны"],
+    "level_estimate": "Junior/Middle/Senior",
+    "roadmap": ["Что подтянуть"]
+}}
+"""
+
+MAP_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", MAP_SYSTEM_PROMPT),
+    ("human", "Фрагмент интервью (ходы {first}-{last}):\n{conversation_text}\n\nJSON:")
+])
+
+REDUCE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", "Лог интервью длинный, поэтому он оценен по частям. Выводы по частям:\n{verdicts}\n\nСоставь отчет.")
+])
+
+FEEDBACK_CHUNK_TURNS = int(os.getenv("FEEDBACK_CHUNK_TURNS", "8"))
+FEEDBACK_MAP_CONCURRENCY = int(os.getenv("FEEDBACK_MAP_CONCURRENCY", "4"))
+
+
+def feedback_mode():
+    return os.getenv("FEEDBACK_MODE", "incremental")
+
+
+def needs_mapreduce(turns):
+    """Полный лог не влезает в бюджет одиночного вызова."""
+    return count_tokens("\n".join(format_turn(q, a) for q, a in turns)) > get_budget("feedback")
+
+
+def chunk_turns(turns, size=FEEDBACK_CHUNK_TURNS):
+    """Окна ходов: [(номер первого хода, [(вопрос, ответ), ...]), ...]."""
+    return [(start + 1, turns[start:start + size]) for start in range(0, len(turns), size)]
+
+
+def map_inputs(state: InterviewState, first, chunk):
+    candidate_info = state.get('candidate_info', {})
+    return {
+        "name": candidate_info.get('name', 'Кандидат'),
+        "level": candidate_info.get('level', 'Junior'),
+        "stack": candidate_info.get('stack', 'General'),
+        "first": first,
+        "last": first + len(chunk) - 1,
+        "conversation_text": build_transcript(chunk, get_budget("feedback_map"))
+    }
+
+
+def parse_verdict(raw_response):
+    cleaned_json = raw_response.replace("```json", "").replace("```", "").strip()
+    try:
+        verdict = json.loads(cleaned_json)
+    except json.JSONDecodeError:
+        # Текстовый ответ тоже годится для свертки
+        return {"summary": raw_response.strip()}
+    return verdict if isinstance(verdict, dict) else {"summary": cleaned_json}
+
+
+def format_verdicts(chunks, verdicts):
+    """Выводы по частям в компактный текст для свертки."""
+    lines = []
+    for (first, chunk), verdict in zip(chunks, verdicts):
+        lines.append(f"### Ходы {first}-{first + len(chunk) - 1}")
+        if verdict is None:
+            lines.append("- Часть не удалось оценить.")
+            continue
+        for key, title in (("topics", "Темы"), ("strengths", "Сильные стороны"), ("weaknesses", "Слабые стороны"),
+                           ("level_estimate", "Оценка уровня"), ("roadmap", "Что подтянуть"), ("summary", "Вывод")):
+            value = verdict.get(key)
+            if value:
+                lines.append(f"- {title}: {'; '.join(map(str, value)) if isinstance(value, list) else value}")
+    return "\n".join(lines)
+
+
+def _map_chunk(state, first, chunk):
+    try:
+        return parse_verdict(invoke_chain("feedback_map", MAP_PROMPT, map_inputs(state, first, chunk)))
+    except Exception as e:
+        print(f"❌ Feedback Map Error (turns {first}+): {e}")
+        return None
+
+
+async def _amap_chunk(state, first, chunk, semaphore):
+    async with semaphore:
+        try:
+            return parse_verdict(await ainvoke_chain("feedback_map", MAP_PROMPT, map_inputs(state, first, chunk)))
+        except Exception as e:
+            print(f"❌ Feedback Map Error (turns {first}+): {e}")
+            return None
+
+
+def mapreduce_feedback(state: InterviewState):
+    chunks = chunk_turns(conversation_turns(state))
+    print(f"Feedback: map-reduce по {len(chunks)} частям")
+
+    # Каждая задача — в своей копии контекста: так вызовы учитываются в метриках узла
+    with ThreadPoolExecutor(max_workers=max(min(FEEDBACK_MAP_CONCURRENCY, len(chunks)), 1)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, _map_chunk, state, first, chunk) for first, chunk in chunks]
+        verdicts = [f.result() for f in futures]
+
+    inputs = {**feedback_inputs_base(state), "verdicts": format_verdicts(chunks, verdicts)}
+    try:
+        feedback_markdown = invoke_chain("feedback_reduce", REDUCE_PROMPT, inputs)
+    except Exception as e:
+        print(f"❌ Feedback Reduce Error: {e}")
+        fell_back("feedback")
+        feedback_markdown = FALLBACK_FEEDBACK
+
+    return {"final_feedback": feedback_markdown}
+
+
+async def amapreduce_feedback(state: InterviewState):
+    chunks = chunk_turns(conversation_turns(state))
+    print(f"Feedback: map-reduce по {len(chunks)} частям (async)")
+
+    semaphore = asyncio.Semaphore(FEEDBACK_MAP_CONCURRENCY)
+    verdicts = await asyncio.gather(*(_amap_chunk(state, first, chunk, semaphore) for first, chunk in chunks))
+
+    inputs = {**feedback_inputs_base(state), "verdicts": format_verdicts(chunks, verdicts)}
+    try:
+        feedback_markdown = await ainvoke_chain("feedback_reduce", REDUCE_PROMPT, inputs)
+    except Exception as e:
+        print(f"❌ Feedback Reduce Error: {e}")
+        fell_back("feedback")
+        feedback_markdown = FALLBACK_FEEDBACK
+
+    return {"final_feedback": feedback_markdown}
+
+
+def use_mapreduce(state: InterviewState):
+    mode = feedback_mode()
+    return mode == "mapreduce" or (mode == "single" and needs_mapreduce(conversation_turns(state)))
+
+
+def feedback_node(state: InterviewState):
+    print("--- Feedback Generation ---")
+
+    if grading_enabled():
+        return incremental_feedback(state)
+    if use_mapreduce(state):
+        return mapreduce_feedback(state)
+
+    try:
+        feedback_markdown = invoke_chain("feedback", PROMPT, feedback_inputs(state))
+    except Exception as e:
+        print(f"❌ Feedback Error: {e}")
+        fell_back("feedback")
+        feedback_markdown = FALLBACK_FEEDBACK
+
+    return {
+        "final_feedback": feedback_markdown
+    }
+
+
+async def afeedback_node(state: InterviewState):
+    print("--- Feedback Generation (async) ---")
+
+    if grading_enabled():
+        return await aincremental_feedback(state)
+    if use_mapreduce(state):
+        return await amapreduce_feedback(state)
 
     try:
-        feedback_markdown = chain.invoke({})
+        feedback_markdown = await ainvoke_chain("feedback", PROMPT, feedback_inputs(state))
     except Exception as e:
         print(f"❌ Feedback Error: {e}")
-        feedback_markdown = "## Ошибка генерации отчета\nК сожалению, не удалось сформировать фидбэк."
+        fell_back("feedback")
+        feedback_markdown = FALLBACK_FEEDBACK
 
     return {
         "final_feedback": feedback_markdown
-    }
\ No newline at end of file
+    }
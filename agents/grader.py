@@ -0,0 +1,204 @@
+import os
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from langchain_core.prompts import ChatPromptTemplate
+from langgraph.config import get_config
+
+from utils.llm import invoke_chain, ainvoke_chain
+
+# Фоновая оценка ходов: пока кандидат читает вопрос и печатает ответ, отдельный поток
+# оценивает предыдущий ход. Готовые оценки попадают в state["turn_grades"] на следующем ходу,
+# а feedback_node только собирает их в отчет (FEEDBACK_MODE=incremental).
+
+# --- ПРОМПТ ---
+SYSTEM_PROMPT = """
+Ты — Технический Лид, оценивающий ОДИН ответ кандидата на интервью.
+
+КАНДИДАТ: {level} {role}, стек: {stack}
+
+ЗАМЕТКИ НАБЛЮДАТЕЛЯ И ЭКСПЕРТА:
+{internal_thoughts}
+
+ТВОЯ ЗАДАЧА: Оценить ответ по существу.
+- Если ответ не технический (приветствие, организационный вопрос, просьба закончить) — поставь "score": null.
+- Флаги HALLUCINATION и CONTRADICTION снижают оценку.
+
+ФОРМАТ ВЫВОДА (ТОЛЬКО JSON, БЕЗ ЛИШНЕГО ТЕКСТА):
+{{
+    "topic": "Тема вопроса (например: 'SQL Joins').",
+    "score": 3,
+    "strengths": ["Что кандидат знает хорошо"],
+    "weaknesses": ["Где ошибся или плавает"],
+    "roadmap": ["Что конкретно подтянуть"]
+}}
+Шкала score: 1 — не знает, 2 — слабо, 3 — базово, 4 — уверенно, 5 — глубоко.
+"""
+
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", "Вопрос: {question}\nОтвет кандидата: {answer}\n\nJSON:")
+])
+
+
+def grade_inputs(entry, candidate_info):
+    return {
+        "level": candidate_info.get('level', 'Junior'),
+        "role": candidate_info.get('role', 'Developer'),
+        "stack": candidate_info.get('stack', 'General'),
+        "internal_thoughts": entry.get('internal_thoughts', '') or "Нет заметок.",
+        "question": entry.get('agent_visible_message', ''),
+        "answer": entry.get('user_message', '')
+    }
+
+
+def parse_grade(raw_response, entry):
+    cleaned_json = raw_response.replace("```json", "").replace("```", "").strip()
+    result = json.loads(cleaned_json)
+
+    score = result.get('score')
+    if isinstance(score, (int, float)):
+        score = min(max(int(round(score)), 1), 5)
+    else:
+        score = None
+
+    def as_list(value):
+        return [str(item) for item in value] if isinstance(value, list) else []
+
+    return {
+        "turn_id": entry.get('turn_id'),
+        "topic": str(result.get('topic') or 'General'),
+        "score": score,
+        "strengths": as_list(result.get('strengths')),
+        "weaknesses": as_list(result.get('weaknesses')),
+        "roadmap": as_list(result.get('roadmap'))
+    }
+
+
+def grade_turn(entry, candidate_info):
+    """Оценка одного хода. None, если LLM не ответила — ход будет оценен повторно в конце."""
+    try:
+        return parse_grade(invoke_chain("grader", PROMPT, grade_inputs(entry, candidate_info)), entry)
+    except Exception as e:
+        print(f"❌ Grader Error (turn {entry.get('turn_id')}): {e}")
+        return None
+
+
+async def agrade_turn(entry, candidate_info):
+    try:
+        return parse_grade(await ainvoke_chain("grader", PROMPT, grade_inputs(entry, candidate_info)), entry)
+    except Exception as e:
+        print(f"❌ Grader Error (turn {entry.get('turn_id')}): {e}")
+        return None
+
+
+# --- ФОНОВЫЕ ЗАДАЧИ ---
+_executor = None
+_pending = {}   # thread_id -> {turn_id: Future}
+_pending_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _pending_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("GRADER_WORKERS", "4")),
+                    thread_name_prefix="grader"
+                )
+    return _executor
+
+
+def grading_enabled():
+    return os.getenv("FEEDBACK_MODE", "incremental") == "incremental"
+
+
+def current_thread_id():
+    """thread_id сессии из config графа (None вне графа)."""
+    try:
+        return get_config().get("configurable", {}).get("thread_id")
+    except RuntimeError:
+        return None
+
+
+def submit_grade(thread_id, entry, candidate_info):
+    """Ставит оценку хода в фоновый пул. Результат забирают collect_grades / wait_grades."""
+    future = _get_executor().submit(grade_turn, entry, candidate_info)
+    with _pending_lock:
+        _pending.setdefault(thread_id, {})[entry.get('turn_id')] = future
+
+
+def _pop(thread_id, only_done):
+    with _pending_lock:
+        futures = _pending.get(thread_id, {})
+        ready = {turn_id: f for turn_id, f in futures.items() if f.done() or not only_done}
+        for turn_id in ready:
+            del futures[turn_id]
+        if not futures:
+            _pending.pop(thread_id, None)
+    return ready
+
+
+def _results(futures):
+    """(оценки завершенных, {turn_id: future} еще идущих) — по одному снимку состояния."""
+    grades, running = [], {}
+    for turn_id in sorted(futures, key=lambda t: (t is None, t)):
+        future = futures[turn_id]
+        if not future.done():
+            running[turn_id] = future
+        elif future.exception() is None and future.result() is not None:
+            grades.append(future.result())
+    return grades, running
+
+
+def collect_grades(thread_id):
+    """Уже готовые оценки сессии (без ожидания)."""
+    return _results(_pop(thread_id, only_done=True))[0]
+
+
+def wait_grades(thread_id, timeout=None):
+    """
+    Дожидается оценок сессии (не дольше timeout секунд). Возвращает (оценки, незавершенные futures):
+    незавершенные передаются в grade_missing, чтобы не оценивать те же ходы второй раз.
+    """
+    futures = _pop(thread_id, only_done=False)
+    if futures:
+        wait(list(futures.values()), timeout=timeout)
+    return _results(futures)
+
+
+async def await_grades(thread_id, timeout=None):
+    """Async-версия wait_grades: не блокирует event loop."""
+    futures = _pop(thread_id, only_done=False)
+    if futures:
+        await asyncio.wait([asyncio.wrap_future(f) for f in futures.values()], timeout=timeout)
+    return _results(futures)
+
+
+def grade_missing(entries, candidate_info, running=None):
+    """
+    Оценивает ходы без оценки (пропущенные после рестарта или упавшие) параллельно в пуле.
+    Ход, чья фоновая оценка еще идет (running от wait_grades), не ставится второй раз — ждем ее.
+    """
+    running = running or {}
+    futures = []
+    for entry in entries:
+        future = running.get(entry.get('turn_id'))
+        futures.append(future if future is not None else _get_executor().submit(grade_turn, entry, candidate_info))
+    return [f.result() for f in futures if f.result() is not None]
+
+
+async def agrade_missing(entries, candidate_info, running=None):
+    running = running or {}
+
+    async def grade(entry):
+        future = running.get(entry.get('turn_id'))
+        # Оценка, еще стоящая в очереди пула, снимается и выполняется здесь; уже начатая — дожидается
+        if future is not None and not future.cancel():
+            return await asyncio.wrap_future(future)
+        return await agrade_turn(entry, candidate_info)
+
+    results = await asyncio.gather(*(grade(entry) for entry in entries))
+    return [grade for grade in results if grade is not None]
@@ -1,20 +1,195 @@
+import hashlib
 from langchain_core.messages import AIMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 
-from utils.llm import get_llm
+from utils.llm import invoke_chain, ainvoke_chain
 from utils.state import InterviewState
+from utils.context import fit_fields
+from utils.resilience import fell_back
+from utils.openers import opening_enabled, get_opening_bank
+from agents.grader import grading_enabled, current_thread_id, collect_grades, submit_grade
+from agents.observer import skip_analysis
+from agents.expert import expert_update, SYSTEM_PROMPT as EXPERT_PROMPT
 
-def interviewer_node(state: InterviewState):
-    print("--- Interviewer Working ---") 
-    
-    llm = get_llm()
-    messages = state['messages']
-    
+SYSTEM_PROMPT = """
+Ты — Технический рекрутер Алиса.
+
+ТВОЯ ЗАДАЧА:
+Перефразировать инструкцию Эксперта в живой диалог.
+
+ВХОДНАЯ ИНСТРУКЦИЯ:
+"{instruction}"
+
+ПРАВИЛА ОФОРМЛЕНИЯ:
+1. {greeting_rule}
+2. ВАЖНО: Твоя цель — ПОЛУЧИТЬ ОТВЕТ. Каждое твоё сообщение (кроме прощания) ДОЛЖНО заканчиваться вопросительным предложением.
+3. Не читай лекции и не объясняй термины сама, если тебя об этом не просили. Твоя роль — спрашивать.
+4. Будь лаконична (2-3 предложения).
+5. Тон: Профессиональный, но дружелюбный.
+6. Если инструкция говорит завершить — попрощайся.
+7. Язык: Русский
+"""
+
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", "Сгенерируй ответ.") 
+])
+
+
+# Реплика, если LLM не ответила
+FALLBACK_REPLY = "Отлично. Давайте двигаться дальше."
+
+# --- ДОСРОЧНОЕ ЗАВЕРШЕНИЕ ---
+# Кандидат попросил остановиться: Expert не нужен, прощание идет параллельно с feedback_node
+FAREWELL_PLAN = {
+    "thoughts": "Кандидат попросил завершить интервью.",
+    "instruction": "Заверши интервью: поблагодари кандидата за уделенное время и попрощайся.",
+    "topic_name": "Conclusion",
+    "difficulty_adjustment": "same"
+}
+FAREWELL_THOUGHT = "[Expert]: (пропущен: кандидат попросил завершить интервью) [Strat: same]"
+FALLBACK_FAREWELL = "Спасибо за уделенное время! Интервью завершено, всего доброго."
+
+# Вступление на случай, если запись банка пропала между проверкой и чтением
+DEFAULT_OPENING_PLAN = {
+    "thoughts": "Начало интервью, вступление по умолчанию.",
+    "instruction": "Поздоровайся и попроси кандидата кратко рассказать о своем опыте со стеком.",
+    "topic_name": "General",
+    "difficulty_adjustment": "same"
+}
+DEFAULT_OPENING_REPLY = "Здравствуйте! Меня зовут Алиса, я проведу с вами техническое интервью. Расскажите, пожалуйста, кратко о своем опыте работы с вашим стеком?"
+
+
+# --- ВСТУПЛЕНИЕ ИЗ БАНКА ---
+# Первый ход зависит только от роли/грейда/стека: готовое вступление берется из utils.openers.
+# Версия — хэш промптов Expert и Интервьюера: после их правки банк наполняется заново.
+OPENING_VERSION = hashlib.sha256((EXPERT_PROMPT + SYSTEM_PROMPT).encode("utf-8")).hexdigest()[:12]
+# Темы, которые не сохраняем в банк: план Expert не удался или интервью завершается
+NOT_BANKED_TOPICS = ("Emergency Topic", "Current Topic", "Conclusion")
+
+
+def opening_available(state: InterviewState):
+    """Старт интервью и для этой роли/грейда/стека уже есть готовое вступление."""
+    return (opening_enabled() and len(state['messages']) <= 1
+            and get_opening_bank().has(state.get('candidate_info', {}), OPENING_VERSION))
+
+
+def opening_update(state: InterviewState, opening):
+    """То же обновление state, что дают Observer (холодный старт), Expert и Интервьюер на первом ходу."""
+    observer_part = skip_analysis(state)
+    expert_part = expert_update(state, opening['expert_plan'], observer_part['observer_analysis'], observer_part['current_turn_thoughts'])
+    return {
+        **observer_part,
+        **expert_part,
+        "messages": [AIMessage(content=opening['reply'])],
+        "last_bot_msg": opening['reply']
+    }
+
+
+def opening_node(state: InterviewState):
+    print("--- Interviewer Opening (bank) ---")
+    opening = get_opening_bank().lookup(state.get('candidate_info', {}), OPENING_VERSION)
+    if opening is None:
+        # Банк проверен в opening_available, сюда попадаем только при гонке с очисткой файла
+        opening = {"expert_plan": dict(DEFAULT_OPENING_PLAN), "reply": DEFAULT_OPENING_REPLY}
+    return opening_update(state, opening)
+
+
+async def aopening_node(state: InterviewState):
+    # Поиск в локальном SQLite — без сети, event loop не блокируется заметно
+    return opening_node(state)
+
+
+def bankable(expert_plan, response_text):
+    """Вступление можно отдавать другим кандидатам: план и реплика получены от LLM, а не из fallback."""
+    return (bool(expert_plan.get('instruction')) and bool(response_text) and response_text != FALLBACK_REPLY
+            and expert_plan.get('topic_name') not in NOT_BANKED_TOPICS)
+
+
+def remember_opening(state: InterviewState, response_text):
+    """Ленивое пополнение банка вступлением, которое граф сгенерировал сам."""
+    expert_plan = state.get('expert_plan') or {}
+    if opening_enabled() and bankable(expert_plan, response_text):
+        get_opening_bank().remember(state.get('candidate_info', {}), OPENING_VERSION, expert_plan, response_text)
+
+
+def interviewer_inputs(state: InterviewState):
+    """Переменные промпта интервьюера из state."""
     # Защита от сбоев Эксперта
     expert_plan = state.get('expert_plan') or {}
-    instruction = expert_plan.get('instruction', "Поблагодари и задай следующий вопрос.")
+
+    inputs = {
+        "instruction": expert_plan.get('instruction', "Поблагодари и задай следующий вопрос."),
+        "greeting_rule": greeting_rule_for(state['messages'])
+    }
+    return fit_fields("interviewer", inputs, ("instruction",))
+
+
+def interviewer_node(state: InterviewState):
+    print("--- Interviewer Working ---") 
     
+    try:
+        response_text = invoke_chain("interviewer", PROMPT, interviewer_inputs(state))
+    except Exception as e:
+        print(f"❌ Interviewer Error: {e}")
+        fell_back("interviewer")
+        response_text = FALLBACK_REPLY
+
+    return interviewer_update(state, response_text, state.get('current_turn_thoughts', []))
+
+
+async def ainterviewer_node(state: InterviewState):
+    print("--- Interviewer Working (async) ---")
+
+    try:
+        response_text = await ainvoke_chain("interviewer", PROMPT, interviewer_inputs(state))
+    except Exception as e:
+        print(f"❌ Interviewer Error: {e}")
+        fell_back("interviewer")
+        response_text = FALLBACK_REPLY
+
+    return interviewer_update(state, response_text, state.get('current_turn_thoughts', []))
+
+
+def farewell_inputs(state: InterviewState):
+    return interviewer_inputs({**state, "expert_plan": FAREWELL_PLAN})
+
+
+def farewell_update(state: InterviewState, response_text):
+    thoughts = state.get('current_turn_thoughts', []) + [FAREWELL_THOUGHT]
+    # Последний ход не оцениваем в фоне: feedback_node уже собирает отчет параллельно
+    update = interviewer_update(state, response_text, thoughts, grade=False)
+    update.update({"expert_plan": FAREWELL_PLAN, "current_turn_thoughts": thoughts, "finished": True})
+    return update
+
+
+def farewell_node(state: InterviewState):
+    print("--- Interviewer Farewell ---")
+
+    try:
+        response_text = invoke_chain("interviewer", PROMPT, farewell_inputs(state))
+    except Exception as e:
+        print(f"❌ Interviewer Error: {e}")
+        fell_back("farewell")
+        response_text = FALLBACK_FAREWELL
+
+    return farewell_update(state, response_text)
+
+
+async def afarewell_node(state: InterviewState):
+    print("--- Interviewer Farewell (async) ---")
+
+    try:
+        response_text = await ainvoke_chain("interviewer", PROMPT, farewell_inputs(state))
+    except Exception as e:
+        print(f"❌ Interviewer Error: {e}")
+        fell_back("farewell")
+        response_text = FALLBACK_FAREWELL
+
+    return farewell_update(state, response_text)
+
+
+def greeting_rule_for(messages):
     # --- ДИНАМИЧЕСКИЙ КОНТЕКСТ ---
     # Если в истории уже есть сообщения (кроме стартового), значит диалог идет.
     # Обычно: [System, Human(Start), AI(Intro), Human(Answer)...]
@@ -22,45 +197,13 @@ def interviewer_node(state: InterviewState):
     is_ongoing_conversation = len(messages) > 2
     
     if is_ongoing_conversation:
-        greeting_rule = "СТРОГИЙ ЗАПРЕТ НА ПРИВЕТСТВИЯ: Не здоровайся. Сразу к вопросу."
-    else:
-        greeting_rule = "ЭТО НАЧАЛО: Обязательно поздоровайся и представься."
+        return "СТРОГИЙ ЗАПРЕТ НА ПРИВЕТСТВИЯ: Не здоровайся. Сразу к вопросу."
+    return "ЭТО НАЧАЛО: Обязательно поздоровайся и представься."
 
-    system_prompt = """
-    Ты — Технический рекрутер Алиса.
-    
-    ТВОЯ ЗАДАЧА:
-    Перефразировать инструкцию Эксперта в живой диалог.
-    
-    ВХОДНАЯ ИНСТРУКЦИЯ:
-    "{instruction}"
-    
-    ПРАВИЛА ОФОРМЛЕНИЯ:
-    1. {greeting_rule}
-    2. ВАЖНО: Твоя цель — ПОЛУЧИТЬ ОТВЕТ. Каждое твоё сообщение (кроме прощания) ДОЛЖНО заканчиваться вопросительным предложением.
-    3. Не читай лекции и не объясняй термины сама, если тебя об этом не просили. Твоя роль — спрашивать.
-    4. Будь лаконична (2-3 предложения).
-    5. Тон: Профессиональный, но дружелюбный.
-    6. Если инструкция говорит завершить — попрощайся.
-    7. Язык: Русский
-    """
-    
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", "Сгенерируй ответ.") 
-    ])
-    
-    # Передаем переменные
-    chain = prompt | llm | StrOutputParser()
-    
-    try:
-        response_text = chain.invoke({
-            "instruction": instruction,
-            "greeting_rule": greeting_rule
-        })
-    except Exception as e:
-        print(f"❌ Interviewer Error: {e}")
-        response_text = "Отлично. Давайте двигаться дальше."
+
+def interviewer_update(state: InterviewState, response_text, thoughts_list, grade=True):
+    """Собирает обновление state из реплики интервьюера: сообщение и запись хода в лог."""
+    messages = state['messages']
 
     # --- ОБНОВЛЕННАЯ СБОРКА ЛОГА ---
     last_user_message = messages[-1].content if messages else ""
@@ -69,6 +212,8 @@ def interviewer_node(state: InterviewState):
     if is_start:
         # Это самый первый запуск. Алиса говорит "Привет! Вопрос 1". 
         # Мы ничего не пишем в лог, но запоминаем Вопрос 1 в last_bot_msg.
+        # Вступление для этой роли/грейда/стека уходит в банк (utils.openers).
+        remember_opening(state, response_text)
         return {
             "messages": [AIMessage(content=response_text)],
             "last_bot_msg": response_text
@@ -80,7 +225,6 @@ def interviewer_node(state: InterviewState):
     current_logs = state.get('internal_log', [])
     turn_id = len(current_logs) + 1
     
-    thoughts_list = state.get('current_turn_thoughts', [])
     combined_thoughts = "\n".join(thoughts_list)
     
     # Берем старый вопрос из состояния для записи в текущий ход
@@ -93,8 +237,18 @@ def interviewer_node(state: InterviewState):
         "internal_thoughts": combined_thoughts
     }
     
-    return {
+    update = {
         "messages": [AIMessage(content=response_text)],
         "internal_log": [log_entry],
         "last_bot_msg": response_text # Сохраняем НОВЫЙ вопрос для следующего хода
-    }
\ No newline at end of file
+    }
+
+    # Оценка хода уходит в фон, пока кандидат читает вопрос; готовые оценки прошлых ходов забираем в state
+    thread_id = current_thread_id() if grade and grading_enabled() else None
+    if thread_id:
+        grades = collect_grades(thread_id)
+        if grades:
+            update["turn_grades"] = grades
+        submit_grade(thread_id, log_entry, state.get('candidate_info', {}))
+
+    return update
\ No newline at end of file
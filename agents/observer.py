@@ -1,15 +1,78 @@
-import json
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser # Используем строковый парсер
-from pydantic import BaseModel, Field
-from typing import Literal
 
-from utils.llm import get_llm
+from utils.structured import invoke_structured, ainvoke_structured
+from utils.schemas import ObserverAnalysis
 from utils.state import InterviewState
+from utils.context import fit_fields
+from utils.classifier import fastpath_enabled, get_fastpath
+from utils.metrics import registry
+from utils.resilience import DeadlineExceeded, CircuitOpenError, budget_exhausted, degraded, fell_back
 
-def observer_node(state: InterviewState):
-    print("--- Observer Working ---")
-    
+# --- ПРОМПТ ---
+# Структура JSON продублирована в промпте; сам ответ ограничен схемой ObserverAnalysis (utils.schemas).
+# intent_to_leave идет первым: при просьбе остановиться остаток ответа не дочитывается.
+SYSTEM_PROMPT = """
+Ты — Строгий Поведенческий Аналитик (Observer).
+
+КОНТЕКСТ:
+- Кандидат: {name} ({level} {role})
+- Стек: {stack}
+
+ТВОЯ ЗАДАЧА: Проанализировать последний ответ кандидата.
+
+АЛГОРИТМ ПРОВЕРКИ (ФЛАГИ):
+1. is_hallucination: True, если выдумал факты/библиотеки.
+2. consistency_violation: True, если противоречит себе или грейду.
+3. is_deep_dive: True, если уходит в дебри не по теме.
+4. is_role_reversal: True, если задает встречные вопросы/перехватывает инициативу.
+5. intent_to_leave: True, если пишет "Стоп", "Хватит", "Закончим" или по-другому открыто проявляет желание остановить интервью.
+
+ФОРМАТ ВЫВОДА (ТОЛЬКО JSON, БЕЗ ЛИШНЕГО ТЕКСТА):
+{{
+    "intent_to_leave": false,
+    "thoughts": "Твой краткий анализ на русском (макс 4 предл).",
+    "is_hallucination": false,
+    "consistency_violation": false,
+    "is_deep_dive": false,
+    "is_role_reversal": false,
+    "answer_quality": "medium"
+}}
+"""
+
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", "Контекст (вопрос бота): {last_bot_msg}\nОтвет кандидата: {last_user_text}\n\nJSON:")
+])
+
+# Ответ наблюдателя, если JSON не удалось получить
+FALLBACK_ANALYSIS = {
+    "thoughts": "Ошибка анализа (JSON Error). Текст ответа был слишком сложным.",
+    "is_hallucination": False,
+    "consistency_violation": False,
+    "is_deep_dive": False,
+    "is_role_reversal": False,
+    "intent_to_leave": False,
+    "answer_quality": "medium"
+}
+
+
+# Нейтральный анализ, когда на Observer не осталось времени хода (utils.resilience)
+SKIPPED_ANALYSIS = {
+    "thoughts": "Анализ пропущен: бюджет времени хода исчерпан.",
+    "is_hallucination": False,
+    "consistency_violation": False,
+    "is_deep_dive": False,
+    "is_role_reversal": False,
+    "intent_to_leave": False,
+    "answer_quality": "medium"
+}
+
+
+def skip_analysis(state: InterviewState):
+    """
+    Проверки, при которых LLM не нужна (холодный старт, пустой ввод).
+    Возвращает готовое обновление state или None, если ответ нужно анализировать.
+    """
     messages = state['messages']
     
     # --- ЛОГИКА ХОЛОДНОГО СТАРТА ---
@@ -30,107 +93,33 @@ def observer_node(state: InterviewState):
             "current_turn_thoughts": ["[Observer]: (Start of Interview)"]
         }
 
-    last_user_text = messages[-1].content
-    last_bot_msg = messages[-2].content if len(messages) > 1 else "Начало интервью"
-    
     # Защита от пустого ввода
-    if not last_user_text.strip():
+    if not messages[-1].content.strip():
         print("Observer: Пустой ввод.")
         return {
             "observer_analysis": {},
             "current_turn_thoughts": ["[Observer]: Пустой ввод."]
         }
-    
-    llm = get_llm()
-    messages = state['messages']
-    
-    # 1. ЗАЩИТА ОТ ПУСТОГО НАЧАЛА
-    if not messages:
-        return {"current_turn_thoughts": ["[Observer]: Нет сообщений для анализа."]}
 
-    last_user_text = messages[-1].content
-    last_bot_msg = messages[-2].content if len(messages) > 1 else "Начало интервью"
-    
-    # 2. ЗАЩИТА ОТ ПУСТОГО ВВОДА ПОЛЬЗОВАТЕЛЯ
-    if not last_user_text.strip():
-        print("⚠️ Observer: Пустой ввод пользователя.")
-        return {
-            "observer_analysis": {},
-            "current_turn_thoughts": ["[Observer]: Пустой ввод."]
-        }
-    
-    candidate_info = state.get('candidate_info', {})
-    stack = candidate_info.get('stack', 'General')
-    level = candidate_info.get('level', 'Junior')
-    
-    # --- ПРОМПТ ---
-    # Убрали Pydantic, пишем структуру JSON прямо в промпте текстом (это надежнее для StrParser)
-    system_prompt = """
-    Ты — Строгий Поведенческий Аналитик (Observer).
-    
-    КОНТЕКСТ:
-    - Кандидат: {name} ({level} {role})
-    - Стек: {stack}
-    
-    ТВОЯ ЗАДАЧА: Проанализировать последний ответ кандидата.
-    
-    АЛГОРИТМ ПРОВЕРКИ (ФЛАГИ):
-    1. is_hallucination: True, если выдумал факты/библиотеки.
-    2. consistency_violation: True, если противоречит себе или грейду.
-    3. is_deep_dive: True, если уходит в дебри не по теме.
-    4. is_role_reversal: True, если задает встречные вопросы/перехватывает инициативу.
-    5. intent_to_leave: True, если пишет "Стоп", "Хватит", "Закончим" или по-другому открыто проявляет желание остановить интервью.
-    
-    ФОРМАТ ВЫВОДА (ТОЛЬКО JSON, БЕЗ ЛИШНЕГО ТЕКСТА):
-    {{
-        "thoughts": "Твой краткий анализ на русском (макс 4 предл).",
-        "is_hallucination": false,
-        "consistency_violation": false,
-        "is_deep_dive": false,
-        "is_role_reversal": false,
-        "intent_to_leave": false,
-        "answer_quality": "medium" 
-    }}
-    """
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", "Контекст (вопрос бота): {last_bot_msg}\nОтвет кандидата: {last_user_text}\n\nJSON:")
-    ])
+    return None
 
-    chain = prompt | llm | StrOutputParser()
 
-    try:
-        # 3. ВЫЗОВ МОДЕЛИ
-        raw_response = chain.invoke({
-            "name": candidate_info.get('name', 'Candidate'),
-            "level": level,
-            "role": candidate_info.get('role', 'Developer'),
-            "stack": stack,
-            "last_bot_msg": last_bot_msg,
-            "last_user_text": last_user_text
-        })
-        
-        # ДЕБАГ: Смотрим в консоль, что пришло
-        print(f"🔧 Observer Raw Output: {raw_response[:100]}...") 
-
-        # 4. РУЧНАЯ ЧИСТКА JSON
-        cleaned_json = raw_response.replace("```json", "").replace("```", "").strip()
-        analysis_result = json.loads(cleaned_json)
+def fast_analysis(state: InterviewState, stop_only=False):
+    """
+    Локальный разбор очевидных ответов (стоп, «не знаю», одно слово, встречный вопрос).
+    Возвращает observer_analysis без вызова LLM или None, если ответ неоднозначный.
+    """
+    if not fastpath_enabled():
+        return None
+    analysis_result = get_fastpath().classify(state['messages'][-1].content, stop_only=stop_only)
+    if analysis_result is not None:
+        print(f"Observer: fast-path ({analysis_result['fast_path']}), LLM не нужна.")
+        registry.inc("interview_fastpath_total", reason=analysis_result['fast_path'])
+    return analysis_result
 
-    except Exception as e:
-        print(f"❌ Observer JSON Error: {e}")
-        # Fallback, чтобы не молчал
-        analysis_result = {
-            "thoughts": f"Ошибка анализа (JSON Error). Текст ответа был слишком сложным.",
-            "is_hallucination": False,
-            "consistency_violation": False,
-            "is_deep_dive": False,
-            "is_role_reversal": False,
-            "intent_to_leave": False,
-            "answer_quality": "medium"
-        }
 
+def observer_update(analysis_result):
+    """Собирает обновление state из JSON наблюдателя: анализ + строка мыслей с флагами."""
     # --- СБОРКА ЛОГА ---
     flags = []
     if analysis_result.get('is_hallucination'): flags.append("HALLUCINATION")
@@ -147,4 +136,88 @@ def observer_node(state: InterviewState):
     return {
         "observer_analysis": analysis_result,
         "current_turn_thoughts": [thought_text] # Создаем чистый список мыслей для этого хода
-    }
\ No newline at end of file
+    }
+
+
+def observer_inputs(state: InterviewState):
+    """Переменные промпта наблюдателя из state."""
+    messages = state['messages']
+    candidate_info = state.get('candidate_info', {})
+
+    inputs = {
+        "name": candidate_info.get('name', 'Candidate'),
+        "level": candidate_info.get('level', 'Junior'),
+        "role": candidate_info.get('role', 'Developer'),
+        "stack": candidate_info.get('stack', 'General'),
+        "last_bot_msg": messages[-2].content if len(messages) > 1 else "Начало интервью",
+        "last_user_text": messages[-1].content
+    }
+    return fit_fields("observer", inputs, ("last_bot_msg", "last_user_text"))
+
+
+def stop_requested(fields):
+    """Условие досрочной остановки чтения: кандидат просит закончить — остальные флаги не нужны."""
+    return fields.get("intent_to_leave") is True
+
+
+def complete_analysis(analysis_result):
+    """Ответ, прочитанный не до конца (или не разобранный), дополняется до полного."""
+    if analysis_result is None:
+        fell_back("observer")
+        return dict(FALLBACK_ANALYSIS)
+    if not analysis_result.get("thoughts"):
+        analysis_result["thoughts"] = "Кандидат просит завершить интервью."
+    return analysis_result
+
+
+def observer_node(state: InterviewState):
+    print("--- Observer Working ---")
+    
+    skipped = skip_analysis(state)
+    if skipped is not None:
+        return skipped
+
+    quick = fast_analysis(state)
+    if quick is not None:
+        return observer_update(quick)
+
+    if budget_exhausted("observer"):
+        return observer_update(dict(SKIPPED_ANALYSIS))
+
+    try:
+        analysis_result = invoke_structured("observer", PROMPT, observer_inputs(state), ObserverAnalysis, stop_when=stop_requested)
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        degraded("observer", e)
+        analysis_result = dict(SKIPPED_ANALYSIS)
+    except Exception as e:
+        print(f"❌ Observer Error: {e}")
+        # Fallback, чтобы не молчал
+        analysis_result = None
+
+    return observer_update(complete_analysis(analysis_result))
+
+
+async def aobserver_node(state: InterviewState):
+    print("--- Observer Working (async) ---")
+
+    skipped = skip_analysis(state)
+    if skipped is not None:
+        return skipped
+
+    quick = fast_analysis(state)
+    if quick is not None:
+        return observer_update(quick)
+
+    if budget_exhausted("observer"):
+        return observer_update(dict(SKIPPED_ANALYSIS))
+
+    try:
+        analysis_result = await ainvoke_structured("observer", PROMPT, observer_inputs(state), ObserverAnalysis, stop_when=stop_requested)
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        degraded("observer", e)
+        analysis_result = dict(SKIPPED_ANALYSIS)
+    except Exception as e:
+        print(f"❌ Observer Error: {e}")
+        analysis_result = None
+
+    return observer_update(complete_analysis(analysis_result))
@@ -2,12 +2,101 @@ import streamlit as st
 import uuid
 from langchain_core.messages import HumanMessage
 
-from main import build_graph, save_logs
+from main import build_graph, save_logs, stream_turn, initial_state
+from utils.turns import TurnPool, PoolBusy
+
+# Как часто UI забирает мысли и токены хода из фонового пула
+POLL_SECONDS = 0.25
+
+
+# --- ОБЩИЕ РЕСУРСЫ ПРОЦЕССА ---
+# Один скомпилированный граф и checkpointer на весь сервер Streamlit, а не на каждую вкладку:
+# сессии различаются только thread_id.
+@st.cache_resource
+def get_app():
+    return build_graph()
+
+
+@st.cache_resource
+def get_turn_pool():
+    """Ходы выполняются в фоне (utils.turns): поток сервера только ставит ход и опрашивает его."""
+    app = get_app()
+    return TurnPool(lambda graph_input, config: stream_turn(app, graph_input, config))
+
+
+def submit_turn(graph_input):
+    """Ставит ход в пул. False — очередь заполнена, кандидат видит предупреждение."""
+    try:
+        st.session_state.job = get_turn_pool().submit(st.session_state.thread_id, graph_input)
+    except PoolBusy:
+        st.warning("Сейчас много кандидатов одновременно — попробуйте еще раз через несколько секунд.")
+        return False
+    return True
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def poll_turn():
+    """
+    Рисует ответ ассистента, пока ход идет в пуле: перерисовывается только этот фрагмент,
+    мысли Observer/Expert появляются сразу, текст Алисы — по токенам.
+    """
+    job = st.session_state.get("job")
+    if job is None:
+        return
+    snapshot = job.snapshot()
+
+    with st.chat_message("assistant", avatar="👩‍💼"):
+        with st.expander("🧠 Мысли Observer / Expert"):
+            st.markdown("_" + ("\n\n".join(snapshot["thoughts"]) or "Алиса думает…") + "_")
+        if snapshot["queued"]:
+            st.markdown("_Ожидание свободного интервьюера…_")
+        elif snapshot["reply"]:
+            st.markdown(snapshot["reply"] + "▌")
+
+    if snapshot["done"]:
+        st.session_state.job = None
+        finish_turn(snapshot)
+        st.rerun()
+
 
+def finish_turn(snapshot):
+    """Переносит завершенный ход в историю чата."""
+    if snapshot["error"] or snapshot["result"] is None:
+        st.session_state.messages.append({
+            "role": "system",
+            "content": "⚠️ Не удалось получить ответ интервьюера. Отправьте ответ еще раз."
+        })
+        return
 
-# --- CONFIG HELPER ---
-def get_config():
-    return {"configurable": {"thread_id": st.session_state.thread_id}}
+    result = snapshot["result"]
+    st.session_state.graph_state = result
+
+    # Первый ход в лог не пишется — показываем заглушку вместо мыслей
+    current_thoughts = "Инициализация интервью…"
+    if result.get("internal_log"):
+        current_thoughts = result["internal_log"][-1].get("internal_thoughts", "")
+
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": result["messages"][-1].content,
+        "thoughts": current_thoughts
+    })
+
+    # Завершение интервью
+    if result.get("finished", False):
+        st.session_state.interview_active = False
+
+        save_logs(result, filename=st.session_state.log_file, participant_name=st.session_state.participant_name,
+                  thread_id=st.session_state.thread_id)
+
+        st.session_state.messages.append({
+            "role": "system",
+            "content": "🏁 Интервью завершено. Спасибо за участие!"
+        })
+        st.session_state.final_feedback = result.get("final_feedback", "Фидбэк не найден")
+
+        st.toast("Интервью завершено", icon="🎉")
+        st.balloons()
 
 
 # --- НАСТРОЙКА СТРАНИЦЫ ---
@@ -41,8 +130,8 @@ if "messages" not in st.session_state:
 if "graph_state" not in st.session_state:
     st.session_state.graph_state = None
 
-if "app" not in st.session_state:
-    st.session_state.app = build_graph()
+if "job" not in st.session_state:
+    st.session_state.job = None
 
 if "thread_id" not in st.session_state:
     st.session_state.thread_id = str(uuid.uuid4())
@@ -64,39 +153,20 @@ with st.sidebar:
     start_btn = st.button("Начать интервью", type="primary")
 
     if start_btn:
-        # Полный сброс UI-сессии
+        # Полный сброс UI-сессии (незавершенный ход прошлого интервью доработает в пуле сам)
         st.session_state.messages = []
         st.session_state.thread_id = str(uuid.uuid4())
-        st.session_state.interview_active = True
-
-        initial_input = {
-            "messages": [HumanMessage(content="Начни интервью.")],
-            "candidate_info": {
-                "name": name,
-                "role": role,
-                "level": level,
-                "stack": stack
-            },
-            "topics_covered": [],
-            "internal_log": [],
-            "finished": False,
-            "last_bot_msg": None
-        }
-
-        result = st.session_state.app.invoke(
-            initial_input,
-            config=get_config()
-        )
-
-        st.session_state.graph_state = result
-
-        st.session_state.messages.append({
-            "role": "assistant",
-            "content": result["messages"][-1].content,
-            "thoughts": "Инициализация интервью…"
-        })
+        st.session_state.final_feedback = None
+        st.session_state.participant_name = name
+        st.session_state.log_file = log_file
 
-        st.rerun()
+        # Приветствие генерируется в пуле и дорисовывается в чат фрагментом poll_turn
+        st.session_state.interview_active = submit_turn(initial_state({
+            "name": name,
+            "role": role,
+            "level": level,
+            "stack": stack
+        }))
 
 
 # --- RENDER CHAT ---
@@ -133,8 +203,20 @@ for msg in st.session_state.messages:
         )
 
 
+# --- ТЕКУЩИЙ ХОД ---
+if st.session_state.job is not None:
+    poll_turn()
+
+if st.session_state.get("final_feedback"):
+    with st.expander("📊 Итоговый фидбэк", expanded=True):
+        st.markdown(st.session_state.final_feedback)
+
+
 # --- INPUT HANDLING ---
-if st.session_state.interview_active:
+if st.session_state.job is not None:
+    st.chat_input("Алиса отвечает…", disabled=True)
+    input_text = None
+elif st.session_state.interview_active:
     input_text = st.chat_input("Ваш ответ…")
 else:
     st.chat_input("Интервью завершено", disabled=True)
@@ -142,50 +224,10 @@ else:
 
 
 if input_text:
-
-    # 1. Рисуем сообщение пользователя
-    st.session_state.messages.append({
-        "role": "user",
-        "content": input_text
-    })
-
-    # 2. Запуск графа
-    with st.spinner("Алиса думает…"):
-        result = st.session_state.app.invoke(
-            {"messages": [HumanMessage(content=input_text)]},
-            config=get_config()
-        )
-
-    st.session_state.graph_state = result
-
-    # 3. Ответ интервьюера
-    last_bot_msg = result["messages"][-1].content
-
-    current_thoughts = ""
-    if result.get("internal_log"):
-        current_thoughts = result["internal_log"][-1].get("internal_thoughts", "")
-
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": last_bot_msg,
-        "thoughts": current_thoughts
-    })
-
-    # 4. Завершение интервью
-    if result.get("finished", False):
-        st.session_state.interview_active = False
-
-        save_logs(result, filename=log_file, participant_name=name)
-
+    # Ход уходит в пул, а сообщение кандидата и ответ дорисуются после перезапуска скрипта
+    if submit_turn({"messages": [HumanMessage(content=input_text)]}):
         st.session_state.messages.append({
-            "role": "system",
-            "content": "🏁 Интервью завершено. Спасибо за участие!"
+            "role": "user",
+            "content": input_text
         })
-
-        st.toast("Интервью завершено", icon="🎉")
-        st.balloons()
-
-        with st.expander("📊 Итоговый фидбэк", expanded=True):
-            st.markdown(result.get("final_feedback", "Фидбэк не найден"))
-
-    st.rerun()
+        st.rerun()
@@ -0,0 +1,209 @@
+"""
+Пакетная переоценка готовых интервью: финальный отчет (feedback_node) и, по желанию,
+повторный анализ Observer по каждому ходу — без графа и без кандидата.
+
+Вход — логи формата save_logs: каталог с *.json, отдельные файлы или JSONL (документ на строку;
+необязательные поля "id" и "candidate_info"). Результаты дописываются в JSONL по одному
+интервью на строку сразу после оценки; повторный запуск с тем же --out пропускает уже
+оцененные интервью (строки с ошибкой оцениваются заново). Частоту запросов ограничивает
+общий лимитер провайдеров (LLM_RPM_* / LLM_TPM_*), --concurrency — число интервью в работе.
+
+Запуск:
+    python batch_score.py logs/ --out scores.jsonl --concurrency 16
+    python batch_score.py transcripts.jsonl --out scores.jsonl --observer --mode single
+"""
+import os
+import sys
+import json
+import glob
+import time
+import asyncio
+import argparse
+import itertools
+from langchain_core.messages import AIMessage, HumanMessage
+
+from agents.feedback import afeedback_node
+from agents.observer import aobserver_node
+from utils.metrics import ametered
+from utils.llm import get_router_stats, get_limiter_stats
+
+
+# --- ВХОД ---
+
+def iter_transcripts(paths, skip=()):
+    """
+    (id, источник, документ) по всем входам, лениво. id — абсолютный путь к файлу (для JSONL —
+    поле "id" или путь:номер строки): стабилен между запусками и не совпадает у одноименных
+    файлов из разных каталогов. Интервью с id из skip не читаются.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for file in sorted(glob.glob(os.path.join(path, "*.json"))):
+                yield from iter_transcripts([file], skip)
+        elif path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                for number, line in enumerate(f, 1):
+                    if line.strip():
+                        document = json.loads(line)
+                        transcript_id = str(document.get("id") or f"{os.path.abspath(path)}:{number}")
+                        if transcript_id not in skip:
+                            yield transcript_id, path, document
+        elif os.path.abspath(path) not in skip:
+            with open(path, encoding="utf-8") as f:
+                yield os.path.abspath(path), path, json.load(f)
+
+
+def load_done(out_path):
+    """id интервью, уже успешно оцененных в прошлых запусках. Оборванная последняя строка пропускается."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    # errors="replace": оборванный многобайтовый символ не роняет чтение, строка просто не разберется
+    with open(out_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not record.get("error"):
+                done.add(record["id"])
+    return done
+
+
+def transcript_state(document, defaults):
+    """State для feedback_node: ходы берутся из internal_log, окно messages не нужно."""
+    candidate_info = {**defaults, **(document.get("candidate_info") or {})}
+    candidate_info.setdefault("name", document.get("participant_name", "Candidate"))
+    return {
+        "messages": [],
+        "candidate_info": candidate_info,
+        "internal_log": document.get("turns", []),
+        "turn_grades": [],
+        "turn_metrics": []
+    }
+
+
+# --- ОЦЕНКА ---
+
+async def reanalyze_turn(state, turn):
+    """Observer по одному ходу: вопрос бота и ответ кандидата как последние два сообщения."""
+    turn_state = {
+        **state,
+        "messages": [
+            HumanMessage(content="Начни интервью."),
+            AIMessage(content=turn.get("agent_visible_message", "")),
+            HumanMessage(content=turn.get("user_message", ""))
+        ]
+    }
+    update = await aobserver_node(turn_state)
+    return {"turn_id": turn.get("turn_id"), **(update.get("observer_analysis") or {})}
+
+
+async def score_transcript(document, defaults, observer):
+    state = transcript_state(document, defaults)
+    # ametered дает ту же запись feedback_metrics, что и узел в графе
+    update = await ametered("feedback", afeedback_node)(state)
+    result = {
+        "participant_name": document.get("participant_name"),
+        "final_feedback": update.get("final_feedback"),
+        "turn_grades": update.get("turn_grades", []),
+        "feedback_metrics": update.get("feedback_metrics", [])
+    }
+    if observer:
+        result["observer"] = list(await asyncio.gather(*(reanalyze_turn(state, turn) for turn in state["internal_log"])))
+    return result
+
+
+class ResultWriter:
+    """Дописывает результаты в JSONL: строка на интервью, на диск — сразу после оценки."""
+
+    def __init__(self, path):
+        # Прерванная запись оставляет строку без перевода: новая запись не должна к ней приклеиться.
+        # Последний байт читаем в двоичном режиме — в текстовом seek может попасть в середину символа UTF-8
+        torn = False
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+        self.file = open(path, "a", encoding="utf-8")
+        if torn:
+            self.file.write("\n")
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+async def run(transcripts, writer, defaults, observer, concurrency):
+    report = {"scored": 0, "failed": 0}
+    started = time.perf_counter()
+
+    async def worker():
+        for transcript_id, source, document in transcripts:
+            t0 = time.perf_counter()
+            record = {"id": transcript_id, "source": source}
+            try:
+                record.update(await score_transcript(document, defaults, observer))
+                report["scored"] += 1
+            except Exception as e:
+                print(f"❌ {transcript_id}: {e}")
+                record["error"] = str(e)
+                report["failed"] += 1
+            record["elapsed_s"] = round(time.perf_counter() - t0, 3)
+            writer.write(record)
+
+            finished = report["scored"] + report["failed"]
+            # Сколько всего входов, заранее неизвестно: их не читаем целиком
+            if finished % 10 == 0:
+                rate = finished / (time.perf_counter() - started) * 3600
+                print(f"📊 {finished} ({rate:.0f} интервью/ч)", flush=True)
+
+    # Воркеры делят один итератор: входы читаются по мере оценки, а не все сразу
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    report["wall_s"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Каталоги с *.json, файлы логов или JSONL")
+    parser.add_argument("--out", required=True, help="JSONL с результатами (дописывается, по нему же возобновление)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Интервью в работе одновременно")
+    parser.add_argument("--observer", action="store_true", help="Повторный анализ Observer по каждому ходу")
+    parser.add_argument("--mode", choices=["incremental", "single", "mapreduce"], help="FEEDBACK_MODE для отчета")
+    parser.add_argument("--role", default="Developer", help="Если в логе нет candidate_info")
+    parser.add_argument("--level", default="Middle")
+    parser.add_argument("--stack", default="General")
+    args = parser.parse_args()
+
+    if args.mode:
+        os.environ["FEEDBACK_MODE"] = args.mode
+
+    done = load_done(args.out)
+    if done:
+        print(f"♻️ Уже оценено: {len(done)}, они будут пропущены")
+    transcripts = iter_transcripts(args.inputs, skip=done)
+    first = next(transcripts, None)
+    if first is None:
+        print("✅ Нечего оценивать")
+        return
+
+    writer = ResultWriter(args.out)
+    defaults = {"role": args.role, "level": args.level, "stack": args.stack}
+    try:
+        report = asyncio.run(run(itertools.chain([first], transcripts), writer, defaults, args.observer, args.concurrency))
+    except KeyboardInterrupt:
+        sys.exit(f"\n⏸️ Остановлено, продолжить: python {' '.join(sys.argv)}")
+    finally:
+        writer.close()
+
+    print(json.dumps({**report, "providers": get_router_stats(), "rate_limits": get_limiter_stats()}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Бенчмарк хранения чекпоинтов: стандартный JsonPlusSerializer против
+CompactSerializer (msgpack + zstd) с дельтами append-каналов.
+
+Имитирует интервью на N ходов (по умолчанию 30) с реальными репликами из logs/:
+на каждый ход пишутся чекпоинты входа, observer, expert и interviewer,
+как это делает граф. Меряет байты на чекпоинт, время записи и загрузки.
+
+Запуск из корня репозитория:
+    python -m benchmarks.checkpoint_bench --turns 30 --out bench_checkpoint.json
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.base.id import uuid6
+
+from utils.checkpoint import SqliteSaver, APPEND_CHANNELS
+from utils.serde import CompactSerializer
+
+
+def load_turns(pattern):
+    turns = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as f:
+            turns.extend(json.load(f).get("turns", []))
+    if not turns:
+        raise SystemExit(f"Нет логов по шаблону {pattern}")
+    return turns
+
+
+def simulate(saver, turns, n_turns, thread_id="bench"):
+    """Пишет чекпоинты интервью на n_turns ходов. Возвращает (число чекпоинтов, время записи)."""
+    checkpoint = empty_checkpoint()
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    values = {
+        "messages": [],
+        "topics_covered": [],
+        "internal_log": [],
+        "candidate_info": {"name": "Bench", "role": "Developer", "level": "Middle", "stack": "Python"}
+    }
+    versions = {}
+    step = 0
+    puts = 0
+    elapsed = 0.0
+
+    def commit(updates):
+        nonlocal checkpoint, config, step, puts, elapsed
+        new_versions = {}
+        for channel, value in updates.items():
+            values[channel] = value
+            versions[channel] = saver.get_next_version(versions.get(channel), None)
+            new_versions[channel] = versions[channel]
+        checkpoint = {
+            **checkpoint,
+            "id": str(uuid6(clock_seq=step)),
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+            "channel_values": dict(values),
+            "channel_versions": dict(versions)
+        }
+        started = time.perf_counter()
+        config = saver.put(config, checkpoint, {"source": "loop", "step": step}, new_versions)
+        elapsed += time.perf_counter() - started
+        step += 1
+        puts += 1
+
+    for i in range(n_turns):
+        turn = turns[i % len(turns)]
+        observer_thought, _, expert_thought = turn["internal_thoughts"].partition("\n")
+        commit({"messages": values["messages"] + [HumanMessage(content=turn["user_message"])]})
+        commit({
+            "observer_analysis": {"thoughts": observer_thought, "intent_to_leave": False},
+            "current_turn_thoughts": [observer_thought]
+        })
+        commit({
+            "expert_plan": {"thoughts": expert_thought, "instruction": turn["agent_visible_message"]},
+            "current_turn_thoughts": [observer_thought, expert_thought],
+            "topics_covered": values["topics_covered"] + [f"Topic {i}"]
+        })
+        commit({
+            "messages": values["messages"] + [AIMessage(content=turn["agent_visible_message"])],
+            "internal_log": values["internal_log"] + [{**turn, "turn_id": i + 1}],
+            "last_bot_msg": turn["agent_visible_message"]
+        })
+
+    saver.flush()
+    return puts, elapsed
+
+
+def stored_bytes(saver):
+    blobs = saver.conn.execute("SELECT COALESCE(SUM(LENGTH(blob)), 0) FROM blobs").fetchone()[0]
+    checkpoints = saver.conn.execute(
+        "SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints"
+    ).fetchone()[0]
+    return blobs + checkpoints
+
+
+def measure(name, saver_factory, turns, n_turns, loads):
+    with tempfile.TemporaryDirectory() as tmp:
+        saver = saver_factory(os.path.join(tmp, "bench.sqlite"))
+        puts, save_time = simulate(saver, turns, n_turns)
+        total = stored_bytes(saver)
+
+        config = {"configurable": {"thread_id": "bench", "checkpoint_ns": ""}}
+        # Загрузка после "перезапуска": сбрасываем кэш дельт, читаем с диска
+        saver._last_values.clear()
+        started = time.perf_counter()
+        for _ in range(loads):
+            state = saver.get_tuple(config).checkpoint["channel_values"]
+            saver._last_values.clear()
+        load_time = (time.perf_counter() - started) / loads
+
+        assert len(state["messages"]) == 2 * n_turns, "Состояние восстановлено не полностью"
+        saver.close()
+
+    return {
+        "serializer": name,
+        "checkpoints": puts,
+        "total_bytes": total,
+        "bytes_per_checkpoint": round(total / puts, 1),
+        "save_ms_per_checkpoint": round(save_time / puts * 1000, 4),
+        "load_ms_full_state": round(load_time * 1000, 4)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--loads", type=int, default=20, help="Сколько раз загрузить финальное состояние")
+    parser.add_argument("--logs", default="logs/interview_log_*.json")
+    parser.add_argument("--out", help="Куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    turns = load_turns(args.logs)
+    results = [
+        measure("jsonplus", lambda path: SqliteSaver(path), turns, args.turns, args.loads),
+        measure(
+            "compact",
+            lambda path: SqliteSaver(path, serde=CompactSerializer(), append_channels=APPEND_CHANNELS),
+            turns, args.turns, args.loads
+        )
+    ]
+    baseline, compact = results
+    report = {
+        "turns": args.turns,
+        "results": results,
+        "bytes_ratio": round(compact["total_bytes"] / baseline["total_bytes"], 4)
+    }
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
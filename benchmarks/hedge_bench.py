@@ -0,0 +1,113 @@
+"""
+Оффлайн-проверка роутера провайдеров (utils.router) на двух локальных заглушках LLM, без сети.
+
+fake  — основной провайдер: быстрый в медиане, но с тяжелым хвостом (--tail-rate / --tail-ms)
+        и, по желанию, с ошибками (--error-rate);
+fake2 — запасной: стабильный, но медленнее в медиане.
+
+Один и тот же поток вызовов прогоняется без дублей (LLM_HEDGE=0) и с дублями (LLM_HEDGE=1),
+сравниваются p50/p95/p99 вызова и доля лишних запросов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.hedge_bench --calls 300 --concurrency 20 --out bench_hedge.json
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+from langchain_core.prompts import ChatPromptTemplate
+
+PROMPT = ChatPromptTemplate.from_messages([("human", "{text}")])
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+    return {
+        "mean": round(statistics.mean(ordered), 1),
+        "p50": round(pick(0.5), 1),
+        "p95": round(pick(0.95), 1),
+        "p99": round(pick(0.99), 1),
+        "max": round(ordered[-1], 1)
+    }
+
+
+async def run_calls(llm, calls, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await llm.ainvoke_chain("bench", PROMPT, {"text": f"Вопрос {i}"})
+            except Exception:
+                errors += 1
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=200, help="Медиана основного провайдера")
+    parser.add_argument("--tail-rate", type=float, default=0.1, help="Доля застрявших ответов основного провайдера")
+    parser.add_argument("--tail-ms", type=float, default=3000)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--secondary-latency-ms", type=float, default=400)
+    parser.add_argument("--hedge-after-ms", type=float, help="Фиксированный порог вместо p95")
+    parser.add_argument("--out", help="Куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    # Заглушки настраиваются до первого обращения к реестру LLM
+    os.environ["LLM_PROVIDERS"] = "fake,fake2"
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["FAKE_LLM_JITTER_MS"] = str(args.latency_ms / 4)
+    os.environ["FAKE_LLM_TAIL_RATE"] = str(args.tail_rate)
+    os.environ["FAKE_LLM_TAIL_MS"] = str(args.tail_ms)
+    os.environ["FAKE_LLM_ERROR_RATE"] = str(args.error_rate)
+    os.environ["FAKE2_LLM_LATENCY_MS"] = str(args.secondary_latency_ms)
+    os.environ["FAKE2_LLM_JITTER_MS"] = str(args.secondary_latency_ms / 10)
+    os.environ["FAKE2_LLM_TAIL_RATE"] = "0"
+    os.environ["FAKE2_LLM_ERROR_RATE"] = "0"
+    if args.hedge_after_ms is not None:
+        os.environ["LLM_HEDGE_AFTER_MS"] = str(args.hedge_after_ms)
+
+    from utils import llm
+
+    report = {"meta": vars(args), "runs": {}}
+    for mode, hedge in (("no_hedge", "0"), ("hedge", "1")):
+        os.environ["LLM_HEDGE"] = hedge
+        llm.reset_router()
+        started = time.perf_counter()
+        latencies, errors = asyncio.run(run_calls(llm, args.calls, args.concurrency))
+        router = llm.get_router_stats()
+        requests = sum(stats["calls"] for stats in router.values())
+        report["runs"][mode] = {
+            "wall_s": round(time.perf_counter() - started, 3),
+            "latency_ms": percentiles(latencies),
+            "errors": errors,
+            # Сколько запросов к провайдерам ушло сверх числа вызовов (цена дублей и переключений)
+            "extra_requests": round(requests / args.calls - 1, 4),
+            "providers": router
+        }
+
+    print(json.dumps(report["runs"], ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""
+Нагрузочный прогон: N кандидатов одновременно проходят интервью с паузами «на раздумье»,
+число кандидатов растет ступенями (--ramp). Для каждой ступени — пропускная способность,
+p50/p95/p99 времени хода и до первого токена, доля ошибок, отказов (503), заглушек
+(узел ответил заготовкой после ошибки LLM: FALLBACK_REPLY, «Emergency Topic» и т.п.) и деградаций
+(Observer / Expert пропущены по бюджету хода или из-за отключенного провайдера).
+Узлы гасят ошибки LLM заготовками, поэтому до хода они почти не доходят: падение провайдера
+видно по fallback_per_turn, а не по error_rate.
+
+Цель — граф в этом процессе (по умолчанию) или сервис server.py (--url). LLM — локальная
+заглушка OpenAI-протокола (benchmarks.openai_stub), которую прогон поднимает сам (--stub),
+или любой провайдер из окружения.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_bench --stub --ramp 10,50,100,200 --duration 60 --out bench_load.json
+    python -m benchmarks.load_bench --stub --stub-429 0.05 --stub-5xx 0.02 --ramp 50,100
+
+    # через HTTP: сервис смотрит в заглушку
+    python -m benchmarks.openai_stub --port 8900 &
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=stub LLM_PROVIDERS=openai python server.py --port 8000 &
+    python -m benchmarks.load_bench --url http://127.0.0.1:8000 --ramp 10,50,100
+
+Квоты лимитера (LLM_RPM_* / LLM_TPM_*) действуют и на заглушку: чтобы мерить пределы машины,
+а не квоты, задайте LLM_RPM_OPENAI=0 LLM_TPM_OPENAI=0.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import socket
+import random
+import asyncio
+import argparse
+import statistics
+import subprocess
+import httpx
+from langchain_core.messages import HumanMessage
+
+from main import build_graph, astream_turn, initial_state
+from runner import load_scripts, STOP_MESSAGE
+from utils.metrics import render_prometheus
+from utils.llm import get_router_stats, get_limiter_stats
+
+DEFAULT_ANSWERS = [
+    "Я бы использовал кэш с вытеснением LRU и шардированием по ключу.",
+    "Индексы ускоряют чтение, но замедляют запись, поэтому их подбирают под запросы.",
+    "Для очередей сообщений важно понимать гарантии доставки: at-least-once и идемпотентность обработчика.",
+    "Не уверен, но думаю, что нужно профилировать, прежде чем оптимизировать.",
+    "Я бы разделил чтение и запись и добавил реплики для чтения."
+]
+# Счетчики Prometheus, по приростам которых считаются доли на ступени
+COUNTERS = {
+    "degraded": "interview_degraded_total",
+    "fallbacks": "interview_fallback_total",
+    "retries": "interview_llm_retries_total"
+}
+
+
+class Rejected(Exception):
+    """Сервис не принял ход (503): очередь ходов заполнена."""
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+    return {
+        "mean": round(statistics.mean(ordered), 1),
+        "p50": round(pick(0.5), 1),
+        "p95": round(pick(0.95), 1),
+        "p99": round(pick(0.99), 1),
+        "max": round(ordered[-1], 1)
+    }
+
+
+def think_time(median_ms, sigma=0.5):
+    """Пауза кандидата перед ответом, секунды (логнормальная вокруг медианы)."""
+    if median_ms <= 0:
+        return 0.0
+    return random.lognormvariate(math.log(median_ms), sigma) / 1000
+
+
+def counter_totals(text):
+    """Суммы нужных счетчиков из текста Prometheus (по всем меткам)."""
+    totals = dict.fromkeys(COUNTERS, 0.0)
+    for line in text.splitlines():
+        for key, name in COUNTERS.items():
+            if line.startswith(name + "{") or line.startswith(name + " "):
+                totals[key] += float(line.rsplit(" ", 1)[1])
+    return totals
+
+
+def failovers(router):
+    """Переключения и дубли роутера по всем провайдерам."""
+    return sum(stats.get("failovers", 0) + stats.get("hedges", 0) for stats in (router or {}).values())
+
+
+# --- ЦЕЛИ ---
+
+class InProcessTarget:
+    """Граф в этом процессе: ходы идут через main.astream_turn, как в runner.py."""
+
+    def __init__(self, mode=None):
+        self.app = build_graph(mode)
+
+    async def start(self, thread_id, candidate_info):
+        return await self._turn(initial_state(candidate_info), thread_id)
+
+    async def answer(self, thread_id, text):
+        return await self._turn({"messages": [HumanMessage(content=text)]}, thread_id)
+
+    async def _turn(self, inputs, thread_id):
+        started = time.perf_counter()
+        ttft = None
+        finished = False
+        async for kind, payload in astream_turn(self.app, inputs, {"configurable": {"thread_id": thread_id}}):
+            if kind == "token" and ttft is None:
+                ttft = (time.perf_counter() - started) * 1000
+            elif kind == "done":
+                finished = payload.get("finished", False)
+        return finished, ttft
+
+    async def snapshot(self):
+        return {**counter_totals(render_prometheus()), "failovers": failovers(get_router_stats())}
+
+    async def report(self):
+        return {"providers": get_router_stats(), "rate_limits": get_limiter_stats()}
+
+    async def close(self):
+        pass
+
+
+class HttpTarget:
+    """Сервис server.py: ход — POST, события хода — SSE /events."""
+
+    def __init__(self, url):
+        self.client = httpx.AsyncClient(base_url=url, timeout=httpx.Timeout(120.0, connect=10.0),
+                                        limits=httpx.Limits(max_connections=None, max_keepalive_connections=None))
+
+    @staticmethod
+    def _check(response):
+        if response.status_code == 503:
+            raise Rejected(response.text)
+        response.raise_for_status()
+
+    async def start(self, thread_id, candidate_info):
+        started = time.perf_counter()
+        self._check(await self.client.post("/interviews", json={**candidate_info, "thread_id": thread_id}))
+        return await self._follow(thread_id, started)
+
+    async def answer(self, thread_id, text):
+        started = time.perf_counter()
+        self._check(await self.client.post(f"/interviews/{thread_id}/answers", json={"text": text}))
+        return await self._follow(thread_id, started)
+
+    async def _follow(self, thread_id, started):
+        ttft = None
+        event = None
+        async with self.client.stream("GET", f"/interviews/{thread_id}/events") as response:
+            self._check(response)
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "token" and ttft is None:
+                        ttft = (time.perf_counter() - started) * 1000
+                    elif event == "done":
+                        return json.loads(line[len("data: "):]).get("finished", False), ttft
+                    elif event == "error":
+                        raise RuntimeError(json.loads(line[len("data: "):]).get("error"))
+        raise RuntimeError("event stream closed before the turn finished")
+
+    async def snapshot(self):
+        metrics = (await self.client.get("/metrics")).text
+        stats = (await self.client.get("/stats")).json()
+        return {**counter_totals(metrics), "failovers": failovers(stats.get("providers"))}
+
+    async def report(self):
+        stats = (await self.client.get("/stats")).json()
+        return {"server": stats.get("server"), "providers": stats.get("providers"), "rate_limits": stats.get("rate_limits")}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+# --- НАГРУЗКА ---
+
+class Level:
+    """Одна ступень: столько-то кандидатов в течение duration секунд."""
+
+    def __init__(self, concurrency, duration):
+        self.concurrency = concurrency
+        self.until = time.perf_counter() + duration
+        self.latencies = []
+        self.ttfts = []
+        self.errors = 0
+        self.rejected = 0
+        self.interviews = 0
+        self.error_samples = []
+
+    @property
+    def open(self):
+        return time.perf_counter() < self.until
+
+    async def turn(self, call):
+        started = time.perf_counter()
+        try:
+            finished, ttft = await call
+        except Rejected:
+            self.rejected += 1
+            raise
+        except Exception as e:
+            self.errors += 1
+            if len(self.error_samples) < 5:
+                self.error_samples.append(f"{type(e).__name__}: {e}")
+            raise
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        if ttft is not None:
+            self.ttfts.append(ttft)
+        return finished
+
+
+async def candidate(target, level, scripts, args):
+    """Кандидат проходит интервью одно за другим, пока ступень не закончилась."""
+    while level.open:
+        info, answers = random.choice(scripts)
+        thread_id = f"load_{uuid.uuid4().hex[:12]}"
+        try:
+            finished = await level.turn(target.start(thread_id, info))
+            for text in answers[:args.turns] + [STOP_MESSAGE]:
+                if finished:
+                    break
+                # Ступень закончилась — кандидат просит завершить: отчет дожидается фоновых оценок ходов,
+                # и они не перетекают в следующую ступень
+                if not level.open:
+                    text = STOP_MESSAGE
+                await asyncio.sleep(think_time(args.think_ms))
+                finished = await level.turn(target.answer(thread_id, text))
+            if finished:
+                level.interviews += 1
+        except Exception:
+            # Интервью брошено; пауза, чтобы отказы не превращались в шторм запросов
+            await asyncio.sleep(1)
+
+
+async def run_level(target, concurrency, scripts, args):
+    before = await target.snapshot()
+    level = Level(concurrency, args.duration)
+    started = time.perf_counter()
+    await asyncio.gather(*(candidate(target, level, scripts, args) for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    after = await target.snapshot()
+
+    turns = len(level.latencies)
+    attempts = turns + level.errors + level.rejected
+    return {
+        "concurrency": concurrency,
+        "wall_s": round(wall, 3),
+        "turns": turns,
+        "interviews": level.interviews,
+        "turns_per_s": round(turns / wall, 2),
+        "turn_ms": percentiles(level.latencies),
+        "ttft_ms": percentiles(level.ttfts),
+        "error_rate": round(level.errors / attempts, 4) if attempts else 0.0,
+        "rejected_rate": round(level.rejected / attempts, 4) if attempts else 0.0,
+        "degraded_per_turn": round((after["degraded"] - before["degraded"]) / turns, 4) if turns else 0.0,
+        "fallback_per_turn": round((after["fallbacks"] - before["fallbacks"]) / turns, 4) if turns else 0.0,
+        "retries_per_turn": round((after["retries"] - before["retries"]) / turns, 4) if turns else 0.0,
+        "failovers": int(after["failovers"] - before["failovers"]),
+        "error_samples": level.error_samples
+    }
+
+
+def mark_saturation(levels):
+    """
+    Эффективность ступени — пропускная способность на кандидата относительно первой ступени.
+    Граф насыщен там, где она впервые падает ниже 0.8: кандидатов больше, а ходов — непропорционально меньше.
+    """
+    base = levels[0]["turns_per_s"] / levels[0]["concurrency"] if levels and levels[0]["turns_per_s"] else None
+    saturated_at = None
+    for level in levels:
+        level["efficiency"] = round(level["turns_per_s"] / level["concurrency"] / base, 3) if base else None
+        if saturated_at is None and level["efficiency"] is not None and level["efficiency"] < 0.8:
+            saturated_at = level["concurrency"]
+    return saturated_at
+
+
+def print_level(level):
+    turn, ttft = level["turn_ms"], level["ttft_ms"]
+    print(
+        f"👥 {level['concurrency']:>4}  {level['turns_per_s']:>7.2f} ходов/с  "
+        f"ход p50/p95/p99 {turn.get('p50', 0):.0f}/{turn.get('p95', 0):.0f}/{turn.get('p99', 0):.0f} ms  "
+        f"TTFT p95 {ttft.get('p95', 0):.0f} ms  ошибки {level['error_rate']:.1%}  "
+        f"503 {level['rejected_rate']:.1%}  заглушки {level['fallback_per_turn']:.1%}  "
+        f"деградации {level['degraded_per_turn']:.1%}",
+        flush=True
+    )
+
+
+# --- ЗАГЛУШКА ---
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(args):
+    """Поднимает benchmarks.openai_stub отдельным процессом и направляет на него ChatOpenAI."""
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.openai_stub", "--port", str(port),
+        "--dist", args.stub_dist, "--ttft-ms", str(args.stub_ttft_ms), "--token-ms", str(args.stub_token_ms),
+        "--rate-429", str(args.stub_429), "--rate-5xx", str(args.stub_5xx)
+    ])
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/health", timeout=1.0).raise_for_status()
+            break
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    else:
+        process.kill()
+        raise SystemExit("Заглушка не запустилась")
+
+    os.environ["OPENAI_BASE_URL"] = f"{url}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["LLM_PROVIDERS"] = "openai"
+    return process, url
+
+
+async def run(args, stub_url):
+    scripts = load_scripts(args.logs) or [(
+        {"name": "Load Candidate", "role": "Developer", "level": "Middle", "stack": "General"},
+        DEFAULT_ANSWERS
+    )]
+    target = HttpTarget(args.url) if args.url else InProcessTarget(args.mode)
+    levels = []
+    try:
+        for concurrency in args.ramp:
+            level = await run_level(target, concurrency, scripts, args)
+            print_level(level)
+            levels.append(level)
+        extra = await target.report()
+    finally:
+        await target.close()
+
+    if stub_url:
+        extra["stub"] = httpx.get(f"{stub_url}/stats").json()
+    return {"levels": levels, "saturated_at": mark_saturation(levels), **extra}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="*", default=["logs/interview_log_*.json"], help="Ответы кандидатов из логов save_logs")
+    parser.add_argument("--url", help="Адрес server.py; без него — граф в этом процессе")
+    parser.add_argument("--mode", default=None, help="Режим графа в процессе: classic / fused / single")
+    parser.add_argument("--ramp", default="10,25,50,100", help="Ступени числа кандидатов через запятую")
+    parser.add_argument("--duration", type=float, default=30, help="Длительность ступени, секунды")
+    parser.add_argument("--turns", type=int, default=6, help="Ответов кандидата до просьбы закончить")
+    parser.add_argument("--think-ms", type=float, default=3000, help="Медиана паузы кандидата перед ответом")
+    parser.add_argument("--stub", action="store_true", help="Поднять OpenAI-заглушку и направить граф в нее")
+    parser.add_argument("--stub-dist", default="lognormal", choices=["fixed", "uniform", "lognormal"])
+    parser.add_argument("--stub-ttft-ms", type=float, default=300)
+    parser.add_argument("--stub-token-ms", type=float, default=10)
+    parser.add_argument("--stub-429", type=float, default=0.0, help="Доля ответов 429 у заглушки")
+    parser.add_argument("--stub-5xx", type=float, default=0.0, help="Доля ответов 5xx у заглушки")
+    parser.add_argument("--out", help="Куда записать JSON с результатами")
+    args = parser.parse_args()
+    args.ramp = [int(value) for value in args.ramp.split(",") if value.strip()]
+    if args.stub and args.url:
+        parser.error("--stub — только для графа в процессе; сервис запускается с OPENAI_BASE_URL заглушки")
+
+    stub, stub_url = start_stub(args) if args.stub else (None, None)
+    try:
+        report = asyncio.run(run(args, stub_url))
+    finally:
+        if stub is not None:
+            stub.terminate()
+
+    report = {"meta": vars(args), **report}
+    print(json.dumps({k: report[k] for k in ("saturated_at", "providers", "rate_limits") if k in report}, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
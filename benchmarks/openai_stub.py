@@ -0,0 +1,201 @@
+"""
+Локальная заглушка OpenAI Chat Completions (tornado) для нагрузочных прогонов без сети и квот.
+
+Отвечает заготовками utils.fake_llm (роль узла узнается по системному промпту), поэтому граф
+проходит интервью целиком через настоящий клиент ChatOpenAI: достаточно направить его
+на заглушку через OPENAI_BASE_URL. Поддерживается стриминг (SSE, с usage при
+stream_options.include_usage), распределения задержки и внедренные ошибки 429 / 5xx.
+
+Задержка до первого токена: --dist fixed | uniform (±--jitter-ms) | lognormal (медиана --ttft-ms, --sigma),
+плюс хвост (--tail-rate / --tail-ms); между токенами — --token-ms.
+
+Запуск из корня репозитория:
+    python -m benchmarks.openai_stub --port 8900 --ttft-ms 400 --dist lognormal --token-ms 15 --rate-429 0.02 --rate-5xx 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=stub LLM_PROVIDERS=openai python server.py
+"""
+import re
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tornado.web
+import tornado.iostream
+
+from utils.fake_llm import detect_role, canned_response
+
+SERVER_ERRORS = (500, 502, 503)
+
+
+def message_text(message):
+    """content сообщения OpenAI: строка или список частей {"type": "text", "text": ...}."""
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def sample_delay(args):
+    """Задержка до первого токена, секунды."""
+    if random.random() < args.tail_rate:
+        return args.tail_ms / 1000
+    if args.dist == "uniform":
+        ms = random.uniform(args.ttft_ms - args.jitter_ms, args.ttft_ms + args.jitter_ms)
+    elif args.dist == "lognormal":
+        ms = random.lognormvariate(math.log(max(args.ttft_ms, 1)), args.sigma)
+    else:
+        ms = args.ttft_ms
+    return max(ms, 0) / 1000
+
+
+class StubStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.disconnects = 0
+        self.started = time.monotonic()
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "requests": self.requests,
+            "streams": self.streams,
+            "rate_limited": self.rate_limited,
+            "server_errors": self.server_errors,
+            "disconnects": self.disconnects,
+            "rps": round(self.requests / elapsed, 2) if elapsed else 0.0
+        }
+
+
+class ChatCompletionsHandler(tornado.web.RequestHandler):
+
+    def initialize(self, args, stats):
+        self.args = args
+        self.stats = stats
+
+    def error(self, status, message, kind):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({"error": {"message": message, "type": kind, "param": None, "code": None}}))
+
+    async def post(self):
+        self.stats.requests += 1
+        body = json.loads(self.request.body or b"{}")
+
+        roll = random.random()
+        if roll < self.args.rate_429:
+            self.stats.rate_limited += 1
+            self.set_header("Retry-After", str(self.args.retry_after))
+            return self.error(429, "Rate limit reached (stub)", "requests")
+        if roll < self.args.rate_429 + self.args.rate_5xx:
+            self.stats.server_errors += 1
+            return self.error(random.choice(SERVER_ERRORS), "Upstream error (stub)", "server_error")
+
+        messages = body.get("messages") or []
+        system_text = next((message_text(m) for m in messages if m.get("role") in ("system", "developer")), "")
+        user_text = message_text(messages[-1]) if messages else ""
+        text = canned_response(detect_role(system_text), system_text, user_text)
+        tokens = re.findall(r"\S+\s*", text)
+        prompt_tokens = sum(len(message_text(m).split()) for m in messages)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = body.get("model", "stub")
+
+        await asyncio.sleep(sample_delay(self.args))
+        if body.get("stream"):
+            self.stats.streams += 1
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            await self.stream(completion_id, model, tokens, usage if include_usage else None)
+            return
+
+        await asyncio.sleep(len(tokens) * self.args.token_ms / 1000)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage
+        }, ensure_ascii=False))
+
+    async def stream(self, completion_id, model, tokens, usage):
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None, choices=True, **extra):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else [], **extra}
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        try:
+            self.write(chunk({"role": "assistant", "content": ""}))
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(self.args.token_ms / 1000)
+                self.write(chunk({"content": token}))
+                await self.flush()
+            self.write(chunk({}, "stop"))
+            if usage is not None:
+                self.write(chunk({}, choices=False, usage=usage))
+            self.write("data: [DONE]\n\n")
+            await self.flush()
+        except tornado.iostream.StreamClosedError:
+            # Клиент отменил запрос (проигравший дубль роутера, дедлайн хода)
+            self.stats.disconnects += 1
+            return
+        self.finish()
+
+
+class StatsHandler(tornado.web.RequestHandler):
+
+    def initialize(self, args, stats):
+        self.stats = stats
+
+    def get(self):
+        self.finish(self.stats.snapshot())
+
+
+def make_app(args):
+    stats = StubStats()
+    params = {"args": args, "stats": stats}
+    return tornado.web.Application([
+        (r"/v1/chat/completions", ChatCompletionsHandler, params),
+        (r"/(?:health|stats)", StatsHandler, params)
+    ], log_function=lambda handler: None)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--ttft-ms", type=float, default=300, help="Медиана задержки до первого токена")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="Разброс для --dist uniform")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Разброс для --dist lognormal")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Доля застрявших ответов")
+    parser.add_argument("--tail-ms", type=float, default=5000)
+    parser.add_argument("--token-ms", type=float, default=10, help="Пауза между токенами")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Доля ответов 500/502/503")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After у 429, секунды")
+    return parser
+
+
+async def serve(args):
+    make_app(args).listen(args.port, address=args.host)
+    print(f"🧪 OpenAI-заглушка: http://{args.host}:{args.port}/v1 ({args.dist}, {args.ttft_ms:g} ms)", flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(make_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
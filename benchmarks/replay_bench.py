@@ -0,0 +1,319 @@
+"""
+Оффлайн-бенчмарк графа: проигрывает логи save_logs (logs/interview_log_*.json)
+через build_graph() на локальной заглушке LLM (LLM_PROVIDER=fake), без сети.
+
+Меряет по каждому ходу: общее время, время по узлам, время внутри LLM,
+накладные расходы графа вне LLM, время checkpointer-а; плюс пиковую память.
+Результат — JSON, чтобы сравнивать версии между собой.
+
+Запуск из корня репозитория:
+    python -m benchmarks.replay_bench --latency-ms 50 --recorded --out bench_replay.json
+"""
+import os
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import statistics
+import subprocess
+from collections import defaultdict
+
+# Заглушка должна быть выбрана до первого обращения к реестру LLM
+os.environ["LLM_PROVIDER"] = "fake"
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from main import build_graph, initial_state
+from utils.llm import get_llm
+from utils.checkpoint import make_checkpointer
+
+FLAG_FIELDS = {
+    "HALLUCINATION": "is_hallucination",
+    "CONTRADICTION": "consistency_violation",
+    "OFF-TOPIC": "is_deep_dive",
+    "ROLE_REVERSAL": "is_role_reversal",
+    "STOP_REQUEST": "intent_to_leave"
+}
+
+
+class TurnProbe(BaseCallbackHandler):
+    """Собирает время узлов графа и вызовов LLM внутри одного хода."""
+
+    def __init__(self):
+        self.node_starts = {}
+        self.llm_starts = {}
+        self.nodes = defaultdict(float)
+        self.llm = defaultdict(float)
+        self.llm_calls = 0
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # Сам узел — это run с именем узла; вложенные цепочки наследуют только metadata
+        if node and kwargs.get("name") == node:
+            self.node_starts[run_id] = (node, time.perf_counter())
+
+    def _end_chain(self, run_id):
+        started = self.node_starts.pop(run_id, None)
+        if started:
+            node, t0 = started
+            self.nodes[node] += time.perf_counter() - t0
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_chain(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_chain(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self.llm_starts[run_id] = ((metadata or {}).get("langgraph_node", "unknown"), time.perf_counter())
+
+    def _end_llm(self, run_id):
+        started = self.llm_starts.pop(run_id, None)
+        if started:
+            node, t0 = started
+            self.llm[node] += time.perf_counter() - t0
+            self.llm_calls += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end_llm(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end_llm(run_id)
+
+
+class TimedSaver(BaseCheckpointSaver):
+    """Обертка над checkpointer-ом, считающая время его вызовов."""
+
+    def __init__(self, inner):
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+        self.seconds = 0.0
+
+    def _timed(self, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+    def get_tuple(self, config):
+        return self._timed(self.inner.get_tuple, config)
+
+    def list(self, config, **kwargs):
+        return iter(self._timed(lambda: list(self.inner.list(config, **kwargs))))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self._timed(self.inner.put, config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        return self._timed(self.inner.put_writes, config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id):
+        return self._timed(self.inner.delete_thread, thread_id)
+
+    def get_next_version(self, current, channel):
+        return self.inner.get_next_version(current, channel)
+
+
+def recorded_payloads(turn):
+    """Восстанавливает JSON Observer/Expert из строки internal_thoughts лога."""
+    observer_line, expert_line = "", ""
+    for line in turn.get("internal_thoughts", "").split("\n"):
+        if line.startswith("[Observer]:"):
+            observer_line = line[len("[Observer]:"):].strip()
+        elif line.startswith("[Expert]:"):
+            expert_line = line[len("[Expert]:"):].strip()
+
+    flags_match = re.search(r"\[FLAGS: ([^\]]*)\]", observer_line)
+    flags = [f.strip() for f in flags_match.group(1).split(",")] if flags_match else []
+    observer = {field: flag in flags for flag, field in FLAG_FIELDS.items()}
+    observer["thoughts"] = re.sub(r"\s*\[FLAGS: [^\]]*\]", "", observer_line)
+    observer["answer_quality"] = "medium"
+
+    expert = {
+        "thoughts": re.sub(r"\s*\[Strat: [^\]]*\]", "", expert_line),
+        "topic_name": "Conclusion" if "STOP_REQUEST" in flags else f"Replay {turn.get('turn_id')}",
+        "difficulty_adjustment": "same"
+    }
+    return observer, expert
+
+
+def push_recorded(fake, data):
+    """Кладет в заглушку записанные ответы всего интервью в порядке вызовов узлов."""
+    turns = data.get("turns", [])
+    fake.recorded.clear()
+    if not turns:
+        return
+
+    first_question = turns[0]["agent_visible_message"]
+    fake.push("expert", json.dumps({
+        "thoughts": "Старт", "instruction": first_question, "topic_name": "General", "difficulty_adjustment": "same"
+    }, ensure_ascii=False))
+    fake.push("interviewer", first_question)
+
+    for i, turn in enumerate(turns):
+        observer, expert = recorded_payloads(turn)
+        next_question = turns[i + 1]["agent_visible_message"] if i + 1 < len(turns) else "Спасибо за интервью!"
+        expert["instruction"] = next_question
+        fake.push("observer", json.dumps(observer, ensure_ascii=False))
+        fake.push("expert", json.dumps(expert, ensure_ascii=False))
+        fake.push("interviewer", next_question)
+
+    if data.get("final_feedback"):
+        fake.push("feedback", data["final_feedback"])
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    return {
+        "p50": round(pick(0.50), 3),
+        "p95": round(pick(0.95), 3),
+        "p99": round(pick(0.99), 3),
+        "mean": round(statistics.fmean(ordered), 3),
+        "max": round(ordered[-1], 3)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def replay(app, saver, data, thread_id):
+    """Проигрывает одно интервью. Возвращает записи по ходам."""
+    info = {
+        "name": data.get("participant_name", "Candidate"),
+        "role": "Developer",
+        "level": "Middle",
+        "stack": "General"
+    }
+    inputs = [initial_state(info)] + [
+        {"messages": [HumanMessage(content=turn["user_message"])]} for turn in data.get("turns", [])
+    ]
+
+    records = []
+    for turn_no, graph_input in enumerate(inputs):
+        probe = TurnProbe()
+        saver.seconds = 0.0
+        config = {"configurable": {"thread_id": thread_id}, "callbacks": [probe]}
+
+        t0 = time.perf_counter()
+        result = app.invoke(graph_input, config=config)
+        wall = time.perf_counter() - t0
+
+        llm_total = sum(probe.llm.values())
+        records.append({
+            "thread_id": thread_id,
+            "turn": turn_no,
+            "wall_ms": wall * 1000,
+            "llm_ms": llm_total * 1000,
+            "llm_calls": probe.llm_calls,
+            "graph_overhead_ms": (wall - llm_total) * 1000,
+            "checkpoint_ms": saver.seconds * 1000,
+            "nodes_ms": {node: seconds * 1000 for node, seconds in probe.nodes.items()}
+        })
+        if result.get("finished", False):
+            break
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="*", default=["logs/interview_log_*.json"])
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Искусственная задержка ответа заглушки")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--mode", default="classic", help="Режим графа: classic / fused / single")
+    parser.add_argument("--checkpointer", default="sqlite", choices=["sqlite", "memory"])
+    parser.add_argument("--recorded", action="store_true", help="Отвечать записанными JSON из логов (только classic)")
+    parser.add_argument("--repeat", type=int, default=1, help="Сколько раз проиграть каждый лог")
+    parser.add_argument("--tracemalloc", action="store_true", help="Точный пик памяти Python (замедляет прогон)")
+    parser.add_argument("--out", help="Куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.logs for path in glob.glob(pattern)})
+    if not paths:
+        sys.exit("Не найдено ни одного лога")
+
+    fake = get_llm()
+    fake.latency = args.latency_ms / 1000
+    fake.jitter = args.jitter_ms / 1000
+    if args.recorded and args.mode != "classic":
+        print("⚠️ --recorded поддерживается только в режиме classic, используются заготовленные ответы")
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inner = make_checkpointer(args.checkpointer, path=os.path.join(tmp, "replay.sqlite"))
+        saver = TimedSaver(inner)
+        app = build_graph(args.mode, checkpointer=saver)
+
+        records = []
+        started = time.perf_counter()
+        for repeat in range(args.repeat):
+            for path in paths:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                if args.recorded and args.mode == "classic":
+                    push_recorded(fake, data)
+                thread_id = f"replay-{repeat}-{os.path.basename(path)}"
+                records.extend(replay(app, saver, data, thread_id))
+        total = time.perf_counter() - started
+
+        if hasattr(inner, "close"):
+            inner.close()
+
+    nodes = defaultdict(list)
+    for record in records:
+        for node, ms in record["nodes_ms"].items():
+            nodes[node].append(ms)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "mode": args.mode,
+            "checkpointer": args.checkpointer,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "recorded": args.recorded,
+            "logs": paths,
+            "repeat": args.repeat
+        },
+        "summary": {
+            "turns": len(records),
+            "total_s": round(total, 3),
+            "turn_wall_ms": percentiles([r["wall_ms"] for r in records]),
+            "graph_overhead_ms": percentiles([r["graph_overhead_ms"] for r in records]),
+            "checkpoint_ms": percentiles([r["checkpoint_ms"] for r in records]),
+            "nodes_ms": {node: percentiles(values) for node, values in sorted(nodes.items())},
+            # ru_maxrss в Linux — килобайты
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "peak_traced_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2) if args.tracemalloc else None
+        },
+        "turns": records
+    }
+
+    print(json.dumps(report["summary"], ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
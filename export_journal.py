@@ -0,0 +1,51 @@
+"""
+Экспорт журнала ходов (utils.journal) в логи прежнего формата save_logs (interview_log_*.json).
+
+Запуск:
+    python export_journal.py interview_1a2b3c4d --out interview_log.json
+    python export_journal.py --all --out-dir logs/export
+    python export_journal.py --list
+"""
+import os
+import argparse
+
+from utils.journal import JournalReader, write_log_document, DEFAULT_DIR
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("thread_ids", nargs="*", help="thread_id сессий")
+    parser.add_argument("--all", action="store_true", help="Все сессии журнала")
+    parser.add_argument("--out", help="Файл лога (для одной сессии)")
+    parser.add_argument("--out-dir", default=".", help="Куда писать interview_log_<thread_id>.json")
+    parser.add_argument("--name", help="participant_name вместо имени из candidate_info")
+    parser.add_argument("--list", action="store_true", help="Показать сессии журнала и выйти")
+    args = parser.parse_args()
+
+    # Только чтение: без фонового fsync и архивации, как у журнала пишущего процесса
+    journal = JournalReader(os.getenv("JOURNAL_DIR", DEFAULT_DIR))
+    if args.list:
+        for thread_id in journal.thread_ids():
+            archived = os.path.exists(journal.archive_path(thread_id))
+            print(f"{thread_id}{' (archive)' if archived else ''}")
+        return
+
+    thread_ids = journal.thread_ids() if args.all else args.thread_ids
+    if not thread_ids:
+        parser.error("укажите thread_id или --all")
+    if args.out and len(thread_ids) != 1:
+        parser.error("--out — только для одной сессии")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for thread_id in thread_ids:
+        document = journal.document(thread_id, args.name)
+        if document is None:
+            print(f"⚠️ {thread_id}: нет в журнале")
+            continue
+        filename = args.out or os.path.join(args.out_dir, f"interview_log_{thread_id}.json")
+        write_log_document(document, filename)
+        print(f"📁 {thread_id}: {len(document['turns'])} ходов -> {filename}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Аналитика по логам интервью: загрузка логов save_logs и журналов ходов в Parquet (utils.analytics)
+и агрегаты по ним.
+
+Запуск:
+    python log_analytics.py ingest "logs/*.json" --journal journal   # только новые и изменившиеся
+    python log_analytics.py flags --by stack      # доля ходов с флагами Observer
+    python log_analytics.py latency --by level    # время хода, p95, TTFT, токены
+    python log_analytics.py grades --by level     # рекомендуемый грейд и средний балл
+    python log_analytics.py topics --by stack --top 10
+    python log_analytics.py compact               # переписать датасет без устаревших строк
+"""
+import json
+import time
+import argparse
+
+from utils.analytics import LogIndex, DEFAULT_DIR
+
+
+def format_table(table):
+    rows = table.to_pylist()
+    columns = table.column_names
+
+    def cell(value):
+        if isinstance(value, float):
+            return f"{value:.4g}"
+        return "—" if value is None else str(value)
+
+    widths = [max([len(column)] + [len(cell(row[column])) for row in rows]) for column in columns]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ["  ".join(cell(row[column]).ljust(width) for column, width in zip(columns, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["ingest", "flags", "latency", "grades", "topics", "compact"])
+    parser.add_argument("logs", nargs="*", default=["logs/interview_log_*.json"], help="Шаблоны логов для ingest")
+    parser.add_argument("--journal", help="Каталог журнала ходов (JOURNAL_DIR) для ingest")
+    parser.add_argument("--index", default=DEFAULT_DIR, help="Каталог Parquet-датасета")
+    parser.add_argument("--by", default=None, help="Колонка группировки: stack / level / role / strat …")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="Результат в JSON")
+    args = parser.parse_args()
+
+    index = LogIndex(args.index)
+    started = time.perf_counter()
+
+    if args.command == "ingest":
+        count = index.ingest(args.logs, args.journal)
+        print(f"📥 Загружено интервью: {count} ({time.perf_counter() - started:.2f} s)")
+        return
+    if args.command == "compact":
+        index.compact()
+        print(f"🗜️ Датасет переписан ({time.perf_counter() - started:.2f} s)")
+        return
+
+    if args.command == "flags":
+        result = index.flag_rates(args.by or "stack")
+    elif args.command == "latency":
+        result = index.turn_latency(args.by or "stack")
+    elif args.command == "grades":
+        result = index.grades(args.by or "level")
+    else:
+        result = index.topics(args.by, args.top)
+
+    if args.json:
+        print(json.dumps(result.to_pylist(), ensure_ascii=False, indent=2))
+    else:
+        print(format_table(result))
+    print(f"\n⏱️ {time.perf_counter() - started:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
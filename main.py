@@ -1,14 +1,27 @@
-import json
+import argparse
+import os
 import sys
-from langchain_core.messages import HumanMessage
+import uuid
+from langchain_core.messages import HumanMessage, AIMessageChunk
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver 
 
 from utils.state import InterviewState
-from agents.observer import observer_node
-from agents.expert import expert_node
-from agents.interviewer import interviewer_node
-from agents.feedback import feedback_node
+from agents.observer import observer_node, aobserver_node
+from agents.expert import expert_node, aexpert_node
+from agents.interviewer import interviewer_node, ainterviewer_node, farewell_node, afarewell_node
+from agents.interviewer import opening_node, aopening_node, opening_available
+from agents.feedback import feedback_node, afeedback_node
+from agents.analyst import analyst_node, aanalyst_node, analyst_single_node, aanalyst_single_node
+from utils.llm import get_pool_stats, get_router_stats, get_limiter_stats
+from utils.cache import get_cache_stats
+from utils.classifier import get_fastpath_stats
+from utils.openers import get_opening_stats
+from utils.structured import get_parse_stats
+from utils.metrics import metered, ametered
+from utils.checkpoint import make_checkpointer
+from utils.journal import journaled, ajournaled, journal_enabled, get_journal, build_log_document, write_log_document
+from utils.resilience import with_turn_deadline
 
 class Colors:
     HEADER = '\033[95m'
@@ -25,83 +38,242 @@ def route_signal(state: InterviewState):
         return "feedback"
     return END
 
+# Узлы досрочного завершения: прощание и отчет выполняются параллельно
+FINISH_NODES = ["farewell", "feedback"]
 
+def route_after_analysis(next_node):
+    """Сразу после анализа ответа: просьба остановиться ведет в finish, минуя Expert/Interviewer."""
+    def route(state: InterviewState):
+        if (state.get("observer_analysis") or {}).get("intent_to_leave", False):
+            return FINISH_NODES
+        return next_node
+    return route
+
+def route_start(entry):
+    """Старт интервью с готовым вступлением в банке (utils.openers) — без вызовов LLM."""
+    def route(state: InterviewState):
+        return "opening" if opening_available(state) else entry
+    return route
+
+
+
+# Режимы графа (для A/B по задержке и качеству флагов):
+#   classic — observer -> expert -> interviewer (3 вызова LLM на ход)
+#   fused   — analyst (observer+expert) -> interviewer (2 вызова)
+#   single  — analyst (observer+expert+interviewer) (1 вызов)
+GRAPH_MODES = ("classic", "fused", "single")
+
+def node(name, func, afunc):
+    """
+    Узел с sync- и async-реализацией: граф работает и через invoke/stream, и через ainvoke/astream.
+    Время узла и его вызовы LLM пишутся в state["turn_metrics"] (utils.metrics),
+    а записи лога сразу после узла дописываются в журнал ходов (utils.journal).
+    """
+    return RunnableLambda(journaled(metered(name, func)), afunc=ajournaled(ametered(name, afunc)), name=func.__name__)
+
+def build_graph(mode=None, checkpointer=None):
+    mode = mode or os.getenv("INTERVIEW_GRAPH_MODE", "classic")
+    if mode not in GRAPH_MODES:
+        raise ValueError(f"Unknown graph mode: {mode}. Expected one of {GRAPH_MODES}")
 
-def build_graph():
     workflow = StateGraph(InterviewState)
-    workflow.add_node("observer", observer_node)
-    workflow.add_node("expert", expert_node)
-    workflow.add_node("interviewer", interviewer_node)
-    workflow.add_node("feedback", feedback_node)
-
-    workflow.set_entry_point("observer")
-    workflow.add_edge("observer", "expert")
-    workflow.add_edge("expert", "interviewer")
+    workflow.add_node("feedback", node("feedback", feedback_node, afeedback_node))
+
+    if mode == "single":
+        workflow.add_node("analyst", node("analyst", analyst_single_node, aanalyst_single_node))
+        entry = "analyst"
+        last_node = "analyst"
+    else:
+        if mode == "fused":
+            workflow.add_node("analyst", node("analyst", analyst_node, aanalyst_node))
+            entry = "analyst"
+            workflow.add_conditional_edges("analyst", route_after_analysis("interviewer"), ["interviewer"] + FINISH_NODES)
+        else:
+            workflow.add_node("observer", node("observer", observer_node, aobserver_node))
+            workflow.add_node("expert", node("expert", expert_node, aexpert_node))
+            entry = "observer"
+            workflow.add_conditional_edges("observer", route_after_analysis("expert"), ["expert"] + FINISH_NODES)
+            workflow.add_edge("expert", "interviewer")
+        workflow.add_node("interviewer", node("interviewer", interviewer_node, ainterviewer_node))
+        workflow.add_node("farewell", node("farewell", farewell_node, afarewell_node))
+        workflow.add_edge("farewell", END)
+        last_node = "interviewer"
     
     workflow.add_conditional_edges(
-        "interviewer",
+        last_node,
         route_signal,
         {"feedback": "feedback", END: END}
     )
     workflow.add_edge("feedback", END)
 
-    shared_memory = MemorySaver()
-    return workflow.compile(checkpointer=shared_memory)
+    # Первый ход: вступление из банка вместо Observer -> Expert -> Interviewer
+    workflow.add_node("opening", node("opening", opening_node, aopening_node))
+    workflow.set_conditional_entry_point(route_start(entry), ["opening", entry])
+    workflow.add_edge("opening", END)
+
+    # Чекпоинты в SQLite-файле (CHECKPOINT_BACKEND=memory — прежний MemorySaver)
+    return workflow.compile(checkpointer=checkpointer or make_checkpointer())
 
-def save_logs(state: InterviewState, filename="interview_log.json", participant_name="Candidate"):
-    feedback_text = state.get("final_feedback", "Feedback not generated")
-    final_data = {
-        "participant_name": participant_name,
-        "turns": state.get("internal_log", []),
-        "final_feedback": feedback_text 
+# Узлы, чьи мысли показываются кандидату по ходу генерации
+THOUGHT_NODES = ("observer", "expert", "analyst", "farewell", "opening")
+# Узлы, чьи токены стримятся кандидату как реплика интервьюера
+REPLY_NODES = ("interviewer", "farewell")
+STREAM_MODES = ["updates", "messages"]
+
+def _turn_events(mode, chunk, shown_thoughts):
+    """Переводит событие графа (stream_mode updates/messages) в события UI."""
+    if mode == "messages":
+        message, metadata = chunk
+        # Берем только токены LLM внутри interviewer_node и farewell_node (не JSON Observer/Expert
+        # и не итоговое сообщение, которое узел кладет в state целиком)
+        if (metadata.get("langgraph_node") in REPLY_NODES
+                and isinstance(message, AIMessageChunk) and message.content):
+            yield "token", message.content
+    else:
+        for node_name, update in chunk.items():
+            if node_name in THOUGHT_NODES and isinstance(update, dict):
+                # Expert дописывает список Observer, analyst отдает оба сразу —
+                # отправляем только еще не показанные мысли
+                for thought in update.get("current_turn_thoughts") or []:
+                    if thought not in shown_thoughts:
+                        shown_thoughts.append(thought)
+                        yield "thought", thought
+
+def stream_turn(app, inputs, config):
+    """
+    Запускает ход графа в режиме стриминга и отдает события по мере готовности:
+    ("thought", мысль Observer/Expert), ("token", кусок ответа интервьюера),
+    ("done", итоговый state после хода).
+    """
+    shown_thoughts = []
+    for mode, chunk in app.stream(inputs, config=with_turn_deadline(config), stream_mode=STREAM_MODES):
+        yield from _turn_events(mode, chunk, shown_thoughts)
+
+    yield "done", app.get_state(config).values
+
+async def astream_turn(app, inputs, config):
+    """Async-версия stream_turn для графа в event loop (ainvoke/astream)."""
+    shown_thoughts = []
+    async for mode, chunk in app.astream(inputs, config=with_turn_deadline(config), stream_mode=STREAM_MODES):
+        for event in _turn_events(mode, chunk, shown_thoughts):
+            yield event
+
+    yield "done", (await app.aget_state(config)).values
+
+def print_turn(app, inputs, config):
+    """Печатает ход в консоль по мере стриминга и возвращает итоговый state."""
+    result = None
+    streamed = False
+    for kind, payload in stream_turn(app, inputs, config):
+        if kind == "thought":
+            print(f"\n{Colors.CYAN}{payload}{Colors.ENDC}")
+        elif kind == "token":
+            if not streamed:
+                print(f"\n{Colors.GREEN}Interviewer:{Colors.ENDC} ", end="")
+                streamed = True
+            print(payload, end="", flush=True)
+        else:
+            result = payload
+
+    if streamed:
+        print()
+    else:
+        # Ответ пришел без токенов (например, из кэша) — печатаем целиком
+        print(f"\n{Colors.GREEN}Interviewer:{Colors.ENDC} {result['messages'][-1].content}")
+    return result
+
+START_MESSAGE = "Начни интервью."
+
+def initial_state(candidate_info):
+    """Вход графа для первого хода: бот здоровается и задает первый вопрос."""
+    return {
+        "messages": [HumanMessage(content=START_MESSAGE)],
+        "candidate_info": candidate_info,
+        "topics_covered": [],
+        "internal_log": [],
+        "turn_metrics": [],
+        "finished": False,
+        "last_bot_msg": None
     }
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(final_data, f, ensure_ascii=False, indent=2)
+
+def save_logs(state: InterviewState, filename="interview_log.json", participant_name="Candidate", thread_id=None):
+    """
+    Итоговый лог интервью. Ходы уже лежат в журнале (utils.journal) — документ собирается из него,
+    а журнал сворачивается в архив; без журнала (JOURNAL=0) — из state, как раньше.
+    """
+    journal = get_journal() if journal_enabled() and thread_id else None
+    if journal is not None and journal.export(thread_id, filename, participant_name):
+        journal.archive(thread_id)
+    else:
+        write_log_document(build_log_document(
+            participant_name,
+            state.get("internal_log", []),
+            state.get("final_feedback", "Feedback not generated"),
+            state.get("feedback_metrics", []),
+            thread_id
+        ), filename)
     print(f"\n{Colors.WARNING}📁 Лог сохранен в {filename}{Colors.ENDC}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Консольное AI-интервью")
+    parser.add_argument("--resume", metavar="THREAD_ID", help="Продолжить интервью после перезапуска")
+    args = parser.parse_args()
+
     app = build_graph()
-    config = {"configurable": {"thread_id": "interview_1"}}
+    thread_id = args.resume or f"interview_{uuid.uuid4().hex[:8]}"
+    config = {"configurable": {"thread_id": thread_id}}
     
     print(f"{Colors.HEADER}=== AI INTERVIEW SYSTEM V2 ==={Colors.ENDC}")
-    
-    name = input("ФИО: ") or "Ivanov Ivan"
-    role = input("Позиция: ") or "C++ Developer"
-    level = input("Грейд: ") or "Middle"
-    stack = input("Стек: ") or "C++, Postgres"
-    log_filename = input("Имя файла лога: ") or "interview_log.json"
 
-    print(f"\n{Colors.WARNING}🚀 Начало...{Colors.ENDC}\n")
-    
-    # ПЕРВЫЙ ШАГ: Бот здоровается и задает вопрос
-    result = app.invoke({
-        "messages": [HumanMessage(content="Начни интервью.")],
-        "candidate_info": {"name": name, "role": role, "level": level, "stack": stack},
-        "topics_covered": [],
-        "internal_log": [],
-        "finished": False
-    }, config=config)
+    saved = app.get_state(config).values if args.resume else None
+    if args.resume and not saved:
+        sys.exit(f"Интервью {thread_id} не найдено")
 
-    print(f"{Colors.GREEN}Interviewer:{Colors.ENDC} {result['messages'][-1].content}")
+    if saved:
+        # ВОССТАНОВЛЕНИЕ: state целиком лежит в checkpointer
+        name = saved.get("candidate_info", {}).get("name", "Candidate")
+        log_filename = input("Имя файла лога: ") or "interview_log.json"
+        print(f"\n{Colors.WARNING}♻️ Продолжаем интервью {thread_id}{Colors.ENDC}")
+        print(f"\n{Colors.GREEN}Interviewer:{Colors.ENDC} {saved['messages'][-1].content}")
+        if saved.get("finished", False):
+            save_logs(saved, filename=log_filename, participant_name=name, thread_id=thread_id)
+            return
+    else:
+        name = input("ФИО: ") or "Ivanov Ivan"
+        role = input("Позиция: ") or "C++ Developer"
+        level = input("Грейд: ") or "Middle"
+        stack = input("Стек: ") or "C++, Postgres"
+        log_filename = input("Имя файла лога: ") or "interview_log.json"
+
+        print(f"\n{Colors.WARNING}🚀 Начало... (id: {thread_id}, продолжить: python main.py --resume {thread_id}){Colors.ENDC}\n")
+        
+        # ПЕРВЫЙ ШАГ: Бот здоровается и задает вопрос
+        print_turn(app, initial_state(
+            {"name": name, "role": role, "level": level, "stack": stack}
+        ), config)
 
     while True:
         user_text = input(f"\n{Colors.BOLD}You:{Colors.ENDC} ")
         
-        # Запускаем граф.
-        result = app.invoke({
+        # Запускаем граф: мысли и ответ печатаются по мере генерации
+        result = print_turn(app, {
             "messages": [HumanMessage(content=user_text)]
-        }, config=config)
-        
-        # Вывод мыслей
-        if result.get("current_turn_thoughts"):
-            print(f"\n{Colors.CYAN}" + "\n".join(result["current_turn_thoughts"]) + f"{Colors.ENDC}")
-
-        # Вывод ответа
-        print(f"\n{Colors.GREEN}Interviewer:{Colors.ENDC} {result['messages'][-1].content}")
+        }, config)
         
         if result.get("finished", False):
-            save_logs(result, filename=log_filename, participant_name=name)
+            save_logs(result, filename=log_filename, participant_name=name, thread_id=thread_id)
+            print(f"{Colors.BLUE}🔌 Соединения LLM: {get_pool_stats()}{Colors.ENDC}")
+            print(f"{Colors.BLUE}🔀 Провайдеры LLM: {get_router_stats()}{Colors.ENDC}")
+            print(f"{Colors.BLUE}🚦 Лимиты LLM: {get_limiter_stats()}{Colors.ENDC}")
+            if get_cache_stats():
+                print(f"{Colors.BLUE}💾 Кэш ответов LLM: {get_cache_stats()}{Colors.ENDC}")
+            if get_fastpath_stats():
+                print(f"{Colors.BLUE}⚡ Fast-path Observer: {get_fastpath_stats()}{Colors.ENDC}")
+            if get_parse_stats():
+                print(f"{Colors.BLUE}🧩 Разбор JSON: {get_parse_stats()}{Colors.ENDC}")
+            if get_opening_stats():
+                print(f"{Colors.BLUE}👋 Банк вступлений: {get_opening_stats()}{Colors.ENDC}")
             break
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import glob
+import json
+import time
+import uuid
+from langchain_core.messages import HumanMessage
+
+from main import build_graph, astream_turn, initial_state
+from utils.classifier import get_fastpath_stats
+from utils.structured import get_parse_stats
+from utils.openers import get_opening_stats
+from utils.llm import get_router_stats, get_limiter_stats
+from utils.resilience import with_turn_deadline
+
+STOP_MESSAGE = "Стоп интервью"
+
+
+class InterviewRunner:
+    """
+    Хостит много интервью в одном event loop поверх одного скомпилированного графа.
+    Каждая сессия — отдельный thread_id в checkpointer. Число одновременных
+    запросов к каждому провайдеру ограничивает utils.llm.ainvoke_chain
+    (LLM_CONCURRENCY_OPENAI / LLM_CONCURRENCY_GROQ).
+    """
+
+    def __init__(self, app=None, mode=None, max_active_turns=None):
+        self.app = app or build_graph(mode)
+        # Необязательный общий потолок одновременно выполняемых ходов
+        self._turn_slots = asyncio.Semaphore(max_active_turns) if max_active_turns else None
+
+    @staticmethod
+    def config(thread_id):
+        return {"configurable": {"thread_id": thread_id}}
+
+    async def _run(self, graph_input, thread_id):
+        # Бюджет хода отсчитывается с момента ответа кандидата, включая ожидание свободного слота
+        config = with_turn_deadline(self.config(thread_id))
+        if self._turn_slots is None:
+            return await self.app.ainvoke(graph_input, config=config)
+        async with self._turn_slots:
+            return await self.app.ainvoke(graph_input, config=config)
+
+    async def start(self, thread_id, candidate_info):
+        """Первый ход: приветствие и первый вопрос."""
+        return await self._run(initial_state(candidate_info), thread_id)
+
+    async def answer(self, thread_id, text):
+        """Ход кандидата. Возвращает state после ответа интервьюера."""
+        return await self._run({"messages": [HumanMessage(content=text)]}, thread_id)
+
+    async def stream_answer(self, thread_id, text):
+        """Ход кандидата со стримингом событий (см. main.stream_turn)."""
+        async for event in astream_turn(self.app, {"messages": [HumanMessage(content=text)]}, self.config(thread_id)):
+            yield event
+
+    async def run_scripted(self, candidate_info, answers, thread_id=None):
+        """
+        Проводит интервью по заранее заданным ответам.
+        Если ответы закончились, а интервью нет — просит остановиться.
+        """
+        thread_id = thread_id or str(uuid.uuid4())
+        result = await self.start(thread_id, candidate_info)
+
+        for text in list(answers) + [STOP_MESSAGE]:
+            if result.get("finished", False):
+                break
+            result = await self.answer(thread_id, text)
+
+        return result
+
+    async def run_many(self, sessions):
+        """
+        Запускает пачку интервью конкурентно.
+        sessions — список пар (candidate_info, answers). Ошибки сессий возвращаются как есть.
+        """
+        return await asyncio.gather(
+            *(self.run_scripted(info, answers) for info, answers in sessions),
+            return_exceptions=True
+        )
+
+
+def load_scripts(patterns):
+    """Сценарии кандидатов из логов save_logs: реплики user_message по ходам."""
+    scripts = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            info = {
+                "name": data.get("participant_name", "Candidate"),
+                "role": "Developer",
+                "level": "Middle",
+                "stack": "General"
+            }
+            scripts.append((info, [turn["user_message"] for turn in data.get("turns", [])]))
+    return scripts
+
+
+async def run_cli(args):
+    scripts = load_scripts(args.logs)
+    if not scripts:
+        raise SystemExit("Не найдено ни одного лога для сценариев")
+
+    sessions = [scripts[i % len(scripts)] for i in range(args.sessions)]
+    runner = InterviewRunner(mode=args.mode, max_active_turns=args.max_active_turns)
+
+    started = time.perf_counter()
+    results = await runner.run_many(sessions)
+    elapsed = time.perf_counter() - started
+
+    errors = [r for r in results if isinstance(r, BaseException)]
+    finished = [r for r in results if not isinstance(r, BaseException) and r.get("finished")]
+    turns = sum(len(r.get("internal_log", [])) for r in results if not isinstance(r, BaseException))
+
+    print(json.dumps({
+        "sessions": len(sessions),
+        "finished": len(finished),
+        "errors": len(errors),
+        "turns": turns,
+        "wall_time_s": round(elapsed, 3),
+        "turns_per_s": round(turns / elapsed, 2) if elapsed else None,
+        "fastpath": get_fastpath_stats(),
+        "parse": get_parse_stats(),
+        "openers": get_opening_stats(),
+        "providers": get_router_stats(),
+        "rate_limits": get_limiter_stats()
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Конкурентный прогон интервью по сценариям из логов")
+    parser.add_argument("logs", nargs="*", default=["logs/interview_log_*.json"])
+    parser.add_argument("--sessions", type=int, default=100, help="Сколько интервью вести одновременно")
+    parser.add_argument("--mode", default=None, help="Режим графа: classic / fused / single")
+    parser.add_argument("--max-active-turns", type=int, default=None, help="Общий потолок одновременных ходов")
+    asyncio.run(run_cli(parser.parse_args()))
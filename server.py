@@ -0,0 +1,472 @@
+"""
+HTTP-сервис интервью без UI (tornado): платформа найма ведет интервью через API,
+много кандидатов на один процесс поверх одного скомпилированного графа.
+
+Сессия — thread_id графа: state лежит в checkpointer, поэтому интервью продолжается
+и после перезапуска сервиса. Ход выполняется в event loop (astream графа), запрос
+не ждет его окончания: события хода (мысли агентов, токены ответа, итог) копятся
+в сессии и отдаются через SSE — подписчик, пришедший позже, получает их с начала хода.
+
+    POST /interviews                      {"name", "role", "level", "stack"[, "thread_id"]} -> 201 {"thread_id", "status"}
+    POST /interviews/<id>/answers         {"text"} -> 202 {"thread_id", "status"}; 409 — ход еще идет или интервью завершено
+    GET  /interviews/<id>/events          SSE текущего хода: thought / token / done / error
+    GET  /interviews/<id>                 статус сессии и последняя реплика
+    GET  /interviews/<id>/feedback        итоговый отчет (202, пока не готов)
+    GET  /interviews/<id>/log             лог в формате save_logs
+    GET  /health, GET /stats, GET /metrics (Prometheus)
+
+Параметр ?wait=1 у POST отвечает сразу итогом хода (без SSE).
+
+Запуск:
+    python server.py --port 8000 --mode fused
+    curl -X POST localhost:8000/interviews -d '{"name": "Ivan", "role": "C++ Developer", "level": "Middle", "stack": "C++"}'
+    curl -N localhost:8000/interviews/interview_1a2b3c4d5e6f/events
+"""
+import os
+import re
+import json
+import time
+import uuid
+import signal
+import asyncio
+import argparse
+import tornado.web
+import tornado.ioloop
+import tornado.iostream
+from langchain_core.messages import HumanMessage
+
+from main import build_graph, astream_turn, initial_state
+from utils.turns import PoolBusy
+from utils.metrics import registry, render_prometheus
+from utils.resilience import with_turn_deadline
+from utils.journal import get_journal, get_journal_stats, journal_enabled, build_log_document
+from utils.llm import get_pool_stats, get_router_stats, get_limiter_stats
+from utils.classifier import get_fastpath_stats
+from utils.structured import get_parse_stats
+from utils.openers import get_opening_stats
+
+# Ходов в работе на процесс (включая ожидающие слота); сверх — 503 с Retry-After
+MAX_PENDING = int(os.getenv("SERVER_MAX_PENDING", "512"))
+# Потолок одновременно выполняемых ходов; 0 — без потолка (запросы к провайдерам держит лимитер)
+MAX_ACTIVE_TURNS = int(os.getenv("SERVER_MAX_ACTIVE_TURNS", "0"))
+# Сессия без запросов выгружается из памяти (state остается в checkpointer)
+SESSION_IDLE_SECONDS = float(os.getenv("SERVER_SESSION_IDLE_SECONDS", "900"))
+# Комментарий-пинг в SSE, чтобы прокси не закрывали соединение во время долгого хода
+SSE_KEEPALIVE_SECONDS = 15
+
+THREAD_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def turn_summary(state):
+    """Итог хода для клиента: реплика интервьюера, мысли агентов, завершено ли интервью."""
+    messages = state.get("messages") or []
+    return {
+        "reply": messages[-1].content if messages else "",
+        "thoughts": state.get("current_turn_thoughts") or [],
+        "turn": len(state.get("internal_log") or []),
+        "finished": bool(state.get("finished", False))
+    }
+
+
+class Session:
+    """Сессия кандидата в памяти процесса: события текущего хода для подписчиков SSE."""
+
+    def __init__(self, thread_id, finished=False):
+        self.thread_id = thread_id
+        self.finished = finished
+        self.running = False
+        self.events = []
+        self.last_active = time.monotonic()
+        self._changed = asyncio.Condition()
+
+    def begin_turn(self):
+        # Новый список: подписчики прошлого хода дочитывают свой до done
+        self.events = []
+        self.running = True
+
+    async def push(self, kind, payload):
+        async with self._changed:
+            self.events.append((kind, payload))
+            self._changed.notify_all()
+
+    async def follow(self, keepalive=None):
+        """События текущего хода с начала и до done/error; ("ping", None) — если событий нет keepalive секунд."""
+        events = self.events
+        index = 0
+        while True:
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: len(events) > index), keepalive)
+                except asyncio.TimeoutError:
+                    yield "ping", None
+                    continue
+                batch = events[index:]
+            index += len(batch)
+            for kind, payload in batch:
+                yield kind, payload
+                if kind in ("done", "error"):
+                    return
+
+    async def result(self):
+        """Итог текущего хода (для ?wait=1)."""
+        async for kind, payload in self.follow():
+            if kind in ("done", "error"):
+                return kind, payload
+
+
+class InterviewService:
+    """Сессии процесса и фоновое выполнение ходов поверх одного графа."""
+
+    def __init__(self, app=None, mode=None):
+        self.app = app or build_graph(mode)
+        self.sessions = {}
+        self.tasks = set()
+        self._slots = asyncio.Semaphore(MAX_ACTIVE_TURNS) if MAX_ACTIVE_TURNS else None
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @staticmethod
+    def config(thread_id):
+        return {"configurable": {"thread_id": thread_id}}
+
+    async def state(self, thread_id):
+        return (await self.app.aget_state(self.config(thread_id))).values
+
+    async def session(self, thread_id):
+        """Сессия по thread_id; после перезапуска или выгрузки поднимается из checkpointer. None — нет такой."""
+        session = self.sessions.get(thread_id)
+        if session is None:
+            state = await self.state(thread_id)
+            if not state:
+                return None
+            session = self.sessions.setdefault(thread_id, Session(thread_id, state.get("finished", False)))
+        session.last_active = time.monotonic()
+        return session
+
+    async def start(self, thread_id, candidate_info):
+        exists = thread_id in self.sessions or await self.state(thread_id)
+        # Пока читали checkpointer, ту же сессию мог создать параллельный запрос
+        if exists or thread_id in self.sessions:
+            raise tornado.web.HTTPError(409, reason="Interview already exists")
+        session = self.sessions[thread_id] = Session(thread_id)
+        try:
+            self._submit(session, initial_state(candidate_info))
+        except PoolBusy:
+            del self.sessions[thread_id]
+            raise
+        return session
+
+    async def answer(self, session, text):
+        if session.running:
+            raise tornado.web.HTTPError(409, reason="Previous turn is still running")
+        if session.finished:
+            raise tornado.web.HTTPError(409, reason="Interview is finished")
+        self._submit(session, {"messages": [HumanMessage(content=text)]})
+
+    def _submit(self, session, inputs):
+        if self.pending >= MAX_PENDING:
+            self.rejected += 1
+            raise PoolBusy(f"too many turns in progress ({MAX_PENDING})")
+        self.pending += 1
+        session.begin_turn()
+        # Бюджет хода отсчитывается с ответа кандидата, включая ожидание слота
+        config = with_turn_deadline(self.config(session.thread_id))
+        task = asyncio.ensure_future(self._run(session, inputs, config))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, session, inputs, config):
+        try:
+            if self._slots is None:
+                await self._stream(session, inputs, config)
+            else:
+                async with self._slots:
+                    await self._stream(session, inputs, config)
+            self.completed += 1
+            registry.inc("interview_server_turns_total", result="ok")
+        except Exception as e:
+            print(f"❌ Turn Error ({session.thread_id}): {e}")
+            self.failed += 1
+            registry.inc("interview_server_turns_total", result="error")
+            await session.push("error", {"error": str(e)})
+        finally:
+            self.pending -= 1
+            session.running = False
+            session.last_active = time.monotonic()
+
+    async def _stream(self, session, inputs, config):
+        async for kind, payload in astream_turn(self.app, inputs, config):
+            if kind == "done":
+                payload = turn_summary(payload)
+                session.finished = payload["finished"]
+            await session.push(kind, payload)
+
+    async def log_document(self, thread_id):
+        """Лог интервью: из журнала ходов, без журнала — из state."""
+        if journal_enabled():
+            document = await asyncio.to_thread(get_journal().document, thread_id)
+            if document is not None:
+                return document
+        state = await self.state(thread_id)
+        return build_log_document(
+            state.get("candidate_info", {}).get("name", "Candidate"),
+            state.get("internal_log", []),
+            state.get("final_feedback", "Feedback not generated"),
+            state.get("feedback_metrics", []),
+            thread_id
+        )
+
+    def evict_idle(self):
+        now = time.monotonic()
+        for thread_id, session in list(self.sessions.items()):
+            if not session.running and now - session.last_active > SESSION_IDLE_SECONDS:
+                del self.sessions[thread_id]
+
+    async def drain(self, timeout):
+        """Дождаться идущих ходов при остановке (state каждого узла уже в checkpointer)."""
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=timeout)
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "running": sum(1 for session in self.sessions.values() if session.running),
+            "pending": self.pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+
+# --- HTTP ---
+
+class BaseHandler(tornado.web.RequestHandler):
+
+    def initialize(self, service):
+        self.service = service
+
+    def write_json(self, payload, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps(payload, ensure_ascii=False))
+
+    def json_body(self):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Body must be JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Body must be a JSON object")
+        return body
+
+    async def require_session(self, thread_id):
+        session = await self.service.session(thread_id)
+        if session is None:
+            raise tornado.web.HTTPError(404, reason="Interview not found")
+        return session
+
+    async def reply_turn(self, session, status, payload):
+        """Ответ на POST: сразу (202/201) или, с ?wait=1, итогом хода."""
+        if self.get_argument("wait", "0") in ("0", "false"):
+            self.write_json(payload, status)
+            return
+        kind, result = await session.result()
+        self.write_json({"thread_id": payload["thread_id"], **result}, 200 if kind == "done" else 500)
+
+    def write_error(self, status_code, **kwargs):
+        exc = kwargs.get("exc_info", (None, None))[1]
+        if isinstance(exc, PoolBusy):
+            self.set_status(503, reason="Too many turns in progress")
+            self.set_header("Retry-After", "1")
+            status_code = 503
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+        self.finish(json.dumps({"error": self._reason, "status": status_code}, ensure_ascii=False))
+
+    def log_exception(self, typ, value, tb):
+        # PoolBusy — штатный отказ под нагрузкой, не ошибка сервиса
+        if not isinstance(value, PoolBusy):
+            super().log_exception(typ, value, tb)
+
+
+class InterviewsHandler(BaseHandler):
+
+    async def post(self):
+        body = self.json_body()
+        thread_id = body.get("thread_id") or f"interview_{uuid.uuid4().hex[:12]}"
+        if not THREAD_ID_RE.match(thread_id):
+            raise tornado.web.HTTPError(400, reason="Invalid thread_id")
+        candidate_info = {
+            "name": body.get("name") or "Candidate",
+            "role": body.get("role") or "Developer",
+            "level": body.get("level") or "Middle",
+            "stack": body.get("stack") or "General"
+        }
+        session = await self.service.start(thread_id, candidate_info)
+        await self.reply_turn(session, 201, {"thread_id": thread_id, "status": "running"})
+
+
+class AnswerHandler(BaseHandler):
+
+    async def post(self, thread_id):
+        text = self.json_body().get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise tornado.web.HTTPError(400, reason="Field 'text' is required")
+        session = await self.require_session(thread_id)
+        await self.service.answer(session, text)
+        await self.reply_turn(session, 202, {"thread_id": thread_id, "status": "running"})
+
+
+class EventsHandler(BaseHandler):
+    """SSE: события текущего (или последнего) хода сессии."""
+
+    async def get(self, thread_id):
+        session = await self.require_session(thread_id)
+        self.set_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("X-Accel-Buffering", "no")
+        if not session.running and not session.events:
+            # Сессия поднята из checkpointer: событий хода в памяти нет, отдаем итог последнего хода
+            summary = turn_summary(await self.service.state(thread_id))
+            self.finish(f"event: done\ndata: {json.dumps(summary, ensure_ascii=False)}\n\n")
+            return
+        try:
+            async for kind, payload in session.follow(SSE_KEEPALIVE_SECONDS):
+                if kind == "ping":
+                    self.write(": ping\n\n")
+                else:
+                    self.write(f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n")
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            # Клиент ушел — ход продолжается, события можно забрать повторным подключением
+            return
+        self.finish()
+
+
+class InterviewHandler(BaseHandler):
+
+    async def get(self, thread_id):
+        session = await self.require_session(thread_id)
+        state = await self.service.state(thread_id)
+        self.write_json({
+            "thread_id": thread_id,
+            "candidate_info": state.get("candidate_info", {}),
+            "running": session.running,
+            "has_feedback": bool(state.get("final_feedback")),
+            **turn_summary(state)
+        })
+
+
+class FeedbackHandler(BaseHandler):
+
+    async def get(self, thread_id):
+        await self.require_session(thread_id)
+        state = await self.service.state(thread_id)
+        if not state.get("final_feedback"):
+            self.write_json({"thread_id": thread_id, "status": "pending"}, 202)
+            return
+        self.write_json({
+            "thread_id": thread_id,
+            "final_feedback": state["final_feedback"],
+            "feedback_metrics": state.get("feedback_metrics", [])
+        })
+
+
+class LogHandler(BaseHandler):
+
+    async def get(self, thread_id):
+        await self.require_session(thread_id)
+        self.write_json(await self.service.log_document(thread_id))
+
+
+class HealthHandler(BaseHandler):
+
+    def get(self):
+        stats = self.service.stats()
+        busy = stats["pending"] >= MAX_PENDING
+        self.write_json({"status": "busy" if busy else "ok", **stats}, 503 if busy else 200)
+
+
+class StatsHandler(BaseHandler):
+
+    def get(self):
+        self.write_json({
+            "server": self.service.stats(),
+            "fastpath": get_fastpath_stats(),
+            "parse": get_parse_stats(),
+            "openers": get_opening_stats(),
+            "journal": get_journal_stats(),
+            "connections": get_pool_stats(),
+            "providers": get_router_stats(),
+            "rate_limits": get_limiter_stats()
+        })
+
+
+class MetricsHandler(BaseHandler):
+
+    def get(self):
+        stats = self.service.stats()
+        gauges = [
+            "# TYPE interview_server_sessions gauge",
+            f"interview_server_sessions {stats['sessions']}",
+            "# TYPE interview_server_turns_pending gauge",
+            f"interview_server_turns_pending {stats['pending']}"
+        ]
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(render_prometheus() + "\n".join(gauges) + "\n")
+
+
+def log_request(handler):
+    """Вместо access-лога tornado — счетчик запросов по обработчику и коду ответа."""
+    registry.inc("interview_http_requests_total", handler=type(handler).__name__, code=handler.get_status())
+
+
+def make_app(service):
+    routes = [
+        (r"/interviews", InterviewsHandler),
+        (r"/interviews/([^/]+)", InterviewHandler),
+        (r"/interviews/([^/]+)/answers", AnswerHandler),
+        (r"/interviews/([^/]+)/events", EventsHandler),
+        (r"/interviews/([^/]+)/feedback", FeedbackHandler),
+        (r"/interviews/([^/]+)/log", LogHandler),
+        (r"/health", HealthHandler),
+        (r"/stats", StatsHandler),
+        (r"/metrics", MetricsHandler)
+    ]
+    return tornado.web.Application(
+        [(pattern, handler, {"service": service}) for pattern, handler in routes],
+        log_function=log_request
+    )
+
+
+async def serve(args):
+    service = InterviewService(mode=args.mode)
+    server = make_app(service).listen(args.port, address=args.host)
+    tornado.ioloop.PeriodicCallback(service.evict_idle, 60_000).start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    print(f"🌐 Сервис интервью: http://{args.host}:{args.port}")
+    await stop.wait()
+
+    print("⏹️ Остановка: новые запросы не принимаются, ждем идущие ходы...")
+    server.stop()
+    await service.drain(args.shutdown_timeout)
+    print(f"📊 {service.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mode", default=None, help="Режим графа: classic / fused / single")
+    parser.add_argument("--shutdown-timeout", type=float, default=30, help="Сколько ждать идущие ходы при остановке")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
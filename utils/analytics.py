@@ -0,0 +1,353 @@
+import os
+import re
+import glob
+import json
+import time
+import hashlib
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from utils.openers import normalize
+from utils.journal import JournalReader
+
+# Колоночный индекс логов интервью: логи save_logs (interview_log_*.json) и журналы ходов
+# (utils.journal) раскладываются в Parquet-датасет с типизированными колонками — флаги Observer,
+# стратегия Expert, темы и оценки из отчета, замеры узлов. Запросы идут по колонкам без
+# чтения JSON и регулярок по тексту.
+#
+# Датасет:
+#   <dir>/interviews/part-<run>.parquet — интервью (роль/грейд/стек, итоговый грейд, стоимость)
+#   <dir>/turns/part-<run>.parquet      — ходы (флаги, длины реплик, время и токены хода)
+#   <dir>/topics/part-<run>.parquet     — темы из отчета с баллом
+#   <dir>/manifest.json                 — какие источники уже загружены (по mtime/size)
+# Повторная загрузка берет только новые и изменившиеся источники; строки прежней версии
+# изменившегося источника отбрасываются при чтении (compact переписывает датасет без них).
+
+DEFAULT_DIR = "analytics"
+TABLES = ("interviews", "turns", "topics")
+
+FLAGS = {
+    "HALLUCINATION": "hallucination",
+    "CONTRADICTION": "contradiction",
+    "OFF-TOPIC": "off_topic",
+    "ROLE_REVERSAL": "role_reversal",
+    "STOP_REQUEST": "stop_request"
+}
+FLAG_COLUMNS = tuple(FLAGS.values())
+
+FLAGS_RE = re.compile(r"\[FLAGS: ([^\]]*)\]")
+STRAT_RE = re.compile(r"\[Strat: ([^\]]*)\]")
+GRADE_SECTION_RE = re.compile(r"## Итоговый Грейд(.*?)(?:\n## |\Z)", re.S)
+RECOMMENDED_RE = re.compile(r"Рекомендуемый грейд:\s*\**\s*(Junior|Middle|Senior)", re.I)
+GRADE_RE = re.compile(r"грейд[^\n.]*?\b(Junior|Middle|Senior)\b", re.I)
+AVERAGE_RE = re.compile(r"Средний балл:\s*([\d.]+)\s*/\s*5")
+TOPIC_RE = re.compile(r"^### (.+?) — ([\d.]+)/5\s*$", re.M)
+
+SCHEMAS = {
+    "interviews": pa.schema([
+        ("interview_id", pa.string()),
+        ("version", pa.string()),
+        ("source", pa.string()),
+        ("participant_name", pa.string()),
+        ("role", pa.string()),
+        ("level", pa.string()),
+        ("stack", pa.string()),
+        ("turns", pa.int32()),
+        ("finished", pa.bool_()),
+        ("grade", pa.string()),
+        ("avg_score", pa.float64()),
+        ("cost_usd", pa.float64()),
+        ("feedback_ms", pa.float64()),
+        ("ingested_at", pa.timestamp("s"))
+    ]),
+    "turns": pa.schema(
+        [
+            ("interview_id", pa.string()),
+            ("version", pa.string()),
+            ("role", pa.string()),
+            ("level", pa.string()),
+            ("stack", pa.string()),
+            ("turn_id", pa.int32()),
+            ("user_chars", pa.int32()),
+            ("bot_chars", pa.int32()),
+            ("strat", pa.string())
+        ]
+        + [(column, pa.bool_()) for column in FLAG_COLUMNS]
+        + [
+            ("wall_ms", pa.float64()),
+            ("llm_ms", pa.float64()),
+            ("ttft_ms", pa.float64()),
+            ("llm_calls", pa.int32()),
+            ("prompt_tokens", pa.int64()),
+            ("completion_tokens", pa.int64()),
+            ("cost_usd", pa.float64()),
+            ("retries", pa.int32()),
+            ("cache_hits", pa.int32()),
+            ("errors", pa.int32())
+        ]
+    ),
+    "topics": pa.schema([
+        ("interview_id", pa.string()),
+        ("version", pa.string()),
+        ("role", pa.string()),
+        ("level", pa.string()),
+        ("stack", pa.string()),
+        ("topic", pa.string()),
+        ("score", pa.float64())
+    ])
+}
+
+
+# --- РАЗБОР ЛОГА ---
+
+def parse_flags(thoughts):
+    match = FLAGS_RE.search(thoughts or "")
+    found = {flag.strip() for flag in match.group(1).split(",")} if match else set()
+    return {column: flag in found for flag, column in FLAGS.items()}
+
+
+def parse_grade(feedback):
+    """(рекомендуемый грейд, средний балл) из раздела «Итоговый Грейд» отчета."""
+    if not isinstance(feedback, str):
+        return None, None
+    section = GRADE_SECTION_RE.search(feedback)
+    text = section.group(1) if section else ""
+    match = RECOMMENDED_RE.search(text) or GRADE_RE.search(text)
+    average = AVERAGE_RE.search(text)
+    return (match.group(1).capitalize() if match else None), (float(average.group(1)) if average else None)
+
+
+def parse_topics(feedback):
+    """Темы с баллом из заголовков «### Тема — 3.5/5» (отчет инкрементального режима)."""
+    if not isinstance(feedback, str):
+        return []
+    return [(name.strip(), float(score)) for name, score in TOPIC_RE.findall(feedback)]
+
+
+def turn_row(turn):
+    metrics = turn.get("metrics") or []
+    # Время до первого токена реплики — у последнего узла хода (интервьюер или analyst в режиме single)
+    ttft = next((m.get("ttft_ms") for m in reversed(metrics) if m.get("ttft_ms") is not None), None)
+    strat = STRAT_RE.search(turn.get("internal_thoughts") or "")
+    return {
+        "turn_id": turn.get("turn_id"),
+        "user_chars": len(turn.get("user_message") or ""),
+        "bot_chars": len(turn.get("agent_visible_message") or ""),
+        "strat": strat.group(1).strip() if strat else None,
+        **parse_flags(turn.get("internal_thoughts")),
+        "wall_ms": sum(m.get("wall_ms") or 0 for m in metrics) if metrics else None,
+        "llm_ms": sum(m.get("llm_ms") or 0 for m in metrics) if metrics else None,
+        "ttft_ms": ttft,
+        "llm_calls": sum(m.get("llm_calls") or 0 for m in metrics),
+        "prompt_tokens": sum(m.get("prompt_tokens") or 0 for m in metrics),
+        "completion_tokens": sum(m.get("completion_tokens") or 0 for m in metrics),
+        "cost_usd": sum(m.get("cost_usd") or 0 for m in metrics),
+        "retries": sum(m.get("retries") or 0 for m in metrics),
+        "cache_hits": sum(m.get("cache_hits") or 0 for m in metrics),
+        "errors": sum(m.get("errors") or 0 for m in metrics)
+    }
+
+
+def document_rows(interview_id, version, source, document, candidate_info=None, finished=True):
+    """Строки трех таблиц из документа формата save_logs."""
+    if candidate_info:
+        role, level, stack = normalize(candidate_info)
+    else:
+        # В логах save_logs нет данных кандидата — только в журнале
+        role = level = stack = None
+    keys = {"interview_id": interview_id, "version": version, "role": role, "level": level, "stack": stack}
+
+    turns = [{**keys, **turn_row(turn)} for turn in document.get("turns", [])]
+    feedback = document.get("final_feedback")
+    feedback_metrics = document.get("feedback_metrics") or []
+    grade, average = parse_grade(feedback)
+    interview = {
+        **keys,
+        "source": source,
+        "participant_name": document.get("participant_name"),
+        "turns": len(turns),
+        "finished": finished,
+        "grade": grade,
+        "avg_score": average,
+        "cost_usd": sum(row["cost_usd"] for row in turns) + sum(m.get("cost_usd") or 0 for m in feedback_metrics),
+        "feedback_ms": sum(m.get("wall_ms") or 0 for m in feedback_metrics) if feedback_metrics else None,
+        "ingested_at": int(time.time())
+    }
+    topics = [{**keys, "topic": name, "score": score} for name, score in parse_topics(feedback)]
+    return {"interviews": [interview], "turns": turns, "topics": topics}
+
+
+# --- ДАТАСЕТ ---
+
+class LogIndex:
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.manifest = {"sources": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        self._tables = {}
+
+    def _save_manifest(self):
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(tmp, self.manifest_path)
+
+    def _changed(self, interview_id, path):
+        stat = os.stat(path)
+        known = self.manifest["sources"].get(interview_id)
+        signature = {"source": path, "mtime": stat.st_mtime, "size": stat.st_size}
+        if known and all(known.get(key) == value for key, value in signature.items()):
+            return None
+        return signature
+
+    def _sources(self, log_patterns, journal_dir):
+        """
+        (interview_id, путь, документ, candidate_info, завершено) новых и изменившихся источников.
+        save_logs выгружает журнал в logs/, поэтому интервью может прийти из обоих: лог, чей thread_id
+        есть в журнале, отдается без документа — строки берутся из журнала (в нем есть роль и стек).
+        """
+        journal = JournalReader(journal_dir) if journal_dir and os.path.isdir(journal_dir) else None
+        journaled = set(journal.thread_ids()) if journal is not None else set()
+
+        for path in sorted({p for pattern in log_patterns for p in glob.glob(pattern)}):
+            interview_id = "log:" + hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+            signature = self._changed(interview_id, path)
+            if signature is None:
+                continue
+            with open(path, encoding="utf-8") as f:
+                document = json.load(f)
+            thread_id = document.get("thread_id")
+            signature["thread_id"] = thread_id
+            if thread_id and (thread_id in journaled or f"journal:{thread_id}" in self.manifest["sources"]):
+                document = None
+            yield interview_id, signature, document, None, True
+
+        if journal is not None:
+            for thread_id in journaled:
+                path = journal.path(thread_id)
+                if not os.path.exists(path):
+                    path = journal.archive_path(thread_id)
+                interview_id = f"journal:{thread_id}"
+                signature = self._changed(interview_id, path)
+                if signature is None:
+                    continue
+                records = journal.read(thread_id)
+                start = next((r for r in records if r.get("type") == "start"), {})
+                finished = any(r.get("type") == "final" for r in records)
+                yield interview_id, signature, journal.document(thread_id), start.get("candidate_info"), finished
+
+    def ingest(self, log_patterns=(), journal_dir=None):
+        """Загружает новые и изменившиеся источники одной пачкой файлов Parquet. Возвращает число интервью."""
+        run = time.strftime("%Y%m%d%H%M%S") + f"-{os.getpid()}"
+        rows = {table: [] for table in TABLES}
+        signatures = {}
+        for interview_id, signature, document, candidate_info, finished in self._sources(log_patterns, journal_dir):
+            if document is None:
+                # Дубликат сессии журнала: помним файл, но строк не пишем
+                signatures[interview_id] = {**signature, "version": None}
+                continue
+            version = f"{interview_id}@{run}"
+            for table, table_rows in document_rows(interview_id, version, signature["source"], document, candidate_info, finished).items():
+                rows[table].extend(table_rows)
+            signatures[interview_id] = {**signature, "version": version}
+
+        # Лог, загруженный раньше своей сессии журнала, уступает ей: его строки становятся устаревшими
+        journaled = {interview_id.split(":", 1)[1] for interview_id in signatures if interview_id.startswith("journal:")}
+        for interview_id, source in self.manifest["sources"].items():
+            if source.get("version") and source.get("thread_id") in journaled and interview_id not in signatures:
+                signatures[interview_id] = {**source, "version": None}
+
+        if not signatures:
+            return 0
+        for table in TABLES:
+            os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+            pq.write_table(
+                pa.Table.from_pylist(rows[table], schema=SCHEMAS[table]),
+                os.path.join(self.directory, table, f"part-{run}.parquet"),
+                compression="zstd"
+            )
+        # Манифест пишется после файлов: при сбое посередине пачка просто загрузится заново
+        stale = sum(1 for interview_id in signatures if interview_id in self.manifest["sources"])
+        self.manifest["stale"] = self.manifest.get("stale", 0) + stale
+        self.manifest["sources"].update(signatures)
+        self._save_manifest()
+        self._tables = {}
+        return sum(1 for signature in signatures.values() if signature["version"])
+
+    def table(self, name):
+        """Таблица датасета без строк прежних версий переписанных источников."""
+        if name not in self._tables:
+            directory = os.path.join(self.directory, name)
+            if not os.path.isdir(directory) or not os.listdir(directory):
+                self._tables[name] = SCHEMAS[name].empty_table()
+            else:
+                table = pq.read_table(directory, schema=SCHEMAS[name])
+                if self.manifest.get("stale"):
+                    current = pa.array([source["version"] for source in self.manifest["sources"].values() if source.get("version")], pa.string())
+                    table = table.filter(pc.is_in(table["version"], value_set=current))
+                self._tables[name] = table
+        return self._tables[name]
+
+    def compact(self):
+        """Переписывает каждую таблицу одним файлом без устаревших строк."""
+        run = time.strftime("%Y%m%d%H%M%S") + f"-{os.getpid()}"
+        for name in TABLES:
+            table = self.table(name)
+            directory = os.path.join(self.directory, name)
+            os.makedirs(directory, exist_ok=True)
+            target = os.path.join(directory, f"part-{run}.parquet")
+            # В ту же секунду, что и ingest, имя совпадает с только что записанной частью: ее не удаляем
+            old = [os.path.join(directory, part) for part in os.listdir(directory)]
+            pq.write_table(table, target, compression="zstd")
+            for path in old:
+                if path != target:
+                    os.remove(path)
+        self.manifest["stale"] = 0
+        self._save_manifest()
+        self._tables = {}
+
+    # --- ЗАПРОСЫ ---
+
+    def flag_rates(self, by="stack"):
+        """Доля ходов с каждым флагом Observer в разрезе колонки by."""
+        aggregations = [("turn_id", "count")] + [(column, "mean") for column in FLAG_COLUMNS]
+        return self._group("turns", by, aggregations)
+
+    def turn_latency(self, by="stack"):
+        """Время хода и до первого токена: среднее и p95, токены и стоимость хода."""
+        turns = self.table("turns")
+        aggregations = [("turn_id", "count"), ("wall_ms", "mean"), ("wall_ms", "tdigest"),
+                        ("ttft_ms", "mean"), ("ttft_ms", "tdigest"), ("cost_usd", "mean"),
+                        ("prompt_tokens", "mean"), ("completion_tokens", "mean"), ("retries", "sum")]
+        return self._group_table(turns, by, aggregations)
+
+    def grades(self, by="level"):
+        """Распределение рекомендуемого грейда и средний балл."""
+        return self._group("interviews", [by, "grade"] if by else ["grade"], [("interview_id", "count"), ("avg_score", "mean")])
+
+    def topics(self, by=None, top=20):
+        """Самые частые темы отчетов и средний балл по ним."""
+        result = self._group("topics", [by, "topic"] if by else ["topic"], [("topic", "count"), ("score", "mean")])
+        return result.sort_by([("topic_count", "descending")]).slice(0, top)
+
+    def _group(self, name, by, aggregations):
+        return self._group_table(self.table(name), by, aggregations)
+
+    @staticmethod
+    def _group_table(table, by, aggregations):
+        keys = [by] if isinstance(by, str) else list(by or [])
+        p95 = pc.TDigestOptions(q=0.95)
+        aggregations = [(column, func, p95) if func == "tdigest" else (column, func) for column, func in aggregations]
+        grouped = table.group_by(keys, use_threads=True).aggregate(aggregations)
+        # tdigest отдает список из одного квантиля — разворачиваем в число
+        for column in list(grouped.column_names):
+            if column.endswith("_tdigest"):
+                values = pc.list_element(grouped[column], 0)
+                index = grouped.column_names.index(column)
+                grouped = grouped.set_column(index, column.replace("_tdigest", "_p95"), values)
+        return grouped.sort_by([(key, "ascending") for key in keys]) if keys else grouped
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from utils.metrics import current_call
+
+DEFAULT_PATH = os.path.join("cache", "llm_responses.sqlite")
+
+
+class DiskResponseCache(BaseCache):
+    """
+    Дисковый кэш ответов LLM (SQLite) с вытеснением по LRU при превышении max_bytes.
+
+    Ключ — sha256 от (llm_string, prompt). LangChain кладет в llm_string провайдера,
+    модель и параметры вызова, а в prompt — отрендеренные сообщения, поэтому
+    при temperature=0.0 одинаковый запрос дает тот же ответ без похода в сеть.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def _key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        key = self._key(prompt, llm_string)
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            call = current_call()
+            if call is not None:
+                call.cache_hit = True
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return [loads(item) for item in json.loads(row[0])]
+
+    def update(self, prompt, llm_string, return_val):
+        key = self._key(prompt, llm_string)
+        value = json.dumps([dumps(generation) for generation in return_val], ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Удаляем давно не использованные ответы, пока не освободим ~10% запаса
+        target = int(self.max_bytes * 0.9)
+        for key, size in self.conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall():
+            if self.total_bytes <= target:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.total_bytes,
+            "evictions": self.evictions
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def cache_enabled_for(node):
+    """
+    Включен ли кэш для узла: LLM_CACHE_NODES=all или список через запятую
+    (например, "expert,interviewer"). По умолчанию кэш выключен.
+    """
+    nodes = os.getenv("LLM_CACHE_NODES", "").strip()
+    if not nodes:
+        return False
+    return nodes == "all" or node in {n.strip() for n in nodes.split(",")}
+
+
+def get_response_cache():
+    """Общий на процесс кэш (LLM_CACHE_PATH, LLM_CACHE_MAX_MB)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskResponseCache(
+                    os.getenv("LLM_CACHE_PATH", DEFAULT_PATH),
+                    max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024)
+                )
+    return _cache
+
+
+def get_cache_stats():
+    return _cache.stats() if _cache is not None else None
@@ -0,0 +1,546 @@
+import os
+import atexit
+import random
+import sqlite3
+import threading
+import time
+import asyncio
+from collections import OrderedDict
+import ormsgpack
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+from utils.serde import CompactSerializer
+
+DEFAULT_PATH = os.path.join("checkpoints", "interviews.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS threads_eviction ON threads (finished, updated_at);
+"""
+
+
+class SqliteSaver(BaseCheckpointSaver[str]):
+    """
+    Файловый checkpointer на SQLite для InterviewState.
+
+    - WAL-режим: чтения не блокируются записью;
+    - пакетная запись: коммит раз в batch_size операций или flush_interval секунд;
+    - вытеснение завершенных интервью по возрасту (ttl_seconds) и по числу (max_threads);
+    - интервью продолжается по thread_id после перезапуска процесса.
+
+    Раскладка данных как у MemorySaver: значения каналов хранятся отдельно
+    от чекпоинта и только для тех каналов, чья версия изменилась.
+
+    Каналы из append_channels (списки с reducer operator.add: messages, internal_log)
+    пишутся дельтами: новая версия хранит только хвост, дописанный к предыдущей,
+    и ссылку на нее. Раз в keyframe_interval дельт пишется полный снимок,
+    чтобы цепочка при чтении оставалась короткой.
+    """
+
+    DELTA_TYPE = "delta"
+
+    def __init__(
+        self,
+        path=DEFAULT_PATH,
+        *,
+        serde=None,
+        batch_size=32,
+        flush_interval=1.0,
+        ttl_seconds=None,
+        max_threads=None,
+        eviction_interval=300.0,
+        finished_channel="finished",
+        append_channels=(),
+        keyframe_interval=16,
+        delta_cache_size=1024
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.eviction_interval = eviction_interval
+        self.finished_channel = finished_channel
+        self.append_channels = frozenset(append_channels)
+        self.keyframe_interval = keyframe_interval
+        self.delta_cache_size = delta_cache_size
+        # Последнее записанное значение append-канала: (thread, ns, channel) -> (version, value, depth)
+        self._last_values = OrderedDict()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Транзакциями управляем сами (isolation_level=None), чтобы коммитить пачками
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        with self.lock:
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.executescript(SCHEMA)
+
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._last_eviction = time.monotonic()
+        self._closed = threading.Event()
+
+        # Фоновый поток досбрасывает неполную пачку и периодически чистит старые интервью
+        self._worker = threading.Thread(target=self._background, name="sqlite-saver", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    # --- ТРАНЗАКЦИИ ---
+
+    def _begin(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Коммитит накопленную пачку записей."""
+        with self.lock:
+            if self.conn.in_transaction:
+                self.conn.execute("COMMIT")
+            self._pending = 0
+            self._last_flush = time.monotonic()
+
+    def _background(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                if self._pending:
+                    self.flush()
+                if time.monotonic() - self._last_eviction >= self.eviction_interval:
+                    self.evict()
+            except sqlite3.Error as e:
+                print(f"❌ Checkpoint background error: {e}")
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
+    # --- ЗАПИСЬ ---
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        c = checkpoint.copy()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        values = c.pop("channel_values")
+
+        with self.lock:
+            self._begin()
+            for channel, version in new_versions.items():
+                if channel not in values:
+                    type_, blob = "empty", b""
+                elif channel in self.append_channels:
+                    type_, blob = self._dump_append(thread_id, checkpoint_ns, channel, str(version), values[channel])
+                else:
+                    type_, blob = self.serde.dumps_typed(values[channel])
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, channel, str(version), type_, blob)
+                )
+
+            type_, data = self.serde.dumps_typed(c)
+            metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    type_,
+                    data,
+                    metadata_type,
+                    metadata_data
+                )
+            )
+
+            now = time.time()
+            finished = 1 if checkpoint_ns == "" and values.get(self.finished_channel) is True else 0
+            self.conn.execute(
+                """
+                INSERT INTO threads (thread_id, created_at, updated_at, finished) VALUES (?, ?, ?, ?)
+                ON CONFLICT(thread_id) DO UPDATE SET
+                    updated_at = excluded.updated_at,
+                    finished = MAX(threads.finished, excluded.finished)
+                """,
+                (thread_id, now, now, finished)
+            )
+            self._written()
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"]
+            }
+        }
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        # Специальные каналы (ошибки, прерывания) перезаписываются, обычные — нет
+        query = (
+            "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            if all(channel in WRITES_IDX_MAP for channel, _ in writes)
+            else "INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+        with self.lock:
+            self._begin()
+            for idx, (channel, value) in enumerate(writes):
+                type_, blob = self.serde.dumps_typed(value)
+                self.conn.execute(query, (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint_id,
+                    task_id,
+                    WRITES_IDX_MAP.get(channel, idx),
+                    channel,
+                    type_,
+                    blob,
+                    task_path
+                ))
+            self._written()
+
+    def delete_thread(self, thread_id):
+        with self.lock:
+            self._begin()
+            self._delete_threads([thread_id])
+            self.flush()
+
+    def _delete_threads(self, thread_ids):
+        doomed = set(thread_ids)
+        for key in [k for k in self._last_values if k[0] in doomed]:
+            del self._last_values[key]
+        for table in ("checkpoints", "blobs", "writes", "threads"):
+            self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in thread_ids])
+
+    # --- ЧТЕНИЕ ---
+
+    # --- ДЕЛЬТЫ APPEND-КАНАЛОВ ---
+
+    def _remember(self, key, version, value, depth):
+        self._last_values[key] = (version, value, depth)
+        self._last_values.move_to_end(key)
+        while len(self._last_values) > self.delta_cache_size:
+            self._last_values.popitem(last=False)
+
+    def _dump_append(self, thread_id, checkpoint_ns, channel, version, value):
+        key = (thread_id, checkpoint_ns, channel)
+        previous = self._last_values.get(key)
+
+        if isinstance(value, list) and previous is not None:
+            prev_version, prev_value, depth = previous
+            size = len(prev_value)
+            # Дельта возможна, только если новое значение — продолжение предыдущего
+            is_append = (
+                len(value) >= size
+                and depth + 1 < self.keyframe_interval
+                and all(a is b or a == b for a, b in zip(prev_value, value[:size]))
+            )
+            if is_append:
+                inner_type, inner = self.serde.dumps_typed(value[size:])
+                self._remember(key, version, value, depth + 1)
+                return self.DELTA_TYPE, ormsgpack.packb([prev_version, inner_type, inner])
+
+        self._remember(key, version, value, 0)
+        return self.serde.dumps_typed(value)
+
+    def _load_blob(self, thread_id, checkpoint_ns, channel, version):
+        # Идем по ссылкам дельт назад до полного снимка, затем склеиваем хвосты
+        tails = []
+        current = version
+        while True:
+            row = self.conn.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, current)
+            ).fetchone()
+            if row is None or row[0] == "empty":
+                return None, False
+            if row[0] != self.DELTA_TYPE:
+                value = self.serde.loads_typed((row[0], row[1]))
+                break
+            prev_version, inner_type, inner = ormsgpack.unpackb(row[1])
+            tails.append(self.serde.loads_typed((inner_type, inner)))
+            current = prev_version
+
+        if tails:
+            value = list(value)
+            for tail in reversed(tails):
+                value.extend(tail)
+        if channel in self.append_channels and isinstance(value, list):
+            self._remember((thread_id, checkpoint_ns, channel), version, value, len(tails))
+        return value, True
+
+    def _load_blobs(self, thread_id, checkpoint_ns, versions):
+        values = {}
+        for channel, version in versions.items():
+            value, found = self._load_blob(thread_id, checkpoint_ns, channel, str(version))
+            if found:
+                values[channel] = value
+        return values
+
+    def _make_tuple(self, row):
+        thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type_, data, metadata_type, metadata_data = row
+
+        checkpoint = self.serde.loads_typed((type_, data))
+        writes = self.conn.execute(
+            """
+            SELECT task_id, channel, type, value FROM writes
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+            ORDER BY task_id, idx
+            """,
+            (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchall()
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id
+                }
+            },
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint["channel_versions"])
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata_data)),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((w_type, value)))
+                for task_id, channel, w_type, value in writes
+            ],
+            parent_config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": parent_checkpoint_id
+                }
+            } if parent_checkpoint_id else None
+        )
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+
+        with self.lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self.conn.execute(
+                    "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id)
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    """
+                    SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                    ORDER BY checkpoint_id DESC LIMIT 1
+                    """,
+                    (thread_id, checkpoint_ns)
+                ).fetchone()
+            return self._make_tuple(row) if row else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = "SELECT * FROM checkpoints"
+        conditions, params = [], []
+        if config:
+            conditions.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            checkpoint_ns = config["configurable"].get("checkpoint_ns")
+            if checkpoint_ns is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            params.append(before_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+            tuples = []
+            for row in rows:
+                item = self._make_tuple(row)
+                if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                    continue
+                tuples.append(item)
+                if limit is not None and len(tuples) >= limit:
+                    break
+        yield from tuples
+
+    def get_next_version(self, current, channel):
+        # Строковые монотонные версии, как у MemorySaver
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
+
+    # --- ASYNC (через пул потоков, SQLite синхронный) ---
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    # --- ВЫТЕСНЕНИЕ И ВОССТАНОВЛЕНИЕ ---
+
+    def evict(self, now=None):
+        """
+        Удаляет завершенные интервью старше ttl_seconds, а сверх max_threads —
+        самые старые завершенные. Незавершенные интервью не трогаем.
+        Возвращает число удаленных thread_id.
+        """
+        now = now or time.time()
+        with self.lock:
+            victims = []
+            if self.ttl_seconds is not None:
+                victims += [row[0] for row in self.conn.execute(
+                    "SELECT thread_id FROM threads WHERE finished = 1 AND updated_at < ?",
+                    (now - self.ttl_seconds,)
+                )]
+            if self.max_threads is not None:
+                total = self.conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0] - len(victims)
+                if total > self.max_threads:
+                    victims += [row[0] for row in self.conn.execute(
+                        "SELECT thread_id FROM threads WHERE finished = 1 ORDER BY updated_at LIMIT ? OFFSET ?",
+                        (total - self.max_threads, len(victims))
+                    )]
+            self._last_eviction = time.monotonic()
+            if not victims:
+                return 0
+
+            self._begin()
+            self._delete_threads(victims)
+            self.flush()
+            self.conn.execute("PRAGMA incremental_vacuum")
+            print(f"🧹 Checkpoints: вытеснено интервью: {len(victims)}")
+            return len(victims)
+
+    def list_threads(self, finished=None):
+        """Интервью в базе (для возобновления по thread_id после перезапуска)."""
+        query = "SELECT thread_id, created_at, updated_at, finished FROM threads"
+        params = ()
+        if finished is not None:
+            query += " WHERE finished = ?"
+            params = (1 if finished else 0,)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY updated_at DESC", params).fetchall()
+        return [
+            {"thread_id": t, "created_at": c, "updated_at": u, "finished": bool(f)}
+            for t, c, u, f in rows
+        ]
+
+
+# Каналы InterviewState с reducer operator.add
+APPEND_CHANNELS = ("messages", "topics_covered", "internal_log", "turn_grades")
+
+_savers = {}
+_savers_lock = threading.Lock()
+
+
+def make_checkpointer(backend=None, path=None):
+    """
+    Checkpointer по настройкам окружения.
+    CHECKPOINT_BACKEND: sqlite (по умолчанию) | memory
+    CHECKPOINT_PATH, CHECKPOINT_TTL_SECONDS, CHECKPOINT_MAX_THREADS — для sqlite.
+    CHECKPOINT_COMPACT=0 отключает msgpack+zstd и дельты append-каналов.
+    Один файл базы — один общий saver на процесс.
+    """
+    backend = backend or os.getenv("CHECKPOINT_BACKEND", "sqlite")
+    if backend == "memory":
+        return MemorySaver()
+    if backend != "sqlite":
+        raise ValueError(f"Unknown checkpoint backend: {backend}")
+
+    path = path or os.getenv("CHECKPOINT_PATH", DEFAULT_PATH)
+    with _savers_lock:
+        saver = _savers.get(path)
+        if saver is None:
+            ttl = os.getenv("CHECKPOINT_TTL_SECONDS", "86400")
+            max_threads = os.getenv("CHECKPOINT_MAX_THREADS", "10000")
+            compact = os.getenv("CHECKPOINT_COMPACT", "1") != "0"
+            saver = SqliteSaver(
+                path,
+                serde=CompactSerializer() if compact else None,
+                append_channels=APPEND_CHANNELS if compact else (),
+                ttl_seconds=float(ttl) if ttl else None,
+                max_threads=int(max_threads) if max_threads else None
+            )
+            _savers[path] = saver
+    return saver
@@ -0,0 +1,251 @@
+import os
+import re
+import sys
+import glob
+import json
+import math
+import argparse
+import threading
+from collections import Counter
+
+# Быстрый локальный разбор очевидных ответов перед observer_node: правила + наивный Байес.
+# Однозначные случаи (просьба остановиться, «не знаю», встречный вопрос об условиях работы)
+# получают тот же JSON, что и от LLM, за микросекунды. Все неоднозначное — в том числе короткие
+# ответы («B-дерево», «Mutex») и уточняющие вопросы — уходит в LLM как раньше.
+#
+# Модель обучается на логах save_logs: метки берутся из флагов Observer в internal_thoughts.
+#   python -m utils.classifier logs/interview_log_*.json
+# Поставляемая модель обучена на 26 ходах из logs/ без единого ROLE_REVERSAL: пока ее не переобучат
+# на логах со встречными вопросами, их ловят только правила, модель решает лишь «стоп».
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "classifier_model.json")
+
+# Байес решает только за короткие реплики и только с высокой уверенностью
+MAX_WORDS = int(os.getenv("FASTPATH_MAX_WORDS", "12"))
+THRESHOLD = float(os.getenv("FASTPATH_THRESHOLD", "0.97"))
+
+# Класс "answer" — обычный ответ: флаги галлюцинаций и противоречий может поставить только LLM
+LABELS = ("stop", "role_reversal", "answer")
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+STOP_RE = re.compile(
+    r"^\W*(?:(?:ну|давайте|всё|все|так|может)\W+)*(?:стоп|хватит|закончим|заканчиваем|завершим|stop)\b"
+    r"(?:\W+(?:интервью|на\W+сегодня|пожалуйста|собеседование))*\W*$",
+    re.IGNORECASE
+)
+DONT_KNOW_RE = re.compile(
+    r"^\W*(?:я\W+)?(?:не\W+знаю|не\W+помню|без\W+понятия|хз|пас|затрудняюсь(?:\W+ответить)?|не\W+уверен)\W*$",
+    re.IGNORECASE
+)
+# Встречный вопрос об условиях работы или компании. Обращение на «вы» само по себе не в счет:
+# «Вы имеете в виду B-tree индекс?» — уточнение по вопросу, его разбирает LLM. Компания, команда,
+# зарплата и т.п. бывают и в технических вопросах («Какие компании используют Kafka?»,
+# «вторая по величине зарплата в таблице»), поэтому считаются только с обращением к интервьюеру.
+# Без обращения — лишь слова, которых в технических вопросах не бывает (вилка, соцпакет, удаленка)
+_WORKPLACE = r"(?:компани\w*|команд\w*|стек\w*|офис\w*|зарплат\w*|оклад\w*|бонус\w*|проект\w*|график\w*\W+работ\w*)"
+REVERSAL_RE = re.compile(
+    r"\b(?:вилк\w*|соцпакет\w*|дмс|релокац\w*|испытательн\w*\W+срок\w*|удаленк\w*"
+    r"|ваш\w*\W+(?:\w+\W+)?" + _WORKPLACE +
+    r"|у\W+вас\W+(?:в\W+|как\w*\W+)?" + _WORKPLACE +
+    r"|" + _WORKPLACE + r"\W+у\W+вас)\b",
+    re.IGNORECASE
+)
+
+
+def tokenize(text):
+    return [word.lower() for word in WORD_RE.findall(text or "")]
+
+
+def analysis(thoughts, quality="medium", intent_to_leave=False, is_role_reversal=False):
+    """Ответ в схеме observer_analysis (fast_path — причина, по которой LLM не понадобилась)."""
+    return {
+        "thoughts": thoughts,
+        "is_hallucination": False,
+        "consistency_violation": False,
+        "is_deep_dive": False,
+        "is_role_reversal": is_role_reversal,
+        "intent_to_leave": intent_to_leave,
+        "answer_quality": quality
+    }
+
+
+class NaiveBayes:
+    """Мультиномиальный наивный Байес по словам со сглаживанием Лапласа."""
+
+    def __init__(self, priors=None, counts=None, totals=None, vocabulary=None):
+        self.priors = priors or {}
+        self.counts = counts or {}
+        self.totals = totals or {}
+        self.vocabulary = vocabulary or 0
+
+    @classmethod
+    def train(cls, samples):
+        """samples — пары (текст, метка)."""
+        labels = Counter(label for _, label in samples)
+        counts = {label: Counter() for label in LABELS}
+        for text, label in samples:
+            counts[label].update(tokenize(text))
+        vocabulary = len({word for counter in counts.values() for word in counter})
+        return cls(
+            priors={label: (labels[label] + 1) / (len(samples) + len(LABELS)) for label in LABELS},
+            counts={label: dict(counter) for label, counter in counts.items()},
+            totals={label: sum(counter.values()) for label, counter in counts.items()},
+            vocabulary=vocabulary
+        )
+
+    def predict(self, text):
+        """(метка, апостериорная вероятность)."""
+        words = tokenize(text)
+        scores = {}
+        for label in LABELS:
+            score = math.log(self.priors.get(label, 1e-9))
+            denominator = self.totals.get(label, 0) + self.vocabulary + 1
+            counts = self.counts.get(label, {})
+            for word in words:
+                score += math.log((counts.get(word, 0) + 1) / denominator)
+            scores[label] = score
+
+        best = max(scores, key=scores.get)
+        norm = sum(math.exp(s - scores[best]) for s in scores.values())
+        return best, 1 / norm
+
+    def to_dict(self):
+        return {"priors": self.priors, "counts": self.counts, "totals": self.totals, "vocabulary": self.vocabulary}
+
+
+class FastPath:
+    """Правила + модель. classify() возвращает observer_analysis или None (нужна LLM)."""
+
+    def __init__(self, model=None):
+        self.model = model
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _hit(self, reason):
+        with self._lock:
+            self.stats["total"] += 1
+            self.stats[reason] += 1
+
+    def _decide(self, text):
+        words = tokenize(text)
+        if not words:
+            return "empty", analysis("Пустой или бессодержательный ответ.", quality="low")
+
+        if STOP_RE.match(text):
+            return "stop", analysis("Кандидат просит завершить интервью.", intent_to_leave=True)
+        if DONT_KNOW_RE.match(text):
+            return "dont_know", analysis("Кандидат не знает ответа.", quality="low")
+
+        is_question = text.rstrip().endswith("?")
+        if is_question and len(words) <= MAX_WORDS * 2 and REVERSAL_RE.search(text):
+            return "role_reversal", analysis("Кандидат задает встречный вопрос интервьюеру.", is_role_reversal=True)
+
+        if self.model is not None and len(words) <= MAX_WORDS:
+            label, probability = self.model.predict(text)
+            if probability >= THRESHOLD:
+                if label == "stop":
+                    return "model_stop", analysis("Кандидат просит завершить интервью.", intent_to_leave=True)
+                if label == "role_reversal" and is_question:
+                    return "model_role_reversal", analysis("Кандидат задает встречный вопрос интервьюеру.", is_role_reversal=True)
+        return None, None
+
+    def classify(self, text, stop_only=False):
+        """stop_only — интересует только просьба остановиться (режим fused: Expert нужен для всего остального)."""
+        reason, result = self._decide(text or "")
+        if stop_only and result is not None and not result["intent_to_leave"]:
+            reason, result = None, None
+        self._hit(reason or "llm")
+        if result is not None:
+            result["fast_path"] = reason
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            total = self.stats["total"]
+            short_circuited = total - self.stats["llm"]
+            return {
+                "turns": total,
+                "short_circuited": short_circuited,
+                "rate": round(short_circuited / total, 4) if total else 0.0,
+                "by_reason": {k: v for k, v in self.stats.items() if k not in ("total", "llm")}
+            }
+
+
+_fastpath = None
+_fastpath_lock = threading.Lock()
+
+
+def load_model(path=MODEL_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return NaiveBayes(**json.load(f))
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Warning: fast-path model not loaded ({e}), using rules only.")
+        return None
+
+
+def get_fastpath():
+    global _fastpath
+    if _fastpath is None:
+        with _fastpath_lock:
+            if _fastpath is None:
+                _fastpath = FastPath(load_model())
+    return _fastpath
+
+
+def fastpath_enabled():
+    return os.getenv("FASTPATH", "1") != "0"
+
+
+def get_fastpath_stats():
+    return _fastpath.snapshot() if _fastpath is not None else None
+
+
+# --- ОБУЧЕНИЕ ---
+
+def label_turn(turn):
+    """Метка хода по флагам Observer из лога."""
+    match = re.search(r"\[FLAGS: ([^\]]*)\]", turn.get("internal_thoughts", ""))
+    flags = {flag.strip() for flag in match.group(1).split(",")} if match else set()
+    if "STOP_REQUEST" in flags:
+        return "stop"
+    if flags == {"ROLE_REVERSAL"}:
+        return "role_reversal"
+    return "answer"
+
+
+def load_samples(patterns):
+    samples = []
+    for path in sorted({p for pattern in patterns for p in glob.glob(pattern)}):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        samples += [(turn.get("user_message", ""), label_turn(turn)) for turn in data.get("turns", [])]
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение fast-path классификатора на логах интервью")
+    parser.add_argument("logs", nargs="*", default=["logs/interview_log_*.json"])
+    parser.add_argument("--out", default=MODEL_PATH)
+    args = parser.parse_args()
+
+    samples = load_samples(args.logs)
+    if not samples:
+        sys.exit("Не найдено ни одного хода для обучения")
+
+    model = NaiveBayes.train(samples)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(model.to_dict(), f, ensure_ascii=False, indent=1, sort_keys=True)
+
+    # Сколько ходов из обучающих логов решилось бы без LLM
+    fastpath = FastPath(model)
+    for text, _ in samples:
+        fastpath.classify(text)
+    print(f"Обучено на {len(samples)} ходах: {dict(Counter(label for _, label in samples))}")
+    print(f"Fast-path на обучающих логах: {fastpath.snapshot()}")
+    print(f"Модель сохранена в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
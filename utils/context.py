@@ -0,0 +1,165 @@
+import os
+import threading
+from langchain_core.messages import SystemMessage
+
+# Бюджет контекста: сколько токенов узел может потратить на переменную часть промпта
+# (реплики, список тем, лог). Системный промпт узла фиксированный и сюда не входит.
+# Переопределяется CONTEXT_BUDGET_<NODE>, например CONTEXT_BUDGET_FEEDBACK=20000.
+DEFAULT_BUDGETS = {
+    "observer": 1500,
+    "expert": 2000,
+    "analyst": 2500,
+    "analyst_single": 2500,
+    "interviewer": 800,
+    "feedback": 12000,
+    "feedback_map": 4000
+}
+
+# Сколько последних сообщений хранит канал messages; более старые сворачиваются в сводку
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW_MESSAGES", "40"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "600"))
+SUMMARY_PREFIX = "[Сводка ранних ходов]"
+
+# Старые ходы в логе для отчета сжимаются до этого размера, если весь лог не влезает в бюджет
+OLD_TURN_TOKENS = 80
+RECENT_SHARE = 0.7
+
+CLIP_MARKER = " … "
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """
+    Кодировка tiktoken (CONTEXT_ENCODING, по умолчанию o200k_base как у gpt-4o-mini).
+    Если файл BPE недоступен (нет сети), считаем приблизительно: ~3 символа на токен.
+    """
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(os.getenv("CONTEXT_ENCODING", "o200k_base"))
+                except Exception as e:
+                    print(f"Warning: tiktoken unavailable ({e}), using approximate token counts.")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 3 + 1
+
+
+def clip(text, max_tokens):
+    """Обрезает текст до max_tokens, сохраняя начало и конец (середина заменяется на «…»)."""
+    if not text or count_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    encoding = _get_encoding()
+    head = max_tokens // 2
+    tail = max_tokens - head
+    if encoding:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:head]) + CLIP_MARKER + (encoding.decode(tokens[-tail:]) if tail else "")
+    return text[:head * 3] + CLIP_MARKER + (text[-tail * 3:] if tail else "")
+
+
+def get_budget(node):
+    return int(os.getenv(f"CONTEXT_BUDGET_{node.upper()}", DEFAULT_BUDGETS.get(node, 2000)))
+
+
+def fit_fields(node, inputs, fields):
+    """
+    Ужимает переменные промпта inputs[fields] в бюджет узла.
+    Короткие поля остаются как есть, остаток бюджета делится поровну между длинными.
+    """
+    budget = get_budget(node)
+    costs = {field: count_tokens(str(inputs.get(field) or "")) for field in fields}
+    if sum(costs.values()) <= budget:
+        return inputs
+
+    inputs = dict(inputs)
+    remaining = budget
+    ordered = sorted(fields, key=costs.get)
+    for i, field in enumerate(ordered):
+        share = remaining // (len(ordered) - i)
+        allowed = min(costs[field], share)
+        if costs[field] > allowed:
+            inputs[field] = clip(str(inputs[field]), allowed)
+        remaining -= allowed
+    return inputs
+
+
+def _summary_line(message):
+    role = "Candidate" if message.type == "human" else "Interviewer"
+    return f"{role}: {clip(str(message.content), 40)}"
+
+
+def window_messages(left, right):
+    """
+    Reducer канала messages: дописывает новые сообщения, а все, что старше
+    HISTORY_WINDOW последних, сворачивает в одно SystemMessage со сжатой сводкой.
+    Полная история ходов остается в internal_log.
+    """
+    merged = list(left or []) + list(right or [])
+    if len(merged) <= HISTORY_WINDOW:
+        return merged
+
+    dropped, kept = merged[:-HISTORY_WINDOW], merged[-HISTORY_WINDOW:]
+    lines = []
+    for message in dropped:
+        if isinstance(message, SystemMessage) and str(message.content).startswith(SUMMARY_PREFIX):
+            lines.append(str(message.content)[len(SUMMARY_PREFIX):].strip())
+        else:
+            lines.append(_summary_line(message))
+
+    # Размер сводки ограничен: clip выбрасывает середину, оставляя самые ранние и самые свежие строки
+    summary = clip("\n".join(lines), HISTORY_SUMMARY_TOKENS)
+    return [SystemMessage(content=f"{SUMMARY_PREFIX}\n{summary}")] + kept
+
+
+def format_turn(question, answer):
+    return f"Interviewer: {question}\nCandidate: {answer}"
+
+
+def build_transcript(turns, budget):
+    """
+    Лог интервью для промпта в пределах budget токенов.
+    Последние ходы идут дословно, более ранние сжимаются, самые старые при нехватке места опускаются.
+    turns — список пар (вопрос, ответ).
+    """
+    texts = [format_turn(q, a) for q, a in turns]
+    costs = [count_tokens(text) for text in texts]
+    if sum(costs) <= budget:
+        return "\n".join(texts)
+
+    selected = []
+    used = 0
+    omitted = 0
+    for i in reversed(range(len(texts))):
+        if used + costs[i] <= budget * RECENT_SHARE:
+            selected.append(texts[i])
+            used += costs[i]
+            continue
+        question, answer = turns[i]
+        short = format_turn(clip(question, OLD_TURN_TOKENS // 2), clip(answer, OLD_TURN_TOKENS // 2))
+        short_cost = count_tokens(short)
+        if used + short_cost > budget:
+            omitted = i + 1
+            break
+        selected.append(short)
+        used += short_cost
+
+    selected.reverse()
+    if omitted:
+        selected.insert(0, f"[... опущено ранних ходов: {omitted}]")
+    return "\n".join(selected)
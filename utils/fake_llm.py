@@ -0,0 +1,201 @@
+import re
+import json
+import time
+import random
+import zlib
+import asyncio
+import threading
+from typing import Dict, List
+from pydantic import Field, PrivateAttr
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Локальная замена LLM для бенчмарков и оффлайн-прогонов (LLM_PROVIDER=fake).
+# Узнает роль по системному промпту и отвечает заготовленным (или записанным) JSON/текстом.
+
+STOP_WORDS = ("стоп", "хватит", "закончим")
+
+
+def detect_role(system_text):
+    """Какой узел прислал промпт: observer / expert / analyst / interviewer / feedback / grader / feedback_map / summary."""
+    if "(Observer)" in system_text and "(Expert)" in system_text:
+        return "analyst"
+    if "Поведенческий Аналитик" in system_text:
+        return "observer"
+    if "Технический Лид (Expert)" in system_text:
+        return "expert"
+    if "рекрутер Алиса" in system_text:
+        return "interviewer"
+    if "финальную оценку" in system_text:
+        return "feedback"
+    if "ФРАГМЕНТ лога" in system_text:
+        return "feedback_map"
+    if "оценивающий ОДИН ответ" in system_text:
+        return "grader"
+    if 'раздел "Заключение"' in system_text:
+        return "summary"
+    return "other"
+
+
+def candidate_answer(user_text):
+    """
+    Реплика кандидата из human-сообщения узла. Observer и grader присылают перед ней вопрос бота,
+    который почти всегда кончается на «?», — флаги считаем только по самому ответу.
+    """
+    _, marker, answer = user_text.rpartition("Ответ кандидата:")
+    if not marker:
+        return user_text
+    return re.sub(r"\n\nJSON:\s*$", "", answer).strip()
+
+
+def canned_response(role, system_text, user_text):
+    """Детерминированный ответ, совместимый с форматом каждого узла."""
+    answer = candidate_answer(user_text)
+    wants_stop = any(word in answer.lower() for word in STOP_WORDS)
+
+    observer = {
+        "thoughts": "Кандидат ответил по существу. Флагов нет." if not wants_stop else "Кандидат просит завершить интервью.",
+        "is_hallucination": False,
+        "consistency_violation": False,
+        "is_deep_dive": False,
+        "is_role_reversal": "?" in answer,
+        "intent_to_leave": wants_stop,
+        "answer_quality": "medium"
+    }
+    stop_in_report = re.search(r'"intent_to_leave":\s*true', system_text) is not None
+    finish = wants_stop or stop_in_report
+    expert = {
+        "thoughts": "Ответ принят, переходим к следующей теме." if not finish else "Кандидат хочет закончить.",
+        "instruction": "Расскажите, как вы бы спроектировали кэш для высоконагруженного сервиса?" if not finish else "Заверши интервью.",
+        "topic_name": f"Topic {zlib.crc32(user_text.encode('utf-8')) % 1000}" if not finish else "Conclusion",
+        "difficulty_adjustment": "same"
+    }
+
+    if role == "observer":
+        return json.dumps(observer, ensure_ascii=False)
+    if role == "expert":
+        return json.dumps(expert, ensure_ascii=False)
+    if role == "analyst":
+        result = {"observer": observer, "expert": expert}
+        if '"reply"' in system_text:
+            result["reply"] = "Спасибо! Как бы вы спроектировали кэш для высоконагруженного сервиса?"
+        return json.dumps(result, ensure_ascii=False)
+    if role == "interviewer":
+        if '"Заверши интервью' in system_text:
+            return "Спасибо за интервью! Всего доброго."
+        return "Спасибо за ответ. Как бы вы спроектировали кэш для высоконагруженного сервиса?"
+    if role == "feedback":
+        return (
+            "## Технический ревью\n- Ответы по существу.\n\n"
+            "## Итоговый Грейд\nMiddle\n\n"
+            "## План развития (Roadmap)\n- Кэширование\n\n"
+            "## Заключение\nСпасибо за интервью!"
+        )
+    if role == "grader":
+        return json.dumps({
+            "topic": f"Topic {zlib.crc32(user_text.encode('utf-8')) % 1000}",
+            "score": None if wants_stop else 3,
+            "strengths": ["Понимает основы"],
+            "weaknesses": ["Мало практических примеров"],
+            "roadmap": ["Кэширование"]
+        }, ensure_ascii=False)
+    if role == "feedback_map":
+        return json.dumps({
+            "topics": ["Кэширование"],
+            "strengths": ["Понимает основы"],
+            "weaknesses": ["Мало практических примеров"],
+            "level_estimate": "Middle",
+            "roadmap": ["Кэширование"]
+        }, ensure_ascii=False)
+    if role == "summary":
+        return "Кандидат показал базовый уровень. Спасибо за интервью!"
+    return "OK"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat-модель без сети с искусственной задержкой.
+    latency / jitter — секунды на весь ответ, token_delay — пауза между токенами при стриминге.
+    tail_rate / tail_latency — доля «застрявших» ответов и их задержка, error_rate — доля ошибок
+    (для проверки маршрутизации и дублирования запросов в utils.router).
+    recorded — очереди записанных ответов по ролям; пока очередь не пуста, ответ берется из нее.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    token_delay: float = 0.0
+    tail_rate: float = 0.0
+    tail_latency: float = 0.0
+    error_rate: float = 0.0
+    recorded: Dict[str, List[str]] = Field(default_factory=dict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self):
+        return "fake-interview"
+
+    @property
+    def _identifying_params(self):
+        return {"latency": self.latency, "jitter": self.jitter}
+
+    def push(self, role, text):
+        """Добавить записанный ответ для роли (observer / expert / interviewer / ...)."""
+        with self._lock:
+            self.recorded.setdefault(role, []).append(text)
+
+    def _respond(self, messages):
+        system_text = messages[0].content if messages else ""
+        user_text = messages[-1].content if messages else ""
+        role = detect_role(system_text)
+        with self._lock:
+            queue = self.recorded.get(role)
+            if queue:
+                return queue.pop(0)
+        return canned_response(role, system_text, user_text)
+
+    def _delay(self):
+        if random.random() < self.error_rate:
+            raise ConnectionError("fake provider error")
+        if random.random() < self.tail_rate:
+            return self.tail_latency
+        return max(self.latency + random.uniform(-self.jitter, self.jitter), 0.0)
+
+    def _message(self, messages, text):
+        prompt_tokens = sum(len(str(m.content).split()) for m in messages)
+        completion_tokens = len(text.split())
+        return AIMessage(content=text, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        })
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        time.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        await asyncio.sleep(self._delay())
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        time.sleep(self._delay())
+        for token in re.findall(r"\S+\s*", text):
+            time.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        await asyncio.sleep(self._delay())
+        for token in re.findall(r"\S+\s*", text):
+            await asyncio.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
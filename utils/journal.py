@@ -0,0 +1,345 @@
+import io
+import os
+import re
+import json
+import time
+import atexit
+import threading
+import zstandard
+from langgraph.config import get_config
+
+from utils.metrics import summarize
+
+# Журнал ходов: вместо одного JSON-документа в конце интервью каждая запись internal_log
+# дописывается строкой JSONL в файл своей сессии (один файл на thread_id) сразу после хода.
+# Запись хода — одна строка, цена не растет с длиной интервью; fsync пачками в фоне
+# (JOURNAL_FSYNC_MS, 0 — на каждую запись). Завершенный журнал сворачивается в архив .jsonl.zst.
+# Итоговый лог прежнего формата (save_logs) собирается из журнала экспортером (export_journal.py).
+#
+# Записи журнала:
+#   {"type": "start", "thread_id", "candidate_info", "ts"}
+#   {"type": "turn", "ts", "entry": <запись internal_log с metrics>}
+#   {"type": "final", "ts", "final_feedback", "feedback_metrics"}
+
+DEFAULT_DIR = "journal"
+FSYNC_SECONDS = float(os.getenv("JOURNAL_FSYNC_MS", "200")) / 1000
+# Завершенный журнал архивируется, когда в него столько секунд никто не пишет
+# (прощание может дописаться чуть позже отчета — они идут параллельно)
+ROLL_SECONDS = float(os.getenv("JOURNAL_ROLL_SECONDS", "10"))
+# Файл незавершенной сессии закрывается после простоя, чтобы не держать дескрипторы
+IDLE_CLOSE_SECONDS = float(os.getenv("JOURNAL_IDLE_CLOSE_SECONDS", "300"))
+# Архивация и закрытие простаивающих файлов идут в фоне и при fsync на каждую запись (JOURNAL_FSYNC_MS=0):
+# иначе долгоживущий server.py держал бы по дескриптору на каждое интервью до выхода
+SWEEP_SECONDS = FSYNC_SECONDS if FSYNC_SECONDS > 0 else 1.0
+
+
+def journal_enabled():
+    return os.getenv("JOURNAL", "1") != "0"
+
+
+def build_log_document(participant_name, turns, final_feedback, feedback_metrics, thread_id=None):
+    """
+    Документ лога интервью в формате save_logs (logs/interview_log_*.json). thread_id связывает лог
+    с журналом сессии: аналитика не считает одно интервью дважды.
+    """
+    return {
+        "thread_id": thread_id,
+        "participant_name": participant_name,
+        "turns": turns,
+        "final_feedback": final_feedback,
+        "feedback_metrics": feedback_metrics,
+        "metrics_summary": summarize([m for turn in turns for m in turn.get("metrics", [])] + feedback_metrics)
+    }
+
+
+def write_log_document(document, filename):
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+
+
+def _safe_name(thread_id):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(thread_id))
+
+
+class _Handle:
+    """Открытый файл журнала одной сессии."""
+
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.finished = False
+        self.last_write = time.monotonic()
+
+
+class JournalReader:
+    """Чтение журнала без записи: без фонового fsync и без создания каталогов (аналитика, экспорт)."""
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self.archive_dir = os.path.join(directory, "archive")
+
+    def path(self, thread_id):
+        return os.path.join(self.directory, f"{_safe_name(thread_id)}.jsonl")
+
+    def archive_path(self, thread_id):
+        return os.path.join(self.archive_dir, f"{_safe_name(thread_id)}.jsonl.zst")
+
+    def read(self, thread_id):
+        """Записи журнала сессии: архив, затем открытый файл. Оборванная последняя строка пропускается."""
+        lines = []
+        target = self.archive_path(thread_id)
+        if os.path.exists(target):
+            with open(target, "rb") as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                lines.extend(io.TextIOWrapper(reader, encoding="utf-8"))
+        path = self.path(thread_id)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                lines.extend(f)
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def thread_ids(self):
+        """Все сессии в журнале: и открытые, и архивные."""
+        names = set()
+        for directory, suffix in ((self.directory, ".jsonl"), (self.archive_dir, ".jsonl.zst")):
+            if os.path.isdir(directory):
+                names.update(name[:-len(suffix)] for name in os.listdir(directory) if name.endswith(suffix))
+        return sorted(names)
+
+    def document(self, thread_id, participant_name=None):
+        """Лог в формате save_logs из журнала или None, если сессии нет."""
+        records = self.read(thread_id)
+        if not records:
+            return None
+
+        candidate_info = {}
+        turns = {}
+        final = {}
+        for record in records:
+            kind = record.get("type")
+            if kind == "start":
+                candidate_info = record.get("candidate_info") or {}
+            elif kind == "turn":
+                # Узел, переигранный после сбоя, мог записать ход повторно — берем последнюю версию
+                entry = record.get("entry") or {}
+                turns[entry.get("turn_id", len(turns) + 1)] = entry
+            elif kind == "final":
+                final = record
+
+        return build_log_document(
+            participant_name or candidate_info.get("name", "Candidate"),
+            [turns[turn_id] for turn_id in sorted(turns)],
+            final.get("final_feedback", "Feedback not generated"),
+            final.get("feedback_metrics", []),
+            thread_id
+        )
+
+    def export(self, thread_id, filename, participant_name=None):
+        document = self.document(thread_id, participant_name)
+        if document is None:
+            return False
+        write_log_document(document, filename)
+        return True
+
+
+class TurnJournal(JournalReader):
+
+    def __init__(self, directory=DEFAULT_DIR):
+        super().__init__(directory)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self.handles = {}
+        self.lock = threading.Lock()
+        self.records = 0
+        self.fsyncs = 0
+        self.archived = 0
+        self._archive_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True)
+        self._flusher.start()
+
+    # --- ЗАПИСЬ ---
+
+    def _handle(self, thread_id, candidate_info):
+        with self.lock:
+            handle = self.handles.get(thread_id)
+            if handle is None:
+                path = self.path(thread_id)
+                is_new = not os.path.exists(path) and not os.path.exists(self.archive_path(thread_id))
+                handle = _Handle(path)
+                self.handles[thread_id] = handle
+                if is_new:
+                    self._write(handle, {"type": "start", "thread_id": thread_id, "candidate_info": candidate_info or {}})
+        return handle
+
+    def _write(self, handle, record):
+        # Строка целиком уходит в ОС одной записью: падение процесса не рвет уже записанные ходы
+        line = json.dumps({**record, "ts": round(time.time(), 3)}, ensure_ascii=False) + "\n"
+        with handle.lock:
+            handle.file.write(line)
+            handle.file.flush()
+            handle.last_write = time.monotonic()
+            if FSYNC_SECONDS > 0:
+                handle.dirty = True
+            else:
+                os.fsync(handle.file.fileno())
+                self.fsyncs += 1
+        self.records += 1
+
+    def append_turns(self, thread_id, candidate_info, entries):
+        handle = self._handle(thread_id, candidate_info)
+        for entry in entries:
+            self._write(handle, {"type": "turn", "entry": entry})
+
+    def append_final(self, thread_id, candidate_info, final_feedback, feedback_metrics):
+        handle = self._handle(thread_id, candidate_info)
+        self._write(handle, {"type": "final", "final_feedback": final_feedback, "feedback_metrics": feedback_metrics or []})
+        handle.finished = True
+
+    # --- FSYNC И АРХИВ ---
+
+    def _flush_loop(self):
+        while not self._stop.wait(SWEEP_SECONDS):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Журнал ходов: {e}")
+
+    def flush(self, roll=True):
+        """fsync грязных файлов; завершенные и давно не менявшиеся журналы уходят в архив."""
+        now = time.monotonic()
+        with self.lock:
+            handles = list(self.handles.items())
+        for thread_id, handle in handles:
+            with handle.lock:
+                if handle.dirty:
+                    os.fsync(handle.file.fileno())
+                    handle.dirty = False
+                    self.fsyncs += 1
+                idle = now - handle.last_write
+            if roll and handle.finished and idle >= ROLL_SECONDS:
+                self.archive(thread_id)
+            elif roll and idle >= IDLE_CLOSE_SECONDS:
+                self._close(thread_id)
+
+    def _close(self, thread_id):
+        with self.lock:
+            handle = self.handles.pop(thread_id, None)
+        if handle is not None:
+            with handle.lock:
+                if handle.dirty:
+                    os.fsync(handle.file.fileno())
+                    handle.dirty = False
+                handle.file.close()
+
+    def archive(self, thread_id):
+        """Сворачивает журнал сессии в .jsonl.zst (дописывая к уже существующему архиву)."""
+        self._close(thread_id)
+        path = self.path(thread_id)
+        target = self.archive_path(thread_id)
+        with self._archive_lock:
+            if not os.path.exists(path):
+                return
+            tmp = target + ".tmp"
+            with open(tmp, "wb") as out:
+                # Кадры zstd склеиваются: старый архив копируется как есть, новые строки — отдельным кадром
+                if os.path.exists(target):
+                    with open(target, "rb") as old:
+                        out.write(old.read())
+                with open(path, "rb") as src:
+                    zstandard.ZstdCompressor(level=10).copy_stream(src, out)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, target)
+            os.remove(path)
+            self.archived += 1
+
+    def close(self):
+        """При выходе процесса: все на диск, завершенные журналы — в архив."""
+        self._stop.set()
+        with self.lock:
+            handles = list(self.handles.items())
+        for thread_id, handle in handles:
+            if handle.finished:
+                self.archive(thread_id)
+            else:
+                self._close(thread_id)
+
+    def stats(self):
+        with self.lock:
+            open_files = len(self.handles)
+        return {"records": self.records, "fsyncs": self.fsyncs, "archived": self.archived, "open_files": open_files}
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """Общий на процесс журнал (JOURNAL_DIR)."""
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                _journal = TurnJournal(os.getenv("JOURNAL_DIR", DEFAULT_DIR))
+                atexit.register(_journal.close)
+    return _journal
+
+
+def get_journal_stats():
+    return _journal.stats() if _journal is not None else None
+
+
+# --- УЗЛЫ ГРАФА ---
+
+def _record(state, update):
+    """Пишет в журнал то, что узел добавил в лог: новые записи internal_log и итоговый отчет."""
+    if not journal_enabled() or not isinstance(update, dict):
+        return
+    if not update.get("internal_log") and "final_feedback" not in update:
+        return
+    try:
+        thread_id = get_config().get("configurable", {}).get("thread_id")
+    except RuntimeError:
+        thread_id = None
+    if thread_id is None:
+        return
+
+    try:
+        journal = get_journal()
+        candidate_info = state.get("candidate_info", {})
+        if update.get("internal_log"):
+            journal.append_turns(thread_id, candidate_info, update["internal_log"])
+        if "final_feedback" in update:
+            journal.append_final(thread_id, candidate_info, update["final_feedback"], update.get("feedback_metrics"))
+    except OSError as e:
+        # Журнал не должен ронять ход: state все равно сохранен в checkpointer
+        print(f"⚠️ Журнал ходов: {e}")
+
+
+def journaled(func):
+    """Sync-узел графа, чьи записи лога сразу дописываются в журнал (поверх metered)."""
+    def wrapper(state):
+        update = func(state)
+        _record(state, update)
+        return update
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def ajournaled(afunc):
+    async def wrapper(state):
+        update = await afunc(state)
+        _record(state, update)
+        return update
+
+    wrapper.__name__ = afunc.__name__
+    return wrapper
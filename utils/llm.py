@@ -1,43 +1,447 @@
 import os
+import time
+import asyncio
+import threading
+import httpx
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain_groq import ChatGroq
+from langchain_core.output_parsers import StrOutputParser
+
+from utils.cache import cache_enabled_for, get_response_cache
+from utils.fake_llm import FakeChatModel
+from utils.metrics import track_call
+from utils.schemas import strict_schema
+from utils.router import Router, Attempt
+from utils.resilience import (
+    REQUEST_TIMEOUT, REPLY_NODES, DeadlineExceeded, node_deadline, remaining,
+    call_with_retries, acall_with_retries, iterate_with_deadline
+)
+from utils.ratelimit import (
+    get_limiter, estimate_tokens, priority_for, is_rate_limit, run_limited, arun_limited, get_ratelimit_stats,
+    RATE_LIMIT_RETRIES
+)
 
 load_dotenv()
 
-def get_llm():
+OPENAI_MODEL = "gpt-4o-mini-2024-07-18"
+GROQ_MODEL = "llama-3.3-70b-versatile"
+FAKE_MODEL = "fake-interview"
+DEFAULT_MODELS = {"openai": OPENAI_MODEL, "groq": GROQ_MODEL}
+API_KEYS = (("openai", "OPENAI_API_KEY"), ("groq", "GROQ_API_KEY"))
+
+# Один пул keep-alive соединений на провайдера: его делят все узлы и все сессии
+POOL_LIMITS = httpx.Limits(
+    max_connections=100,
+    max_keepalive_connections=20,
+    keepalive_expiry=60.0
+)
+
+_registry_lock = threading.Lock()
+_clients = {}       # (provider, model, cached) -> экземпляр LLM
+_chains = {}        # (node, provider, model) -> prompt | llm | parser
+_stats = {}         # provider -> ConnectionStats
+_http_clients = {}  # provider -> (httpx.Client, httpx.AsyncClient)
+_router = None
+
+# Потолок одновременных запросов к провайдеру (переопределяется LLM_CONCURRENCY_<PROVIDER>);
+# лимитер (utils.ratelimit) снижает его на 429 и возвращает обратно по мере успешных ответов
+DEFAULT_CONCURRENCY = {"openai": 64, "groq": 16}
+
+
+class ConnectionStats:
+    """
+    Счетчики HTTP-запросов провайдера: сколько открыто новых TCP-соединений
+    и сколько запросов ушло по уже открытому (keep-alive) соединению.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def on_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def on_connect(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": max(self.requests - self.new_connections, 0)
+            }
+
+
+def _make_http_clients(provider):
+    """Создает пару (sync, async) httpx-клиентов с общим пулом и счетчиками."""
+    if provider in _http_clients:
+        return _http_clients[provider]
+
+    stats = _stats.setdefault(provider, ConnectionStats())
+
+    # httpcore сообщает о новом соединении через trace-расширение запроса
+    def trace(event, info):
+        if event == "connection.connect_tcp.started":
+            stats.on_connect()
+
+    async def atrace(event, info):
+        trace(event, info)
+
+    def on_request(request):
+        stats.on_request()
+        request.extensions["trace"] = trace
+
+    async def aon_request(request):
+        stats.on_request()
+        request.extensions["trace"] = atrace
+
+    http_client = httpx.Client(limits=POOL_LIMITS, event_hooks={"request": [on_request]})
+    http_async_client = httpx.AsyncClient(limits=POOL_LIMITS, event_hooks={"request": [aon_request]})
+    _http_clients[provider] = (http_client, http_async_client)
+    return _http_clients[provider]
+
+
+def available_providers():
     """
-    Возвращает экземпляр LLM.
-    Приоритет: OpenAI (gpt-4o-mini) -> Groq (Llama-3).
+    Провайдеры в порядке предпочтения.
+    По умолчанию — по наличию ключей: OpenAI (gpt-4o-mini) -> Groq (Llama-3).
+    LLM_PROVIDERS — явный список, например openai,groq или fake,fake2 (две заглушки для оффлайн-проверки роутера).
+    LLM_PROVIDER=fake — локальная заглушка без сети (бенчмарки и оффлайн-прогоны).
     """
-    openai_key = os.getenv("OPENAI_API_KEY")
-    groq_key = os.getenv("GROQ_API_KEY")
+    explicit = os.getenv("LLM_PROVIDERS")
+    if explicit:
+        return [provider.strip() for provider in explicit.split(",") if provider.strip()]
+    if os.getenv("LLM_PROVIDER") == "fake":
+        return ["fake"]
+    providers = [provider for provider, key in API_KEYS if os.getenv(key)]
+    if not providers:
+        raise ValueError("CRITICAL ERROR: No API keys found in .env")
+    return providers
+
+
+def default_model(provider):
+    return FAKE_MODEL if provider.startswith("fake") else DEFAULT_MODELS[provider]
+
+
+def _resolve_provider():
+    """Провайдер и модель по умолчанию — первый доступный провайдер."""
+    provider = available_providers()[0]
+    return provider, default_model(provider)
+
+
+def get_router():
+    """Общий роутер процесса (utils.router): статистика провайдеров, маршруты узлов, дубли запросов."""
+    global _router
+    if _router is None:
+        with _registry_lock:
+            if _router is None:
+                providers = available_providers()
+                _router = Router(
+                    providers,
+                    {provider: default_model(provider) for provider in providers},
+                    hedging=os.getenv("LLM_HEDGE", "1") != "0"
+                )
+    return _router
+
+
+def reset_router():
+    """Сбросить роутер и его статистику (бенчмарки, смена LLM_PROVIDERS на лету)."""
+    global _router
+    with _registry_lock:
+        _router = None
+
 
-    # ПРИОРИТЕТ 1: OpenAI (GPT-4o-mini)
-    if openai_key:
+def _fake_setting(provider, name):
+    """Параметр заглушки: <PROVIDER>_LLM_<NAME> (например, FAKE2_LLM_LATENCY_MS), иначе FAKE_LLM_<NAME>."""
+    return float(os.getenv(f"{provider.upper()}_LLM_{name}", os.getenv(f"FAKE_LLM_{name}", "0")))
+
+
+def _create_llm(provider, model, cached=False):
+    http_client, http_async_client = _make_http_clients(provider)
+    # Кэш ответов подключается на уровне клиента: отдельный экземпляр для узлов с кэшем
+    cache = get_response_cache() if cached else None
+
+    if provider == "openai":
         return ChatOpenAI(
-            model="gpt-4o-mini-2024-07-18",
+            model=model,
             temperature=0.0,
-            api_key=openai_key
+            api_key=os.getenv("OPENAI_API_KEY"),
+            # Совместимый endpoint (например, заглушка benchmarks.openai_stub); None — api.openai.com
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            http_client=http_client,
+            http_async_client=http_async_client,
+            cache=cache,
+            # usage приходит и при стриминге — нужен для подсчета токенов (utils.metrics)
+            stream_usage=True,
+            # Повторы и дедлайны — в utils.resilience, ретраи SDK их бы только растягивали
+            timeout=REQUEST_TIMEOUT,
+            max_retries=0
         )
-    
-    # ПРИОРИТЕТ 2: Groq (Fallback)
+
     # Используется только если нет ключа OpenAI
-    elif groq_key:
-        print("Warning: Using Groq (Llama 3) as fallback.")
+    if provider == "groq":
+        if not cached:
+            print("Warning: Using Groq (Llama 3) as fallback.")
         return ChatGroq(
-            model="llama-3.3-70b-versatile",
+            model=model,
             temperature=0.0,
-            api_key=groq_key
+            api_key=os.getenv("GROQ_API_KEY"),
+            http_client=http_client,
+            http_async_client=http_async_client,
+            cache=cache,
+            timeout=REQUEST_TIMEOUT,
+            max_retries=0
         )
-    
-    else:
-        raise ValueError("CRITICAL ERROR: No API keys found in .env")
+
+    if provider.startswith("fake"):
+        return FakeChatModel(
+            latency=_fake_setting(provider, "LATENCY_MS") / 1000,
+            jitter=_fake_setting(provider, "JITTER_MS") / 1000,
+            token_delay=_fake_setting(provider, "TOKEN_DELAY_MS") / 1000,
+            tail_rate=_fake_setting(provider, "TAIL_RATE"),
+            tail_latency=_fake_setting(provider, "TAIL_MS") / 1000,
+            error_rate=_fake_setting(provider, "ERROR_RATE"),
+            cache=cache
+        )
+
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def get_llm(cached=False, target=None):
+    """
+    Возвращает общий экземпляр LLM из реестра процесса.
+    Клиент создается один раз на пару (провайдер, модель) и переиспользуется
+    всеми узлами и сессиями вместе с пулом HTTP-соединений.
+    cached=True — тот же клиент поверх дискового кэша ответов (utils.cache).
+    target — (провайдер, модель), по умолчанию первый доступный провайдер.
+    """
+    key = tuple(target or _resolve_provider()) + (cached,)
+    llm = _clients.get(key)
+    if llm is None:
+        with _registry_lock:
+            llm = _clients.get(key)
+            if llm is None:
+                llm = _create_llm(*key)
+                _clients[key] = llm
+    return llm
+
+
+def _bind_schema(llm, provider, schema):
+    """
+    Ограничивает ответ JSON-схемой средствами провайдера:
+    OpenAI — strict json_schema (модель не может выйти за схему), Groq — JSON mode.
+    Заглушка и так отвечает валидным JSON.
+    """
+    if provider == "openai":
+        return llm.bind(response_format={
+            "type": "json_schema",
+            "json_schema": {"name": schema.__name__, "strict": True, "schema": strict_schema(schema)}
+        })
+    if provider == "groq":
+        return llm.bind(response_format={"type": "json_object"})
+    return llm
+
+
+def get_chain(node, prompt, schema=None, target=None):
+    """
+    Возвращает скомпилированную цепочку prompt | llm | StrOutputParser для узла.
+    Собирается один раз на (узел, провайдер, модель) и кэшируется вместе с клиентом.
+    Кэш ответов включается по узлам через LLM_CACHE_NODES.
+    schema — Pydantic-модель ответа для структурированного вывода (utils.structured).
+    """
+    key = (node,) + tuple(target or _resolve_provider())
+    chain = _chains.get(key)
+    if chain is None:
+        llm = get_llm(cached=cache_enabled_for(node), target=key[1:])
+        if schema is not None:
+            llm = _bind_schema(llm, key[1], schema)
+        with _registry_lock:
+            chain = _chains.get(key)
+            if chain is None:
+                chain = prompt | llm | StrOutputParser()
+                _chains[key] = chain
+    return chain
+
+
+def get_concurrency_limit(provider):
+    default = DEFAULT_CONCURRENCY.get(provider, 16)
+    return int(os.getenv(f"LLM_CONCURRENCY_{provider.upper()}", default))
+
+
+def _limiter(provider):
+    return get_limiter(provider, get_concurrency_limit(provider))
+
+
+def invoke_chain(node, prompt, inputs, schema=None):
+    """
+    Синхронный вызов цепочки узла (с замером времени и токенов, см. utils.metrics).
+    Провайдера выбирает роутер; при медленном ответе он же отправляет дубль другому провайдеру.
+    Каждая попытка проходит через лимитер провайдера (RPM/TPM, очередь по приоритету узла).
+    Вызов укладывается в бюджет узла в пределах хода и повторяется при временных ошибках (utils.resilience).
+    """
+    tokens = estimate_tokens(prompt, inputs)
+    deadline = node_deadline(node)
+
+    def run(attempt_number):
+        def call(attempt):
+            with track_call(node, *attempt.target, silent=attempt.silent) as (record, config):
+                attempt.record = record
+                if attempt_number > 1:
+                    record.retries += 1
+                chain = get_chain(node, prompt, schema, attempt.target)
+                return run_limited(_limiter(attempt.provider), node, tokens, record,
+                                   lambda: chain.invoke(inputs, config=config), deadline)
+
+        return get_router().invoke(node, call, deadline, ttft_only=node in REPLY_NODES)
+
+    return call_with_retries(node, deadline, run)
+
+
+def stream_chain(node, prompt, inputs, schema=None):
+    """
+    Потоковый вызов цепочки: генератор кусков ответа (без дублей — только основной провайдер).
+    Если вызывающий закрывает генератор раньше, запрос к провайдеру обрывается.
+    Весь поток должен уложиться в бюджет узла, иначе DeadlineExceeded.
+    429 приходит до первого куска: запрос снова встает в очередь лимитера, как в run_limited.
+    """
+    router = get_router()
+    attempt = Attempt(router.plan(node)[0])
+    limiter = _limiter(attempt.provider)
+    tokens = estimate_tokens(prompt, inputs)
+    deadline = node_deadline(node)
+    try:
+        with track_call(node, *attempt.target) as (record, config):
+            attempt.record = record
+            chain = get_chain(node, prompt, schema, attempt.target)
+            for retry in range(RATE_LIMIT_RETRIES + 1):
+                streamed = False
+                with limiter.slot(priority_for(node), tokens) as slot:
+                    try:
+                        if deadline is None:
+                            chunks = chain.stream(inputs, config=config)
+                        else:
+                            chunks = iterate_with_deadline(lambda: chain.stream(inputs, config=config), deadline)
+                        for chunk in chunks:
+                            streamed = True
+                            yield chunk
+                        slot.used = record.prompt_tokens + record.completion_tokens or None
+                        break
+                    except Exception as e:
+                        if streamed or not is_rate_limit(e) or retry == RATE_LIMIT_RETRIES:
+                            raise
+                        pause = limiter.throttle(slot, e, retry)
+                        if deadline is not None and pause >= remaining(deadline):
+                            raise
+                record.retries += 1
+                print(f"⏳ Rate limit {limiter.provider} ({node}), retry in {pause:.1f}s")
+                time.sleep(pause)
+    except GeneratorExit:
+        router.observe(attempt, True)
+        raise
+    except Exception as e:
+        router.observe(attempt, False, e)
+        raise
+    router.observe(attempt, True)
+
+
+async def ainvoke_chain(node, prompt, inputs, schema=None):
+    """
+    Асинхронный вызов цепочки узла.
+    Очередь и потолок одновременных запросов к провайдеру — общие с sync-вызовами (utils.ratelimit),
+    чтобы сотни сессий в одном event loop не упирались в лимиты API.
+    Проигравший дубль (utils.router) и попытка, вышедшая за дедлайн, отменяются вместе с HTTP-запросом.
+    """
+    tokens = estimate_tokens(prompt, inputs)
+    deadline = node_deadline(node)
+
+    async def run(attempt_number):
+        async def call(attempt):
+            with track_call(node, *attempt.target, silent=attempt.silent) as (record, config):
+                attempt.record = record
+                if attempt_number > 1:
+                    record.retries += 1
+                chain = get_chain(node, prompt, schema, attempt.target)
+                return await arun_limited(_limiter(attempt.provider), node, tokens, record,
+                                          lambda: chain.ainvoke(inputs, config=config), deadline)
+
+        return await get_router().ainvoke(node, call, deadline, ttft_only=node in REPLY_NODES)
+
+    return await acall_with_retries(node, deadline, run)
+
+
+async def astream_chain(node, prompt, inputs, schema=None):
+    """Асинхронная версия stream_chain (через тот же лимитер провайдера, с тем же дедлайном и повтором на 429)."""
+    router = get_router()
+    attempt = Attempt(router.plan(node)[0])
+    limiter = _limiter(attempt.provider)
+    tokens = estimate_tokens(prompt, inputs)
+    deadline = node_deadline(node)
+    try:
+        with track_call(node, *attempt.target) as (record, config):
+            attempt.record = record
+            chain = get_chain(node, prompt, schema, attempt.target)
+            for retry in range(RATE_LIMIT_RETRIES + 1):
+                streamed = False
+                slot = await limiter.aacquire(priority_for(node), tokens)
+                try:
+                    chunks = chain.astream(inputs, config=config).__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining(deadline) if deadline else None)
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise DeadlineExceeded(f"{node}: stream deadline exceeded")
+                        streamed = True
+                        yield chunk
+                    slot.used = record.prompt_tokens + record.completion_tokens or None
+                    break
+                except Exception as e:
+                    if streamed or not is_rate_limit(e) or retry == RATE_LIMIT_RETRIES:
+                        raise
+                    pause = limiter.throttle(slot, e, retry)
+                    if deadline is not None and pause >= remaining(deadline):
+                        raise
+                finally:
+                    limiter.release(slot)
+                record.retries += 1
+                print(f"⏳ Rate limit {limiter.provider} ({node}), retry in {pause:.1f}s")
+                await asyncio.sleep(pause)
+    except GeneratorExit:
+        router.observe(attempt, True)
+        raise
+    except Exception as e:
+        router.observe(attempt, False, e)
+        raise
+    router.observe(attempt, True)
+
+
+def get_pool_stats():
+    """Счетчики переиспользования соединений по провайдерам."""
+    return {provider: stats.snapshot() for provider, stats in _stats.items()}
+
+
+def get_limiter_stats():
+    """Очередь, ожидание, 429 и текущий потолок одновременных запросов по провайдерам."""
+    return get_ratelimit_stats()
+
+
+def get_router_stats():
+    """Задержки, доля ошибок, дубли и переключения по провайдерам (None, если роутер не создан)."""
+    return _router.snapshot() if _router is not None else None
+
 
 # Тест
 if __name__ == "__main__":
     llm = get_llm()
     # Проверка, какая модель подключилась
     print(f"Connected to: {llm.model_name if hasattr(llm, 'model_name') else llm.model}")
-    res = llm.invoke("Say 'Ready'")
-    print(res.content)
\ No newline at end of file
+    for _ in range(2):
+        res = llm.invoke("Say 'Ready'")
+        print(res.content)
+    print(get_pool_stats())
@@ -0,0 +1,324 @@
+import os
+import time
+import atexit
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables.config import ensure_config, merge_configs
+
+# Замеры узлов графа: время, time-to-first-token, токены, провайдер/модель, ретраи, попадания в кэш.
+# Каждый узел пишет свою запись в state["turn_metrics"], интервьюер переносит их в запись хода
+# internal_log["metrics"]. Параллельно копится сводка по процессу с p50/p95/p99 по узлам
+# для Prometheus (METRICS_FILE — текстовый файл для node_exporter textfile collector).
+
+# Цена за 1M токенов, USD: (prompt, completion)
+PRICES = {
+    "gpt-4o-mini-2024-07-18": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+}
+
+QUANTILES = (0.5, 0.95, 0.99)
+RESERVOIR_SIZE = 2048
+
+# Вызов LLM, который сейчас выполняется (для кэша и ретраев глубже по стеку)
+_current_call = contextvars.ContextVar("llm_call", default=None)
+# Вызовы LLM, сделанные внутри текущего узла
+_node_calls = contextvars.ContextVar("node_calls", default=None)
+
+
+class CallRecord:
+    """Один вызов LLM. Поля дописываются по ходу: кэш, ретраи, токены из callback-ов."""
+
+    def __init__(self, node, provider, model):
+        self.node = node
+        self.provider = provider
+        self.model = model
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retries = 0
+        self.cache_hit = False
+        self.error = None
+
+    @property
+    def wall_ms(self):
+        return ((self.finished or time.perf_counter()) - self.started) * 1000
+
+    @property
+    def ttft_ms(self):
+        # Без стриминга первый токен приходит вместе со всем ответом
+        first = self.first_token or self.finished or time.perf_counter()
+        return (first - self.started) * 1000
+
+    @property
+    def cost_usd(self):
+        prompt_price, completion_price = PRICES.get(self.model, (0.0, 0.0))
+        if self.cache_hit:
+            return 0.0
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1_000_000
+
+
+class CallHandler(BaseCallbackHandler):
+    """Callback LangChain: момент первого токена и usage из ответа модели."""
+
+    run_inline = True
+
+    def __init__(self, record):
+        self.record = record
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.record.first_token is None and token:
+            self.record.first_token = time.perf_counter()
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.record.prompt_tokens += usage.get("input_tokens", 0)
+                    self.record.completion_tokens += usage.get("output_tokens", 0)
+                    return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self.record.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.record.completion_tokens += usage.get("completion_tokens", 0)
+
+
+def current_call():
+    """Запись о вызове LLM, который выполняется в этом контексте (или None)."""
+    return _current_call.get()
+
+
+@contextmanager
+def track_call(node, provider, model, silent=False):
+    """
+    Оборачивает вызов цепочки. Отдает (record, config): config — текущий config узла
+    с добавленным CallHandler, чтобы не потерять callbacks графа (стриминг токенов).
+    silent=True — без callbacks графа (дубль запроса в utils.router не стримит токены в UI).
+    """
+    record = CallRecord(node, provider, model)
+    if silent:
+        config = {**ensure_config(), "callbacks": [CallHandler(record)]}
+    else:
+        config = merge_configs(ensure_config(), {"callbacks": [CallHandler(record)]})
+    token = _current_call.set(record)
+    try:
+        yield record, config
+    except Exception as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        record.finished = time.perf_counter()
+        _current_call.reset(token)
+        calls = _node_calls.get()
+        if calls is not None:
+            calls.append(record)
+
+
+def node_entry(node, wall_ms, calls):
+    """Запись узла для turn_metrics / internal_log: вызовы LLM внутри узла сводятся в одну строку."""
+    last = calls[-1] if calls else None
+    return {
+        "node": node,
+        "wall_ms": round(wall_ms, 1),
+        "llm_ms": round(sum(c.wall_ms for c in calls), 1),
+        "ttft_ms": round(calls[0].ttft_ms, 1) if calls else None,
+        "provider": last.provider if last else None,
+        "model": last.model if last else None,
+        "llm_calls": len(calls),
+        "prompt_tokens": sum(c.prompt_tokens for c in calls),
+        "completion_tokens": sum(c.completion_tokens for c in calls),
+        "cost_usd": round(sum(c.cost_usd for c in calls), 6),
+        "retries": sum(c.retries for c in calls),
+        "cache_hits": sum(1 for c in calls if c.cache_hit),
+        "errors": sum(1 for c in calls if c.error)
+    }
+
+
+def _merge_update(state, update, entry):
+    """
+    Копит записи узлов хода в turn_metrics. Когда узел отдает реплику бота (ход завершен),
+    записи переносятся в новую запись internal_log и список очищается.
+    Замер узла отчета пишется в свой канал feedback_metrics.
+    """
+    if not isinstance(update, dict):
+        return update
+    if "final_feedback" in update:
+        return {**update, "feedback_metrics": [entry]}
+    pending = list(state.get("turn_metrics") or []) + [entry]
+    update = dict(update)
+    if "messages" in update:
+        if update.get("internal_log"):
+            *previous, last = update["internal_log"]
+            update["internal_log"] = previous + [{**last, "metrics": pending}]
+        update["turn_metrics"] = []
+    else:
+        update["turn_metrics"] = pending
+    return update
+
+
+def metered(name, func):
+    """Sync-узел графа с замером времени и вызовов LLM."""
+    def wrapper(state):
+        calls = []
+        token = _node_calls.set(calls)
+        started = time.perf_counter()
+        try:
+            update = func(state)
+        finally:
+            _node_calls.reset(token)
+        entry = node_entry(name, (time.perf_counter() - started) * 1000, calls)
+        registry.observe(entry)
+        return _merge_update(state, update, entry)
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def ametered(name, afunc):
+    """Async-версия metered."""
+    async def wrapper(state):
+        calls = []
+        token = _node_calls.set(calls)
+        started = time.perf_counter()
+        try:
+            update = await afunc(state)
+        finally:
+            _node_calls.reset(token)
+        entry = node_entry(name, (time.perf_counter() - started) * 1000, calls)
+        registry.observe(entry)
+        return _merge_update(state, update, entry)
+
+    wrapper.__name__ = afunc.__name__
+    return wrapper
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(entries):
+    """p50/p95/p99 времени узлов по списку записей (например, по всем ходам одного лога)."""
+    by_node = defaultdict(list)
+    for entry in entries:
+        by_node[entry["node"]].append(entry)
+
+    summary = {}
+    for node, items in by_node.items():
+        wall = sorted(e["wall_ms"] for e in items)
+        summary[node] = {
+            "count": len(items),
+            **{f"p{int(q * 100)}_ms": round(percentile(wall, q), 1) for q in QUANTILES},
+            "prompt_tokens": sum(e["prompt_tokens"] for e in items),
+            "completion_tokens": sum(e["completion_tokens"] for e in items),
+            "cost_usd": round(sum(e["cost_usd"] for e in items), 6)
+        }
+    return summary
+
+
+class MetricsRegistry:
+    """
+    Сводка по процессу. Квантили считаются по последним RESERVOIR_SIZE замерам узла
+    (prometheus summary), счетчики — за все время жизни процесса.
+    """
+
+    COUNTERS = ("prompt_tokens", "completion_tokens", "cost_usd", "retries", "cache_hits", "errors", "llm_calls")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wall = defaultdict(lambda: deque(maxlen=RESERVOIR_SIZE))
+        self.ttft = defaultdict(lambda: deque(maxlen=RESERVOIR_SIZE))
+        self.wall_sum = defaultdict(float)
+        self.count = defaultdict(int)
+        self.counters = defaultdict(lambda: defaultdict(float))
+        self.events = defaultdict(float)  # (имя, метки) -> значение прочих счетчиков
+        self.last_write = 0.0
+
+    def observe(self, entry):
+        node = entry["node"]
+        with self._lock:
+            self.wall[node].append(entry["wall_ms"] / 1000)
+            self.wall_sum[node] += entry["wall_ms"] / 1000
+            self.count[node] += 1
+            if entry["ttft_ms"] is not None:
+                self.ttft[node].append(entry["ttft_ms"] / 1000)
+            for name in self.COUNTERS:
+                self.counters[node][name] += entry[name]
+        self.maybe_write()
+
+    def inc(self, name, value=1, **labels):
+        """Произвольный счетчик (например, interview_fastpath_total{reason="stop"})."""
+        with self._lock:
+            self.events[(name, tuple(sorted(labels.items())))] += value
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        lines = [
+            "# HELP interview_node_seconds Wall time of a graph node",
+            "# TYPE interview_node_seconds summary"
+        ]
+        with self._lock:
+            for node in sorted(self.wall):
+                ordered = sorted(self.wall[node])
+                for q in QUANTILES:
+                    lines.append(f'interview_node_seconds{{node="{node}",quantile="{q}"}} {percentile(ordered, q):.6f}')
+                lines.append(f'interview_node_seconds_sum{{node="{node}"}} {self.wall_sum[node]:.6f}')
+                lines.append(f'interview_node_seconds_count{{node="{node}"}} {self.count[node]}')
+
+            lines += [
+                "# HELP interview_node_ttft_seconds Time to first token of the node's LLM call",
+                "# TYPE interview_node_ttft_seconds summary"
+            ]
+            for node in sorted(self.ttft):
+                ordered = sorted(self.ttft[node])
+                for q in QUANTILES:
+                    lines.append(f'interview_node_ttft_seconds{{node="{node}",quantile="{q}"}} {percentile(ordered, q):.6f}')
+                lines.append(f'interview_node_ttft_seconds_count{{node="{node}"}} {len(ordered)}')
+
+            for name in self.COUNTERS:
+                lines.append(f"# TYPE interview_node_{name}_total counter")
+                for node in sorted(self.counters):
+                    lines.append(f'interview_node_{name}_total{{node="{node}"}} {self.counters[node][name]:g}')
+            for name in sorted({name for name, _ in self.events}):
+                lines.append(f"# TYPE {name} counter")
+                for (event, labels), value in sorted(self.events.items()):
+                    if event == name:
+                        label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                        lines.append(f"{name}{{{label_str}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path=None):
+        path = path or os.getenv("METRICS_FILE")
+        if not path:
+            return
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Атомарная замена: коллектор не должен прочитать файл наполовину
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def maybe_write(self):
+        """Перезаписывает METRICS_FILE не чаще раза в METRICS_FLUSH_SECONDS."""
+        if not os.getenv("METRICS_FILE"):
+            return
+        now = time.monotonic()
+        if now - self.last_write >= float(os.getenv("METRICS_FLUSH_SECONDS", "5")):
+            self.last_write = now
+            self.write()
+
+
+registry = MetricsRegistry()
+atexit.register(registry.write)
+
+
+def render_prometheus():
+    return registry.render()
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import registry
+
+# Банк вступлений: приветствие и первый вопрос зависят только от роли, грейда и стека кандидата,
+# поэтому готовые пары (план Expert, реплика Интервьюера) хранятся в SQLite и отдаются на старте
+# интервью без вызова LLM. Банк заполняется заранее (warm_openers.py) и лениво — вступлениями,
+# которые граф сгенерировал сам для новой комбинации. Запись идет в фоне, мимо пути ответа.
+
+DEFAULT_PATH = os.path.join("cache", "openers.sqlite")
+# Сколько вариантов вступления хранить на комбинацию (на старте выбирается случайный).
+# При temperature=0 один провайдер дает одно и то же, больше 1 имеет смысл с несколькими провайдерами.
+VARIANTS = int(os.getenv("OPENING_BANK_VARIANTS", "1"))
+
+
+def opening_enabled():
+    return os.getenv("OPENING_BANK", "1") != "0"
+
+
+def normalize(candidate_info):
+    """(role, level, stack) без различий в регистре, пробелах и порядке технологий стека."""
+    def clean(value):
+        return " ".join(str(value or "").lower().split())
+
+    stack = sorted({clean(item) for item in str(candidate_info.get('stack') or "").split(",") if clean(item)})
+    return clean(candidate_info.get('role')), clean(candidate_info.get('level')), ", ".join(stack)
+
+
+def opening_key(candidate_info, version):
+    """Ключ банка: нормализованные роль/грейд/стек + версия промптов (правка промпта — новые вступления)."""
+    role, level, stack = normalize(candidate_info)
+    return hashlib.sha256(f"{version}\x00{role}\x00{level}\x00{stack}".encode("utf-8")).hexdigest()
+
+
+class OpeningBank:
+
+    def __init__(self, path=DEFAULT_PATH, variants=VARIANTS):
+        self.path = path
+        self.variants = variants
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Один фоновый писатель: ленивое пополнение не блокирует ход
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="openers")
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS openers (
+                    key TEXT NOT NULL,
+                    variant INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    level TEXT NOT NULL,
+                    stack TEXT NOT NULL,
+                    plan TEXT NOT NULL,
+                    reply TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (key, variant)
+                )
+            """)
+
+    def count(self, candidate_info, version):
+        key = opening_key(candidate_info, version)
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM openers WHERE key = ?", (key,)).fetchone()[0]
+
+    def has(self, candidate_info, version):
+        return self.count(candidate_info, version) > 0
+
+    def lookup(self, candidate_info, version):
+        """Случайный вариант вступления {"expert_plan", "reply"} или None."""
+        key = opening_key(candidate_info, version)
+        with self.lock:
+            rows = self.conn.execute("SELECT plan, reply FROM openers WHERE key = ?", (key,)).fetchall()
+            if not rows:
+                self.misses += 1
+            else:
+                self.hits += 1
+        registry.inc("interview_opening_total", result="hit" if rows else "miss")
+        if not rows:
+            return None
+        plan, reply = random.choice(rows)
+        return {"expert_plan": json.loads(plan), "reply": reply}
+
+    def add(self, candidate_info, version, expert_plan, reply):
+        """Добавляет вариант, пока их меньше VARIANTS. True — вариант сохранен."""
+        key = opening_key(candidate_info, version)
+        role, level, stack = normalize(candidate_info)
+        with self.lock:
+            variant = self.conn.execute("SELECT COUNT(*) FROM openers WHERE key = ?", (key,)).fetchone()[0]
+            if variant >= self.variants:
+                return False
+            # Другой процесс мог занять этот номер варианта — тогда запись пропускается
+            inserted = self.conn.execute(
+                "INSERT OR IGNORE INTO openers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, variant, role, level, stack, json.dumps(expert_plan, ensure_ascii=False), reply, time.time())
+            ).rowcount > 0
+            self.stored += inserted
+        return inserted
+
+    def remember(self, candidate_info, version, expert_plan, reply):
+        """Ленивое пополнение: вступление, сгенерированное графом, пишется в банк в фоне."""
+        def add():
+            try:
+                self.add(candidate_info, version, expert_plan, reply)
+            except Exception as e:
+                print(f"⚠️ Банк вступлений: {e}")
+
+        self.writer.submit(add)
+
+    def flush(self):
+        """Дожидается фоновых записей (CLI и тесты перед выходом)."""
+        self.writer.submit(lambda: None).result()
+
+    def combinations(self):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT role, level, stack, COUNT(*) FROM openers GROUP BY key ORDER BY role, level, stack"
+            ).fetchall()
+
+    def stats(self):
+        with self.lock:
+            entries, keys = self.conn.execute("SELECT COUNT(*), COUNT(DISTINCT key) FROM openers").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stored": self.stored,
+            "entries": entries,
+            "combinations": keys
+        }
+
+
+_bank = None
+_bank_lock = threading.Lock()
+
+
+def get_opening_bank():
+    """Общий на процесс банк (OPENING_BANK_PATH)."""
+    global _bank
+    if _bank is None:
+        with _bank_lock:
+            if _bank is None:
+                _bank = OpeningBank(os.getenv("OPENING_BANK_PATH", DEFAULT_PATH))
+    return _bank
+
+
+def get_opening_stats():
+    return _bank.stats() if _bank is not None else None
@@ -0,0 +1,377 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: общий между процессами лимит недоступен
+    fcntl = None
+
+from utils.context import count_tokens
+
+# Лимитер перед каждым вызовом LLM: запросы в минуту (RPM) и токены в минуту (TPM)
+# как два token bucket-а на провайдера, очередь с приоритетом узла и адаптивный
+# потолок одновременных запросов (AIMD: +1/limit за успех, половина при 429).
+# LLM_RATELIMIT_DIR — каталог с файлами состояния: bucket-ы общие для всех процессов (fcntl.flock).
+
+# Лимиты квоты по умолчанию (RPM, TPM); 0 — без ограничения. Переопределяются LLM_RPM_<PROVIDER> / LLM_TPM_<PROVIDER>
+DEFAULT_LIMITS = {"openai": (500, 200_000), "groq": (30, 12_000)}
+
+# Чем меньше число, тем раньше запрос выходит из очереди: реплика кандидату важнее фоновой оценки
+PRIORITIES = {
+    "interviewer": 0,
+    "analyst_single": 0,
+    "observer": 1,
+    "expert": 1,
+    "analyst": 1,
+    "feedback": 2,
+    "feedback_summary": 2,
+    "feedback_reduce": 2,
+    "feedback_map": 3,
+    "grader": 3,
+}
+
+# Оценка ответа модели, пока настоящий usage неизвестен (потом сверяется)
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "400"))
+# Сколько раз ставить запрос обратно в очередь после 429
+RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATELIMIT_RETRIES", "3"))
+# Пауза после 429 без заголовка Retry-After
+THROTTLE_BACKOFF = 1.0
+MAX_SLEEP = 1.0
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def priority_for(node):
+    return PRIORITIES.get(node, 1)
+
+
+def estimate_tokens(prompt, inputs):
+    """Оценка токенов вызова до отправки: промпт через tiktoken + ожидаемый ответ."""
+    try:
+        messages = prompt.format_messages(**inputs)
+    except (KeyError, ValueError):
+        return EXPECTED_COMPLETION_TOKENS
+    return sum(count_tokens(str(message.content)) for message in messages) + EXPECTED_COMPLETION_TOKENS
+
+
+def is_rate_limit(error):
+    """429 от OpenAI / Groq (RateLimitError в обоих SDK) или от httpx."""
+    if type(error).__name__ == "RateLimitError":
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+def retry_after(error):
+    """Retry-After из ответа провайдера (секунды) или None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Buckets:
+    """
+    RPM и TPM как два token bucket-а: пополняются равномерно, емкость — минутная квота.
+    path — файл состояния, общий для процессов; без него состояние живет в памяти процесса.
+    """
+
+    def __init__(self, rpm, tpm, path=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.path = path
+        self.state = {"requests": float(rpm), "tokens": float(tpm), "updated": time.time(), "paused_until": 0.0}
+
+    @contextmanager
+    def _locked(self):
+        if self.path is None:
+            yield self.state
+            return
+        with open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                state = json.loads(raw) if raw else dict(self.state)
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state, now):
+        elapsed = max(now - state["updated"], 0.0)
+        if self.rpm:
+            state["requests"] = min(float(self.rpm), state["requests"] + elapsed * self.rpm / 60)
+        if self.tpm:
+            state["tokens"] = min(float(self.tpm), state["tokens"] + elapsed * self.tpm / 60)
+        state["updated"] = now
+
+    def take(self, tokens):
+        """Списывает запрос и токены. 0 — можно отправлять, иначе сколько секунд подождать."""
+        with self._locked() as state:
+            now = time.time()
+            self._refill(state, now)
+            if state["paused_until"] > now:
+                return state["paused_until"] - now
+
+            # Запрос больше минутной квоты иначе ждал бы вечно
+            tokens = min(tokens, self.tpm) if self.tpm else 0
+            wait = 0.0
+            if self.rpm and state["requests"] < 1:
+                wait = (1 - state["requests"]) * 60 / self.rpm
+            if self.tpm and state["tokens"] < tokens:
+                wait = max(wait, (tokens - state["tokens"]) * 60 / self.tpm)
+            if wait > 0:
+                return wait
+
+            if self.rpm:
+                state["requests"] -= 1
+            state["tokens"] -= tokens
+            return 0.0
+
+    def adjust(self, delta):
+        """Сверка с настоящим usage: delta > 0 — потрачено больше оценки (долг), < 0 — возврат."""
+        if not self.tpm or not delta:
+            return
+        with self._locked() as state:
+            self._refill(state, time.time())
+            state["tokens"] -= delta
+
+    def pause(self, seconds):
+        with self._locked() as state:
+            state["paused_until"] = max(state["paused_until"], time.time() + seconds)
+
+
+class Slot:
+    """Выданное место: сколько токенов списано по оценке (сверяется при освобождении)."""
+
+    def __init__(self, estimate):
+        self.estimate = estimate
+        self.used = None
+        self.throttled = False
+
+
+class ProviderLimiter:
+    """
+    Лимитер одного провайдера. Очередь — куча (приоритет, номер): из нее выходит только голова,
+    поэтому фоновые вызовы не обгоняют реплики интервьюера. Потолок одновременных запросов
+    адаптивный: растет на 1/limit за каждый успех до max_concurrency, падает вдвое на 429.
+    """
+
+    def __init__(self, provider, rpm, tpm, max_concurrency, path=None):
+        self.provider = provider
+        self.buckets = Buckets(rpm, tpm, path) if (rpm or tpm) else None
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._async_waiters = []  # (loop, future) ожидающих async-вызовов
+        self.stats = {"granted": 0, "throttled": 0, "waited_ms": 0.0, "max_queue": 0}
+
+    def _wake(self):
+        """Будит всех ожидающих: sync через Condition, async через их future (вызывается под self._cond)."""
+        self._cond.notify_all()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+        self._async_waiters = []
+
+    def _enqueue(self, priority):
+        ticket = (priority, next(self._seq))
+        heapq.heappush(self._queue, ticket)
+        self.stats["max_queue"] = max(self.stats["max_queue"], len(self._queue))
+        return ticket
+
+    def _dequeue(self, ticket):
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._wake()
+
+    def _try_acquire(self, ticket, tokens):
+        """Под self._cond: 0 — место выдано, None — ждать освобождения, иначе — секунды ожидания."""
+        if self._queue[0] != ticket or self.in_flight >= max(int(self.limit), 1):
+            return None
+        if self.buckets is not None:
+            wait = self.buckets.take(tokens)
+            if wait > 0:
+                return wait
+        heapq.heappop(self._queue)
+        self.in_flight += 1
+        self.stats["granted"] += 1
+        # Следующий в очереди может пройти сразу, если есть место
+        self._wake()
+        return 0
+
+    @contextmanager
+    def slot(self, priority, tokens):
+        started = time.perf_counter()
+        with self._cond:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    wait = self._try_acquire(ticket, tokens)
+                    if wait == 0:
+                        break
+                    self._cond.wait(timeout=min(wait or MAX_SLEEP, MAX_SLEEP))
+            except BaseException:
+                self._dequeue(ticket)
+                raise
+            self.stats["waited_ms"] += (time.perf_counter() - started) * 1000
+
+        slot = Slot(tokens)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    @contextmanager
+    def _async_ticket(self, priority):
+        with self._cond:
+            ticket = self._enqueue(priority)
+        try:
+            yield ticket
+        except BaseException:
+            with self._cond:
+                self._dequeue(ticket)
+            raise
+
+    async def aacquire(self, priority, tokens):
+        """Async-ожидание места в очереди; отмена задачи снимает заявку из очереди."""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        with self._async_ticket(priority) as ticket:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire(ticket, tokens)
+                    if wait == 0:
+                        break
+                    waiter = (loop, loop.create_future())
+                    self._async_waiters.append(waiter)
+                try:
+                    await asyncio.wait({waiter[1]}, timeout=min(wait or MAX_SLEEP, MAX_SLEEP))
+                finally:
+                    with self._cond:
+                        if waiter in self._async_waiters:
+                            self._async_waiters.remove(waiter)
+        with self._cond:
+            self.stats["waited_ms"] += (time.perf_counter() - started) * 1000
+        return Slot(tokens)
+
+    def release(self, slot):
+        if self.buckets is not None and slot.used is not None:
+            self.buckets.adjust(slot.used - min(slot.estimate, self.buckets.tpm or slot.estimate))
+        with self._cond:
+            self.in_flight -= 1
+            if slot.throttled:
+                self.limit = max(self.limit / 2, 1.0)
+                self.stats["throttled"] += 1
+            else:
+                self.limit = min(self.limit + 1 / self.limit, float(self.max_concurrency))
+            self._wake()
+
+    def throttle(self, slot, error, attempt):
+        """Ответ 429: потолок вдвое, bucket на паузу по Retry-After (или экспоненциально с джиттером)."""
+        slot.throttled = True
+        pause = retry_after(error) or THROTTLE_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+        if self.buckets is not None:
+            self.buckets.pause(pause)
+        return pause
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                **self.stats,
+                "waited_ms": round(self.stats["waited_ms"], 1),
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": len(self._queue)
+            }
+
+
+def get_limiter(provider, max_concurrency):
+    """Лимитер провайдера (один на процесс)."""
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                rpm, tpm = DEFAULT_LIMITS.get(provider, (0, 0))
+                rpm = int(os.getenv(f"LLM_RPM_{provider.upper()}", rpm))
+                tpm = int(os.getenv(f"LLM_TPM_{provider.upper()}", tpm))
+                path = None
+                shared_dir = os.getenv("LLM_RATELIMIT_DIR")
+                if shared_dir and fcntl is not None:
+                    os.makedirs(shared_dir, exist_ok=True)
+                    path = os.path.join(shared_dir, f"{provider}.json")
+                elif shared_dir:
+                    print("Warning: LLM_RATELIMIT_DIR requires fcntl, using per-process rate limits.")
+                limiter = ProviderLimiter(provider, rpm, tpm, max_concurrency, path)
+                _limiters[provider] = limiter
+    return limiter
+
+
+def _outlasts(pause, deadline):
+    """Пауза после 429 не укладывается в дедлайн узла: ответ все равно никто не дождется."""
+    return deadline is not None and pause >= deadline - time.time()
+
+
+def run_limited(limiter, node, tokens, record, func, deadline=None):
+    """
+    Вызов func() под лимитером. На 429 запрос снова встает в очередь (с тем же приоритетом)
+    до RATE_LIMIT_RETRIES раз, вместо того чтобы узел подставлял заглушку. Если пауза дольше
+    оставшегося до deadline времени, 429 пробрасывается: роутер к тому моменту уже бросит вызов,
+    а повтор только потратит квоту.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        with limiter.slot(priority_for(node), tokens) as slot:
+            try:
+                result = func()
+                slot.used = record.prompt_tokens + record.completion_tokens or None
+                return result
+            except Exception as e:
+                if not is_rate_limit(e) or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                pause = limiter.throttle(slot, e, attempt)
+                if _outlasts(pause, deadline):
+                    raise
+        record.retries += 1
+        print(f"⏳ Rate limit {limiter.provider} ({node}), retry in {pause:.1f}s")
+        time.sleep(pause)
+
+
+async def arun_limited(limiter, node, tokens, record, afunc, deadline=None):
+    """Async-версия run_limited."""
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        slot = await limiter.aacquire(priority_for(node), tokens)
+        try:
+            result = await afunc()
+            slot.used = record.prompt_tokens + record.completion_tokens or None
+            return result
+        except Exception as e:
+            if not is_rate_limit(e) or attempt == RATE_LIMIT_RETRIES:
+                raise
+            pause = limiter.throttle(slot, e, attempt)
+            if _outlasts(pause, deadline):
+                raise
+        finally:
+            limiter.release(slot)
+        record.retries += 1
+        print(f"⏳ Rate limit {limiter.provider} ({node}), retry in {pause:.1f}s")
+        await asyncio.sleep(pause)
+
+
+def get_ratelimit_stats():
+    return {provider: limiter.snapshot() for provider, limiter in _limiters.items()}
@@ -0,0 +1,254 @@
+import os
+import time
+import queue
+import threading
+import contextvars
+from tenacity import Retrying, AsyncRetrying, retry_if_exception, wait_random_exponential
+from langgraph.config import get_config
+
+from utils.metrics import registry
+
+# Бюджет времени хода и устойчивость вызовов LLM.
+# Ход кандидата получает общий бюджет (TURN_BUDGET_MS), который делится между узлами:
+# каждому узлу достается все оставшееся время минус доли узлов, которые идут после него,
+# так что недоиспользованное время переходит дальше, а интервьюеру всегда остается его доля.
+# Внутри бюджета узла вызов повторяется с джиттером (tenacity) при временных ошибках,
+# а провайдер с серией ошибок отключается автоматом (CircuitBreaker) до паузы восстановления.
+
+TURN_BUDGET = float(os.getenv("TURN_BUDGET_MS", "20000")) / 1000
+# Доли бюджета узлов, отвечающих кандидату в пределах хода (фоновая оценка и отчет — вне бюджета хода)
+BUDGET_SHARES = {"observer": 0.25, "expert": 0.30, "analyst": 0.55, "interviewer": 0.45, "analyst_single": 1.0}
+# Какие узлы хода идут после данного (их доли резервируются)
+LATER_NODES = {"observer": ("expert", "interviewer"), "expert": ("interviewer",), "analyst": ("interviewer",)}
+# Меньше этого у узла — узел пропускается (Observer/Expert) или не стоит начинать новую попытку
+MIN_NODE_SECONDS = float(os.getenv("TURN_MIN_NODE_MS", "800")) / 1000
+# Реплике кандидату время дается всегда, даже если бюджет хода уже исчерпан
+MIN_REPLY_SECONDS = float(os.getenv("TURN_MIN_REPLY_MS", "3000")) / 1000
+REPLY_NODES = ("interviewer", "analyst_single")
+
+# Таймаут HTTP-запроса к провайдеру (страховка для вызовов вне бюджета хода: фоновая оценка, отчет)
+REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT_MS", "60000")) / 1000
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+# Временные ошибки: сеть, таймауты, 5xx, 429 после очереди лимитера
+TRANSIENT_ERRORS = {
+    "APIConnectionError", "APITimeoutError", "InternalServerError", "ServiceUnavailableError",
+    "RateLimitError", "ConnectError", "ConnectTimeout", "ReadTimeout", "ReadError",
+    "RemoteProtocolError", "PoolTimeout", "ConnectionError"
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Бюджет узла исчерпан до ответа провайдера."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Все провайдеры отключены автоматом — запрос даже не отправлялся."""
+
+
+def is_transient(error):
+    if isinstance(error, (DeadlineExceeded, CircuitOpenError)):
+        return False
+    if type(error).__name__ in TRANSIENT_ERRORS:
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and (status >= 500 or status in (408, 429))
+
+
+class CircuitBreaker:
+    """
+    closed — запросы идут; BREAKER_FAILURES ошибок провайдера подряд -> open (провайдер пропускается);
+    через BREAKER_OPEN_SECONDS -> half_open: пропускается один пробный запрос (claim), его исход решает,
+    закрыться или снова открыться. Пробный запрос без исхода (брошен по дедлайну хода) через
+    BREAKER_OPEN_SECONDS уступает место следующему.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probe_at = None
+        self.opens = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < BREAKER_OPEN_SECONDS:
+                return "open"
+            return "half_open"
+
+    def _probing(self):
+        return self.probe_at is not None and time.monotonic() - self.probe_at < BREAKER_OPEN_SECONDS
+
+    def allows(self):
+        """Можно ли отправить запрос (без захвата пробы): закрыт или полуоткрыт без пробы в пути."""
+        state = self.state
+        with self._lock:
+            return state == "closed" or (state == "half_open" and not self._probing())
+
+    def claim(self):
+        """Разрешение на запрос; в half_open первый вызвавший получает пробу, остальные — отказ."""
+        state = self.state
+        with self._lock:
+            if state == "closed":
+                return True
+            if state == "open" or self._probing():
+                return False
+            self.probe_at = time.monotonic()
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            self.probe_at = None
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            half_open = self.opened_at is not None
+            if half_open or self.failures >= BREAKER_FAILURES:
+                self.opened_at = time.monotonic()
+                self.opens += 1
+
+    def snapshot(self):
+        state = self.state
+        with self._lock:
+            return {"state": state, "consecutive_failures": self.failures, "opens": self.opens}
+
+
+# --- БЮДЖЕТ ХОДА ---
+
+def with_turn_deadline(config):
+    """
+    Config графа с дедлайном хода (configurable.turn_deadline), TURN_BUDGET_MS=0 — без бюджета.
+    Уже выставленный дедлайн не сдвигается: ход, поставленный в очередь, отсчитывается от постановки.
+    """
+    if TURN_BUDGET <= 0 or "turn_deadline" in config.get("configurable", {}):
+        return config
+    return {**config, "configurable": {**config.get("configurable", {}), "turn_deadline": time.time() + TURN_BUDGET}}
+
+
+def turn_deadline():
+    """Дедлайн текущего хода из config графа или None (вне графа, фоновые задачи)."""
+    try:
+        return get_config().get("configurable", {}).get("turn_deadline")
+    except RuntimeError:
+        return None
+
+
+def node_deadline(node):
+    """Абсолютный дедлайн (time.time()) вызова узла или None, если узел вне бюджета хода."""
+    turn = turn_deadline()
+    now = time.time()
+    if turn is None or node not in BUDGET_SHARES:
+        return None
+    reserved = sum(BUDGET_SHARES[later] for later in LATER_NODES.get(node, ())) * TURN_BUDGET
+    deadline = turn - reserved
+    if node in REPLY_NODES:
+        deadline = max(deadline, now + MIN_REPLY_SECONDS)
+    return deadline
+
+
+def remaining(deadline):
+    return deadline - time.time() if deadline is not None else float("inf")
+
+
+def budget_exhausted(node):
+    """Времени на узел меньше MIN_NODE_SECONDS — Observer/Expert пропускаются, чтобы успеть ответить."""
+    if remaining(node_deadline(node)) >= MIN_NODE_SECONDS:
+        return False
+    print(f"⏱️ {node}: бюджет хода исчерпан, узел пропущен")
+    registry.inc("interview_degraded_total", node=node, reason="budget")
+    return True
+
+
+def degraded(node, error):
+    """Учет узла, отработавшего без LLM из-за дедлайна или отключенных провайдеров."""
+    reason = "deadline" if isinstance(error, DeadlineExceeded) else "circuit"
+    print(f"⏱️ {node}: {error}, узел отработал без LLM")
+    registry.inc("interview_degraded_total", node=node, reason=reason)
+
+
+def fell_back(node):
+    """Учет узла, подставившего заготовку вместо ответа LLM после ошибки (не дедлайна)."""
+    registry.inc("interview_fallback_total", node=node)
+
+
+# --- ПОВТОРЫ ---
+
+def _retrying(cls, node, deadline):
+    base_wait = wait_random_exponential(multiplier=0.25, max=4)
+
+    def stop(retry_state):
+        return retry_state.attempt_number >= MAX_ATTEMPTS or remaining(deadline) < MIN_NODE_SECONDS
+
+    def wait(retry_state):
+        # Пауза не съедает время, нужное на саму попытку
+        return max(min(base_wait(retry_state), remaining(deadline) - MIN_NODE_SECONDS), 0)
+
+    def before_sleep(retry_state):
+        error = retry_state.outcome.exception()
+        print(f"🔁 {node}: {type(error).__name__}, повтор #{retry_state.attempt_number}")
+        registry.inc("interview_llm_retries_total", node=node)
+
+    return cls(stop=stop, wait=wait, retry=retry_if_exception(is_transient), before_sleep=before_sleep, reraise=True)
+
+
+def call_with_retries(node, deadline, func):
+    """func(attempt_number) с повторами при временных ошибках, пока хватает бюджета."""
+    for attempt in _retrying(Retrying, node, deadline):
+        with attempt:
+            return func(attempt.retry_state.attempt_number)
+
+
+async def acall_with_retries(node, deadline, afunc):
+    async for attempt in _retrying(AsyncRetrying, node, deadline):
+        with attempt:
+            return await afunc(attempt.retry_state.attempt_number)
+
+
+def iterate_with_deadline(iterator_factory, deadline):
+    """
+    Sync-поток кусков с дедлайном: поток читается в отдельном потоке, а здесь каждый кусок
+    ждется не дольше оставшегося времени. По дедлайну — DeadlineExceeded, чтение обрывается
+    на следующем куске.
+    """
+    chunks = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        iterator = iterator_factory()
+        try:
+            for chunk in iterator:
+                if stop.is_set():
+                    break
+                chunks.put(chunk)
+            chunks.put(done)
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item = chunks.get(timeout=max(remaining(deadline), 0))
+            except queue.Empty:
+                raise DeadlineExceeded("stream deadline exceeded")
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
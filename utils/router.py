@@ -0,0 +1,387 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, is_transient, remaining
+
+# Маршрутизация вызовов LLM между провайдерами.
+# По каждому провайдеру копится скользящее окно задержек (до первого токена) и ошибок.
+# Если основной провайдер не начал отвечать за p95 своей задержки, тот же запрос уходит
+# дублем (hedge) ко второму; побеждает первый ответ, проигравший отменяется.
+# Маршрут узла задается весами: LLM_ROUTE_INTERVIEWER=groq:3,openai:1, LLM_ROUTE_FEEDBACK=openai/gpt-4o.
+# Провайдер с серией временных ошибок отключается автоматом (utils.resilience.CircuitBreaker).
+# Дедлайн вызова (бюджет хода) соблюдается здесь же: по нему незавершенные попытки бросаются.
+# Сам вызов передается снаружи (utils.llm).
+
+WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "200"))
+MIN_SAMPLES = int(os.getenv("LLM_ROUTER_MIN_SAMPLES", "5"))
+MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))
+# Через сколько секунд после последней ошибки провайдер снова получает запросы
+RECOVERY_SECONDS = float(os.getenv("LLM_ROUTER_RECOVERY_SECONDS", "30"))
+
+HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "300"))
+# Порог, пока по провайдеру мало замеров
+HEDGE_DEFAULT_MS = float(os.getenv("LLM_HEDGE_DEFAULT_MS", "5000"))
+HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "64"))
+# Как часто проверять, не пора ли отправить дубль
+POLL_SECONDS = 0.02
+
+
+class ProviderStats:
+    """Скользящее окно задержек и исходов вызовов одного провайдера."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=WINDOW)
+        self.outcomes = deque(maxlen=WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.last_error = None
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.outcomes.append(ok)
+            self.calls += 1
+            if not ok:
+                self.errors += 1
+                self.last_error = time.monotonic()
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def quantile(self, q):
+        """Квантиль задержки или None, если замеров меньше MIN_SAMPLES."""
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def error_rate(self):
+        """Доля ошибок в окне; после RECOVERY_SECONDS без ошибок провайдер пробуется снова."""
+        with self._lock:
+            if len(self.outcomes) < MIN_SAMPLES:
+                return 0.0
+            if self.last_error is not None and time.monotonic() - self.last_error > RECOVERY_SECONDS:
+                return 0.0
+            return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def snapshot(self):
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "error_rate": round(1 - sum(self.outcomes) / len(self.outcomes), 4) if self.outcomes else 0.0,
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers
+            }
+
+
+class Attempt:
+    """
+    Одна попытка вызова у конкретного (провайдер, модель).
+    record — CallRecord из utils.metrics, его выставляет функция вызова;
+    silent — дубль без callbacks графа, чтобы токены двух ответов не смешивались в UI.
+    """
+
+    def __init__(self, target, silent=False):
+        self.target = target
+        self.silent = silent
+        self.record = None
+        self.started = time.perf_counter()
+
+    @property
+    def provider(self):
+        return self.target[0]
+
+    @property
+    def streaming(self):
+        """Ответ уже пошел токенами — такую попытку не дублируем и не отменяем."""
+        return self.record is not None and self.record.first_token is not None
+
+    def latency(self):
+        if self.record is not None and self.record.first_token is not None:
+            return self.record.first_token - self.started
+        return time.perf_counter() - self.started
+
+
+def parse_route(spec, models):
+    """'groq:3,openai/gpt-4o:1' -> [((provider, model), weight), ...]"""
+    route = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        target, _, weight = item.partition(":")
+        provider, _, model = target.partition("/")
+        route.append(((provider, model or models.get(provider)), float(weight or 1)))
+    return route
+
+
+class Router:
+    def __init__(self, providers, models, hedging=True):
+        """providers — доступные провайдеры в порядке предпочтения, models — модель по умолчанию для каждого."""
+        self.providers = list(providers)
+        self.models = dict(models)
+        self.hedging = hedging
+        self.stats = {provider: ProviderStats() for provider in self.providers}
+        self.breakers = {provider: CircuitBreaker() for provider in self.providers}
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def healthy(self, provider):
+        return self.breakers[provider].allows() and self.stats[provider].error_rate() <= MAX_ERROR_RATE
+
+    def _ranked(self):
+        """
+        Провайдеры по порядку предпочтения, больные (доля ошибок выше порога) — в конец,
+        отключенные автоматом — не участвуют.
+        Если у следующего провайдера даже p95 лучше медианы текущего, он выходит вперед.
+        """
+        allowed = [p for p in self.providers if self.breakers[p].allows()]
+        if not allowed:
+            raise CircuitOpenError(f"all LLM providers are circuit-open: {', '.join(self.providers)}")
+        ranked = sorted(allowed, key=lambda p: not self.healthy(p))
+        if len(ranked) > 1 and self.healthy(ranked[1]):
+            first_p50 = self.stats[ranked[0]].quantile(0.5)
+            second_p95 = self.stats[ranked[1]].quantile(0.95)
+            if first_p50 is not None and second_p95 is not None and second_p95 < first_p50:
+                ranked[0], ranked[1] = ranked[1], ranked[0]
+        return ranked
+
+    def plan(self, node):
+        """(основная цель, запасная цель или None) для вызова узла."""
+        ranked = self._ranked()
+        route = [(target, weight) for target, weight in parse_route(os.getenv(f"LLM_ROUTE_{node.upper()}"), self.models)
+                 if target[0] in ranked and weight > 0]
+
+        if route:
+            candidates = [(target, weight) for target, weight in route if self.healthy(target[0])] or route
+            targets, weights = zip(*candidates)
+            primary = random.choices(targets, weights=weights)[0]
+        else:
+            primary = (ranked[0], self.models[ranked[0]])
+
+        if not self.breakers[primary[0]].claim():
+            # Пробу полуоткрытого провайдера уже забрал другой вызов — идем к следующему закрытому
+            closed = [p for p in ranked if p != primary[0] and self.breakers[p].state == "closed"]
+            if not closed:
+                raise CircuitOpenError(f"all LLM providers are circuit-open: {', '.join(self.providers)}")
+            primary = (closed[0], self.models[closed[0]])
+
+        # Дубль — к другому провайдеру: сначала из маршрута узла, потом по общему порядку.
+        # Полуоткрытый провайдер дублем не берется: его проба — только основной запрос
+        fallbacks = [target for target, _ in route] + [(p, self.models[p]) for p in ranked]
+        secondary = next((t for t in fallbacks if t[0] != primary[0] and self.breakers[t[0]].state == "closed"
+                          and self.healthy(t[0])), None)
+        return primary, secondary
+
+    def hedge_delay(self, provider):
+        """Сколько ждать первого токена основного провайдера перед отправкой дубля."""
+        if not self.hedging:
+            return None
+        fixed = os.getenv("LLM_HEDGE_AFTER_MS")
+        if fixed:
+            return float(fixed) / 1000
+        observed = self.stats[provider].quantile(HEDGE_QUANTILE)
+        delay = observed if observed is not None else HEDGE_DEFAULT_MS / 1000
+        return max(delay, HEDGE_MIN_MS / 1000)
+
+    def observe(self, attempt, ok, error=None):
+        """
+        Исход попытки: окно задержек/ошибок и автомат провайдера.
+        Автомат двигают только ошибки самого провайдера (сеть, таймаут SDK, 5xx, 429); дедлайн хода
+        задает вызывающий, о здоровье провайдера он ничего не говорит.
+        """
+        self.stats[attempt.provider].record(attempt.latency(), ok)
+        if ok or is_transient(error):
+            self.breakers[attempt.provider].record(ok)
+
+    def _abandon(self, attempt):
+        # Проигравший не успел ответить — его задержка не меньше прошедшего времени
+        self.stats[attempt.provider].record(attempt.latency(), True)
+
+    def _executor_for_hedges(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def _won(self, attempt, losers):
+        self.observe(attempt, True)
+        if attempt.silent:
+            self.stats[attempt.provider].count("hedge_wins")
+        for loser in losers:
+            self._abandon(loser)
+
+    def _expired(self, deadline, first, ttft_only):
+        """Дедлайн прошел; для реплики (ttft_only) — только если она еще не начала стримиться."""
+        return deadline is not None and remaining(deadline) <= 0 and not (ttft_only and first.streaming)
+
+    def _timeout(self, node, running):
+        for attempt in running:
+            self.observe(attempt, False, DeadlineExceeded())
+        print(f"⏱️ Router: {node} deadline exceeded")
+        return DeadlineExceeded(f"{node}: deadline exceeded")
+
+    def invoke(self, node, call, deadline=None, ttft_only=False):
+        """
+        Синхронный вызов call(attempt) с дублированием, переключением при ошибке и дедлайном
+        (time.time(); ttft_only — дедлайн только на первый токен, для реплик, которые стримятся кандидату).
+        Попытки выполняются в отдельных потоках; поток нельзя прервать, поэтому проигравший
+        (или брошенный по дедлайну) дорабатывает в фоне, а его ответ отбрасывается.
+        """
+        primary, secondary = self.plan(node)
+        delay = self.hedge_delay(primary[0]) if secondary else None
+        ttft_only = ttft_only and deadline is not None
+
+        if delay is None and deadline is None:
+            attempt = Attempt(primary)
+            try:
+                result = call(attempt)
+            except Exception as e:
+                self.observe(attempt, False, e)
+                if secondary is None:
+                    raise
+                self.stats[secondary[0]].count("failovers")
+                print(f"⚠️ Router: {primary[0]} error, failover to {secondary[0]}")
+                attempt = Attempt(secondary)
+                try:
+                    result = call(attempt)
+                except Exception as e:
+                    self.observe(attempt, False, e)
+                    raise
+            self.observe(attempt, True)
+            return result
+
+        executor = self._executor_for_hedges()
+
+        def submit(attempt):
+            return executor.submit(contextvars.copy_context().run, call, attempt)
+
+        first = Attempt(primary)
+        running = {submit(first): first}
+        hedge_at = first.started + delay if delay is not None else None
+        spare = secondary
+        error = None
+        while running:
+            done, _ = wait(running, timeout=min(POLL_SECONDS, max(remaining(deadline), 0)),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                attempt = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.observe(attempt, False, e)
+                    error = e
+                    continue
+                self._won(attempt, running.values())
+                return result
+
+            if self._expired(deadline, first, ttft_only):
+                raise self._timeout(node, running.values())
+            # Основной упал — сразу к запасному (уже не дубль: его токены можно показывать)
+            if not running and spare is not None:
+                self.stats[spare[0]].count("failovers")
+                print(f"⚠️ Router: {primary[0]} error, failover to {spare[0]}")
+                attempt = Attempt(spare)
+                running[submit(attempt)] = attempt
+                spare = None
+            # Основной молчит дольше p95 — отправляем дубль
+            elif (hedge_at is not None and spare is not None
+                  and time.perf_counter() >= hedge_at and not first.streaming):
+                self.stats[spare[0]].count("hedges")
+                attempt = Attempt(spare, silent=True)
+                running[submit(attempt)] = attempt
+                spare = None
+            # Основной начал отвечать после дубля — дубль больше не нужен
+            if first.streaming:
+                for future, attempt in list(running.items()):
+                    if attempt.silent:
+                        future.cancel()
+                        del running[future]
+                        self._abandon(attempt)
+                # Реплика пошла токенами — дедлайн первого токена выполнен
+                if ttft_only:
+                    deadline = None
+                    ttft_only = False
+        raise error
+
+    async def ainvoke(self, node, call, deadline=None, ttft_only=False):
+        """Async-версия invoke: проигравшая или просроченная попытка отменяется вместе с HTTP-запросом."""
+        primary, secondary = self.plan(node)
+        delay = self.hedge_delay(primary[0]) if secondary else None
+        ttft_only = ttft_only and deadline is not None
+
+        first = Attempt(primary)
+        running = {asyncio.ensure_future(call(first)): first}
+        hedge_at = first.started + delay if delay is not None else None
+        spare = secondary
+        error = None
+        try:
+            while running:
+                timeout = POLL_SECONDS if hedge_at is not None or ttft_only else None
+                if deadline is not None:
+                    timeout = min(timeout or float("inf"), max(remaining(deadline), 0))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    attempt = running.pop(task)
+                    if task.exception() is not None:
+                        self.observe(attempt, False, task.exception())
+                        error = task.exception()
+                        continue
+                    self._won(attempt, running.values())
+                    return task.result()
+
+                if self._expired(deadline, first, ttft_only):
+                    raise self._timeout(node, running.values())
+                if not running and spare is not None:
+                    self.stats[spare[0]].count("failovers")
+                    print(f"⚠️ Router: {primary[0]} error, failover to {spare[0]}")
+                    attempt = Attempt(spare)
+                    running[asyncio.ensure_future(call(attempt))] = attempt
+                    spare = None
+                elif (hedge_at is not None and spare is not None
+                      and time.perf_counter() >= hedge_at and not first.streaming):
+                    self.stats[spare[0]].count("hedges")
+                    attempt = Attempt(spare, silent=True)
+                    running[asyncio.ensure_future(call(attempt))] = attempt
+                    spare = None
+                if first.streaming:
+                    for task, attempt in list(running.items()):
+                        if attempt.silent:
+                            task.cancel()
+                            del running[task]
+                            self._abandon(attempt)
+                    # Реплика пошла токенами — дедлайн первого токена выполнен
+                    if ttft_only:
+                        deadline = None
+                        ttft_only = False
+            raise error
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    def snapshot(self):
+        return {
+            provider: {**stats.snapshot(), "breaker": self.breakers[provider].snapshot()}
+            for provider, stats in self.stats.items()
+        }
@@ -0,0 +1,51 @@
+from typing import Literal
+from pydantic import BaseModel, field_validator
+
+# Схемы JSON-ответов Observer и Expert. По ним строится response_format провайдера
+# (utils.structured) и валидируется ответ. Порядок полей = порядок генерации:
+# у Observer решающий флаг intent_to_leave идет первым, чтобы реагировать на него до конца ответа.
+
+
+class ObserverAnalysis(BaseModel):
+    intent_to_leave: bool = False
+    thoughts: str = ""
+    is_hallucination: bool = False
+    consistency_violation: bool = False
+    is_deep_dive: bool = False
+    is_role_reversal: bool = False
+    answer_quality: Literal["low", "medium", "high"] = "medium"
+
+    @field_validator("answer_quality", mode="before")
+    @classmethod
+    def _quality(cls, value):
+        return value if value in ("low", "medium", "high") else "medium"
+
+
+class ExpertPlan(BaseModel):
+    thoughts: str = ""
+    instruction: str
+    topic_name: str = "General"
+    difficulty_adjustment: Literal["easier", "same", "harder"] = "same"
+
+    @field_validator("difficulty_adjustment", mode="before")
+    @classmethod
+    def _difficulty(cls, value):
+        return value if value in ("easier", "same", "harder") else "same"
+
+
+def strict_schema(model):
+    """
+    JSON Schema для strict structured output OpenAI: все поля обязательны,
+    лишние запрещены, без default/title (их strict-режим не принимает).
+    """
+    def clean(node):
+        if isinstance(node, dict):
+            node = {k: clean(v) for k, v in node.items() if k not in ("default", "title")}
+            if node.get("type") == "object" and "properties" in node:
+                node["required"] = list(node["properties"])
+                node["additionalProperties"] = False
+        elif isinstance(node, list):
+            node = [clean(item) for item in node]
+        return node
+
+    return clean(model.model_json_schema())
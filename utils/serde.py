@@ -0,0 +1,41 @@
+import threading
+import zstandard
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+
+class CompactSerializer:
+    """
+    Сериализатор чекпоинтов: msgpack (через JsonPlusSerializer, ormsgpack) + сжатие zstd.
+    Маленькие значения не сжимаем — заголовок zstd их только раздует.
+    Совместим с данными обычного JsonPlusSerializer: несжатые типы читаются как есть.
+    """
+
+    SUFFIX = "+zstd"
+
+    def __init__(self, level=3, min_size=256):
+        self.inner = JsonPlusSerializer()
+        self.level = level
+        self.min_size = min_size
+        # Компрессоры zstd не потокобезопасны — держим по экземпляру на поток
+        self._local = threading.local()
+
+    def _codec(self):
+        codec = getattr(self._local, "codec", None)
+        if codec is None:
+            codec = (zstandard.ZstdCompressor(level=self.level), zstandard.ZstdDecompressor())
+            self._local.codec = codec
+        return codec
+
+    def dumps_typed(self, obj):
+        type_, data = self.inner.dumps_typed(obj)
+        if type_ in ("null", "empty") or len(data) < self.min_size:
+            return type_, data
+        compressor, _ = self._codec()
+        return type_ + self.SUFFIX, compressor.compress(data)
+
+    def loads_typed(self, data):
+        type_, payload = data
+        if type_.endswith(self.SUFFIX):
+            _, decompressor = self._codec()
+            return self.inner.loads_typed((type_[:-len(self.SUFFIX)], decompressor.decompress(payload)))
+        return self.inner.loads_typed(data)
@@ -2,9 +2,11 @@ import operator
 from typing import Annotated, List, TypedDict, Dict, Any, Optional
 from langchain_core.messages import BaseMessage
 
+from utils.context import window_messages
+
 class InterviewState(TypedDict):
-    # Сообщения накапливаются (это правильно)
-    messages: Annotated[List[BaseMessage], operator.add]
+    # Сообщения накапливаются, но в окне: старые ходы сворачиваются в сводку (utils.context)
+    messages: Annotated[List[BaseMessage], window_messages]
     
     candidate_info: Dict[str, str]
     
@@ -18,10 +20,18 @@ class InterviewState(TypedDict):
     # Теперь Observer будет создавать чистый лист, а Expert — дополнять его вручную.
     current_turn_thoughts: List[str]
     
+    # Замеры узлов текущего хода (utils.metrics); переносятся в запись internal_log
+    turn_metrics: List[Dict[str, Any]]
+
     # Итоговый лог накапливается
     internal_log: Annotated[List[Dict[str, Any]], operator.add]
     last_bot_msg: str
     
+    # Оценки ходов из фонового грейдера (agents.grader) накапливаются
+    turn_grades: Annotated[List[Dict[str, Any]], operator.add]
+
     final_feedback: Optional[Dict[str, Any]]
+    # Замеры feedback_node (отдельно от turn_metrics: отчет может строиться параллельно с прощанием)
+    feedback_metrics: List[Dict[str, Any]]
     finished: bool
     
\ No newline at end of file
@@ -0,0 +1,190 @@
+import json
+import threading
+from collections import Counter, defaultdict
+from pydantic import ValidationError
+
+from utils.llm import invoke_chain, ainvoke_chain, stream_chain, astream_chain
+from utils.cache import cache_enabled_for
+from utils.metrics import registry
+from utils.resilience import node_deadline, call_with_retries, acall_with_retries
+
+# Структурированный вывод узлов: JSON mode / json_schema провайдера + валидация Pydantic.
+# Ответ читается потоком: PartialJSONParser отдает поля верхнего уровня по мере готовности,
+# и узел может закончить чтение раньше (stop_when), не дожидаясь хвоста ответа.
+
+
+class PartialJSONParser:
+    """
+    Инкрементальный разбор JSON-объекта: feed() принимает очередной кусок текста и
+    возвращает поля верхнего уровня, значения которых уже полностью пришли.
+    Текст до первой «{» (например, ```json) пропускается.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.started = False
+        self.done = False
+        self.in_string = False
+        self.escape = False
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.fields = {}
+
+    def _finish_value(self, end):
+        raw = self.text[self.value_start:end].strip()
+        try:
+            self.fields[self.key] = json.loads(raw)
+            completed = [(self.key, self.fields[self.key])]
+        except ValueError:
+            completed = []
+        self.key = None
+        self.value_start = None
+        return completed
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        while self.pos < len(self.text) and not self.done:
+            ch = self.text[self.pos]
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.depth = 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        try:
+                            self.key = json.loads(self.text[self.key_start:self.pos + 1])
+                        except ValueError:
+                            self.key = None
+                        self.key_start = None
+            elif ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None and self.value_start is None:
+                    self.key_start = self.pos
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    if self.value_start is not None:
+                        completed += self._finish_value(self.pos)
+                    self.done = True
+            elif self.depth == 1 and ch == ":" and self.key is not None and self.value_start is None:
+                self.value_start = self.pos + 1
+            elif self.depth == 1 and ch == "," and self.value_start is not None:
+                completed += self._finish_value(self.pos)
+            self.pos += 1
+        return completed
+
+
+# --- СЧЕТЧИКИ РАЗБОРА ---
+_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+
+
+def count_parse(node, result):
+    with _stats_lock:
+        _stats[node][result] += 1
+    registry.inc("interview_parse_total", node=node, result=result)
+
+
+def get_parse_stats():
+    """По узлам: ok / early (остановились на нужных полях) / repaired / failed и доля отказов."""
+    with _stats_lock:
+        stats = {}
+        for node, counter in _stats.items():
+            total = sum(counter.values())
+            stats[node] = {**counter, "failure_rate": round(counter["failed"] / total, 4) if total else 0.0}
+        return stats
+
+
+def extract_object(raw):
+    """Чистка «по-старому»: убрать ```json и взять текст от первой { до последней }."""
+    cleaned = raw.replace("```json", "").replace("```", "").strip()
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    return cleaned[start:end + 1] if start != -1 and end > start else cleaned
+
+
+def parse_structured(node, raw, schema):
+    """Валидирует полный ответ по схеме. Возвращает dict или None (узел возьмет свой fallback)."""
+    print(f"🔧 {node.capitalize()} Raw Output: {raw[:100]}...")
+    try:
+        result = schema.model_validate_json(raw.strip()).model_dump()
+        count_parse(node, "ok")
+        return result
+    except (ValidationError, ValueError):
+        pass
+
+    try:
+        result = schema.model_validate_json(extract_object(raw)).model_dump()
+        count_parse(node, "repaired")
+        return result
+    except (ValidationError, ValueError) as e:
+        print(f"❌ {node.capitalize()} JSON Error: {e}")
+        count_parse(node, "failed")
+        return None
+
+
+def _early(node, fields, schema):
+    try:
+        result = schema.model_validate(fields).model_dump()
+    except ValidationError:
+        return None
+    count_parse(node, "early")
+    return result
+
+
+def invoke_structured(node, prompt, inputs, schema, stop_when=None):
+    """
+    Вызов узла со структурированным выводом.
+    stop_when(fields) — условие по уже пришедшим полям, при котором чтение ответа прекращается
+    (поток закрывается, запрос к провайдеру отменяется). Недостающие поля берутся из схемы.
+    С кэшем ответов поток не используется: кэш хранит только полные ответы.
+    Поток при временной ошибке перечитывается заново в пределах бюджета узла.
+    """
+    if stop_when is None or cache_enabled_for(node):
+        return parse_structured(node, invoke_chain(node, prompt, inputs, schema=schema), schema)
+
+    def run(attempt_number):
+        parser = PartialJSONParser()
+        stream = stream_chain(node, prompt, inputs, schema=schema)
+        try:
+            for chunk in stream:
+                if parser.feed(chunk) and stop_when(parser.fields):
+                    result = _early(node, parser.fields, schema)
+                    if result is not None:
+                        return result
+        finally:
+            stream.close()
+        return parse_structured(node, parser.text, schema)
+
+    return call_with_retries(node, node_deadline(node), run)
+
+
+async def ainvoke_structured(node, prompt, inputs, schema, stop_when=None):
+    if stop_when is None or cache_enabled_for(node):
+        return parse_structured(node, await ainvoke_chain(node, prompt, inputs, schema=schema), schema)
+
+    async def run(attempt_number):
+        parser = PartialJSONParser()
+        stream = astream_chain(node, prompt, inputs, schema=schema)
+        try:
+            async for chunk in stream:
+                if parser.feed(chunk) and stop_when(parser.fields):
+                    result = _early(node, parser.fields, schema)
+                    if result is not None:
+                        return result
+        finally:
+            await stream.aclose()
+        return parse_structured(node, parser.text, schema)
+
+    return await acall_with_retries(node, node_deadline(node), run)
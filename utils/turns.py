@@ -0,0 +1,126 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.resilience import with_turn_deadline
+
+# Фоновое выполнение ходов для веб-интерфейса: поток сервера (Streamlit) не держится весь ход,
+# а только ставит ход в пул и периодически забирает накопленные мысли и токены.
+# Пул ограничен: воркеров TURN_WORKERS, ходов в работе и в очереди — не больше TURN_MAX_PENDING.
+
+
+class PoolBusy(RuntimeError):
+    """Очередь ходов заполнена — ход не принят, кандидату стоит повторить позже."""
+
+
+class TurnJob:
+    """Ход в работе: события stream_turn копятся здесь, UI читает снимок через snapshot()."""
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.thoughts = []
+        self.reply = ""
+        self.result = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def push(self, kind, payload):
+        with self._lock:
+            if kind == "thought":
+                self.thoughts.append(payload)
+            elif kind == "token":
+                self.reply += payload
+            else:
+                self.result = payload
+
+    def finish(self, error=None):
+        with self._lock:
+            self.error = error
+            self.finished_at = time.time()
+        self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "thoughts": list(self.thoughts),
+                "reply": self.reply,
+                "result": self.result,
+                "error": self.error,
+                "queued": self.started_at is None,
+                "done": self._done.is_set()
+            }
+
+
+class TurnPool:
+    """
+    Общий на процесс пул ходов поверх одного скомпилированного графа.
+    run_turn(inputs, config) — генератор событий хода (main.stream_turn с привязанным графом).
+    """
+
+    def __init__(self, run_turn, workers=None, max_pending=None):
+        self.run_turn = run_turn
+        self.workers = workers or int(os.getenv("TURN_WORKERS", "8"))
+        self.max_pending = max_pending or int(os.getenv("TURN_MAX_PENDING", "64"))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="turn")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_wait_s = 0.0
+
+    def submit(self, thread_id, inputs):
+        """Ставит ход в очередь; бюджет хода отсчитывается с момента ответа кандидата, включая очередь."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PoolBusy(f"turn queue is full ({self.max_pending})")
+            self.pending += 1
+
+        job = TurnJob(thread_id)
+        config = with_turn_deadline({"configurable": {"thread_id": thread_id}})
+        self.executor.submit(self._run, job, inputs, config)
+        return job
+
+    def _run(self, job, inputs, config):
+        job.started_at = time.time()
+        error = None
+        try:
+            for kind, payload in self.run_turn(inputs, config):
+                job.push(kind, payload)
+        except Exception as e:
+            print(f"❌ Turn Error ({job.thread_id}): {e}")
+            error = str(e)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.queue_wait_s += job.started_at - job.submitted_at
+                if error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            job.finish(error)
+
+    def stats(self):
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_queue_wait_s": round(self.queue_wait_s / finished, 3) if finished else 0.0
+            }
@@ -0,0 +1,110 @@
+"""
+Предгенерация банка вступлений (utils.openers): для каждой комбинации роль × грейд × стек
+один раз выполняются Expert и Интервьюер первого хода, пара (план, реплика) сохраняется в банк.
+После этого интервью с такой комбинацией начинается без вызова LLM.
+
+Запуск:
+    python warm_openers.py --role "Backend Developer" --role "C++ Developer" \\
+        --level Junior --level Middle --level Senior \\
+        --stack "Python, Django, Postgres" --stack "C++, Postgres"
+    python warm_openers.py --matrix openers_matrix.json   # {"roles": [...], "levels": [...], "stacks": [...]}
+    python warm_openers.py --list
+"""
+import json
+import asyncio
+import argparse
+import itertools
+
+from main import initial_state
+from agents.observer import skip_analysis
+from agents.expert import aexpert_node
+from agents.interviewer import PROMPT, OPENING_VERSION, interviewer_inputs, bankable
+from utils.llm import ainvoke_chain, get_router_stats
+from utils.openers import get_opening_bank
+
+DEFAULT_LEVELS = ["Junior", "Middle", "Senior"]
+
+
+async def generate_opening(candidate_info):
+    """Первый ход без графа: заглушка Observer на старте, Expert -> Интервьюер (реплика не стримится)."""
+    state = initial_state(candidate_info)
+    state.update(skip_analysis(state))
+    state.update(await aexpert_node(state))
+    reply = await ainvoke_chain("interviewer", PROMPT, interviewer_inputs(state))
+    return state['expert_plan'], reply
+
+
+async def warm(combinations, variants, concurrency):
+    bank = get_opening_bank()
+    semaphore = asyncio.Semaphore(concurrency)
+    report = {"generated": 0, "skipped": 0, "failed": 0}
+
+    async def one(candidate_info):
+        async with semaphore:
+            missing = variants - bank.count(candidate_info, OPENING_VERSION)
+            if missing <= 0:
+                report["skipped"] += 1
+                return
+            for _ in range(missing):
+                try:
+                    expert_plan, reply = await generate_opening(candidate_info)
+                except Exception as e:
+                    print(f"❌ {candidate_info}: {e}")
+                    expert_plan, reply = {}, ""
+                if not bankable(expert_plan, reply):
+                    report["failed"] += 1
+                    continue
+                if bank.add(candidate_info, OPENING_VERSION, expert_plan, reply):
+                    report["generated"] += 1
+                    print(f"✅ {candidate_info['role']} / {candidate_info['level']} / {candidate_info['stack']}: {reply[:80]}")
+
+    await asyncio.gather(*(one(info) for info in combinations))
+    return report
+
+
+def load_matrix(args):
+    roles, levels, stacks = list(args.role or []), list(args.level or []), list(args.stack or [])
+    if args.matrix:
+        with open(args.matrix, encoding="utf-8") as f:
+            matrix = json.load(f)
+        roles += matrix.get("roles", [])
+        levels += matrix.get("levels", [])
+        stacks += matrix.get("stacks", [])
+    return roles, levels or DEFAULT_LEVELS, stacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--role", action="append", help="Позиция (можно несколько раз)")
+    parser.add_argument("--level", action="append", help=f"Грейд (по умолчанию {', '.join(DEFAULT_LEVELS)})")
+    parser.add_argument("--stack", action="append", help="Стек через запятую (можно несколько раз)")
+    parser.add_argument("--matrix", help="JSON с ключами roles / levels / stacks")
+    parser.add_argument("--variants", type=int, default=None, help="Вариантов на комбинацию (OPENING_BANK_VARIANTS)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--list", action="store_true", help="Показать комбинации в банке и выйти")
+    args = parser.parse_args()
+
+    bank = get_opening_bank()
+    if args.list:
+        for role, level, stack, count in bank.combinations():
+            print(f"{role} / {level} / {stack}: {count}")
+        return
+
+    roles, levels, stacks = load_matrix(args)
+    if not roles or not stacks:
+        parser.error("нужны хотя бы одна позиция (--role) и один стек (--stack) или --matrix")
+
+    if args.variants is not None:
+        bank.variants = args.variants
+    combinations = [
+        {"name": "Candidate", "role": role, "level": level, "stack": stack}
+        for role, level, stack in itertools.product(roles, levels, stacks)
+    ]
+    print(f"🔥 Комбинаций: {len(combinations)}, вариантов на каждую: {bank.variants}, версия промптов: {OPENING_VERSION}")
+
+    report = asyncio.run(warm(combinations, bank.variants, args.concurrency))
+    print(json.dumps({**report, "bank": bank.stats(), "providers": get_router_stats()}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()